@@ -0,0 +1,125 @@
+import threading
+import time
+
+import numpy as np
+
+# オーディオコールバックと解析スレッドの間でブロックを受け渡すリングバッファ
+# 書き込みはコールバックスレッドのみ、読み込みは解析スレッドのみが行う(単一生産者・単一消費者)
+# そのためロックを使わずにインデックスの更新だけで受け渡しができる
+class BlockRingBuffer:
+    def __init__(self, block_size, capacity=64, dtype=np.float32):
+        self.block_size = block_size
+        self.capacity = capacity
+        # ブロックとキャプチャ時刻を格納する領域を事前に確保しておく
+        self.blocks = np.zeros((capacity, block_size), dtype=dtype)
+        self.frames = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        # 書き込み位置と読み込み位置(単調増加するカウンタ)
+        self.write_index = 0
+        self.read_index = 0
+        # 解析が追いつかずに捨てたブロック数
+        self.dropped = 0
+        self.max_depth = 0
+        # 解析スレッドを起こすためのイベント
+        self.data_ready = threading.Event()
+
+    # 溜まっているブロック数
+    def depth(self):
+        return self.write_index - self.read_index
+
+    # コールバックスレッドから呼ぶ: ブロックをコピーして積む(満杯なら捨てる)
+    def push(self, block, timestamp):
+        depth = self.write_index - self.read_index
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+
+        slot = self.write_index % self.capacity
+        frames = min(len(block), self.block_size)
+        self.blocks[slot, :frames] = block[:frames]
+        self.frames[slot] = frames
+        self.timestamps[slot] = timestamp
+        # データを書き終えてから書き込み位置を進める
+        self.write_index += 1
+
+        if depth + 1 > self.max_depth:
+            self.max_depth = depth + 1
+        self.data_ready.set()
+        return True
+
+    # 解析スレッドから呼ぶ: 一番古いブロックを取り出す(空ならNone)
+    def pop(self):
+        if self.read_index == self.write_index:
+            return None
+
+        slot = self.read_index % self.capacity
+        frames = self.frames[slot]
+        # 次の書き込みで上書きされないようにコピーしてから読み込み位置を進める
+        block = self.blocks[slot, :frames].copy()
+        timestamp = self.timestamps[slot]
+        self.read_index += 1
+        return block, timestamp
+
+
+# リングバッファからブロックを取り出して音階認識を行う解析スレッド
+# process_block(audio_data, timestamp) の戻り値を音階として on_note(note, timestamp) に渡す
+class AnalysisWorker(threading.Thread):
+    def __init__(self, ring_buffer, process_block, on_note=None, poll_interval=0.1):
+        super().__init__(daemon=True)
+        self.ring_buffer = ring_buffer
+        self.process_block = process_block
+        self.on_note = on_note
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.errors = 0  # process_block (または on_note) が例外を投げたブロック数
+        self.stopping = threading.Event()
+
+    def run(self):
+        while True:
+            item = self.ring_buffer.pop()
+            if item is None:
+                # 停止要求があり、バッファも空なら終了する
+                if self.stopping.is_set():
+                    break
+                self.ring_buffer.data_ready.wait(self.poll_interval)
+                self.ring_buffer.data_ready.clear()
+                continue
+
+            audio_data, timestamp = item
+            try:
+                note = self.process_block(audio_data, timestamp)
+                self.processed += 1
+                if self.on_note is not None:
+                    self.on_note(note, timestamp)
+            except Exception as e:
+                # 1つのブロックの失敗でスレッドが止まると、以降のブロックがすべて捨てられるので、記録して次に進む
+                self.errors += 1
+                print(f"ブロックの処理に失敗しました: {e}")
+
+    # 残っているブロックを処理しきってからスレッドを止める
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.ring_buffer.data_ready.set()
+        self.join(timeout)
+
+    # キューの深さや取りこぼしの数を返す
+    def stats(self):
+        return {
+            "queue_depth": self.ring_buffer.depth(),
+            "max_queue_depth": self.ring_buffer.max_depth,
+            "dropped": self.ring_buffer.dropped,
+            "processed": self.processed,
+            "errors": self.errors,
+        }
+
+
+# コールバックに渡される time からキャプチャ時刻を time.monotonic() の時計で取り出す
+# PortAudio の inputBufferAdcTime はストリームの時計なので、currentTime との差(ブロックが届くまでの遅れ)を
+# 今の time.monotonic() から引いて、模擬Unityや計測と同じ時計にそろえる(取れなければ現在時刻)
+def capture_timestamp(time_info):
+    now = time.monotonic()
+    adc_time = getattr(time_info, "inputBufferAdcTime", 0.0)
+    current_time = getattr(time_info, "currentTime", 0.0)
+    if not adc_time or not current_time:
+        return now
+    return now - max(0.0, current_time - adc_time)
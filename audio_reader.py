@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+from feature_cache import FEATURE_CACHE_DIR, FeatureCache, audio_hash
+from ingest import StreamingResampler
+
+# 長い録音をメモリに全部読み込まずに処理するためのオフラインの読み込み
+# 音声ファイルは soundfile.blocks で少しずつデコード・リサンプリングして、モノラル float32 の生データとしてキャッシュに書き出し、
+# 以降は np.memmap で開いて、ブロックはコピーせずにビューとして返す
+# (キャッシュは音声ファイルの内容のハッシュとサンプリングレートで管理するので、同じ録音を何度解析してもデコードは1回だけ)
+# キャッシュの場所と容量は feature_cache の特徴量と共通で、合計が上限を超えたら使っていないものから消す
+
+AUDIO_CACHE_DIR = FEATURE_CACHE_DIR
+READ_BLOCK_SIZE = 65536  # デコードするときに1回に読むフレーム数
+
+# 音声ファイルを少しずつデコード・リサンプリングしてキャッシュに書き出す
+def decode_to_cache(path, sr, cache_path, block_size=READ_BLOCK_SIZE):
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"  # 別のプロセスが同じ録音をデコードしていてもぶつからない
+    try:
+        with sf.SoundFile(path) as f, open(temporary_path, "wb") as out:
+            resampler = StreamingResampler(f.samplerate, sr) if f.samplerate != sr else None
+            for block in f.blocks(blocksize=block_size, dtype="float32", always_2d=True):
+                samples = block.mean(axis=1)  # モノラルにする
+                if resampler is not None:
+                    samples = resampler.process(samples)
+                out.write(samples.astype("<f4").tobytes())
+            if resampler is not None:
+                out.write(resampler.process(np.zeros(0, dtype=np.float32), last=True).astype("<f4").tobytes())
+    except sf.LibsndfileError:
+        # soundfile で読めない形式(m4a など)は librosa で一度だけ全体を読み込む
+        import librosa
+        print(f"{os.path.basename(path)} は soundfile で読めないため、librosa で読み込みます")
+        audio_data, _ = librosa.load(path, sr=sr)
+        audio_data.astype("<f4").tofile(temporary_path)
+    os.replace(temporary_path, cache_path)
+
+
+class AudioReader:
+    # cache: デコードした音声を置く FeatureCache(省略時は cache_dir に既定の容量で作る)
+    def __init__(self, path, sr=22050, cache_dir=AUDIO_CACHE_DIR, cache=None):
+        self.path = path
+        self.sr = sr
+        self.cache = cache or FeatureCache(cache_dir)
+        self.content_hash = audio_hash(path)
+        self.cache_path = os.path.join(self.cache.cache_dir, f"{self.content_hash}_{sr}.f32")
+        self.audio = self.open_cache()
+
+    # キャッシュのデコード済みの音声を開く(なければデコードする)
+    # 確かめてから開くまでの間に別のプロセスの evict() で消されたら、キャッシュになかったものとしてデコードし直す
+    def open_cache(self, attempts=3):
+        for attempt in range(attempts):
+            if os.path.exists(self.cache_path):
+                self.cache.touch(self.cache_path)
+            else:
+                decode_to_cache(self.path, self.sr, self.cache_path)
+                self.cache.evict(keep=(self.cache_path,))
+            try:
+                if os.path.getsize(self.cache_path) == 0:
+                    return np.zeros(0, dtype=np.float32)
+                return np.memmap(self.cache_path, dtype="<f4", mode="r")
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+    def __len__(self):
+        return len(self.audio)
+
+    # 録音の秒数
+    @property
+    def duration(self):
+        return len(self.audio) / self.sr
+
+    # block_size サンプルずつのビューを順番に返す(最後のブロックは短いことがある)
+    def blocks(self, block_size, start=0, stop=None):
+        stop = len(self.audio) if stop is None else min(stop, len(self.audio))
+        for start_index in range(start, stop, block_size):
+            yield self.audio[start_index:min(start_index + block_size, stop)]
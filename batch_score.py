@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from audio_reader import AudioReader
+from feature_cache import FEATURE_CACHE_MAX_BYTES, FeatureCache
+from offline import transcribe_reader
+from score_follower import OnlineScoreFollower
+from score_index import load_reference
+from timing import DEFAULT_BPM, TimingModel
+
+# クラス全員の録音をまとめて採点するためのCLI/API
+# 1ファイルの処理に必要な状態はすべて score_file の中に閉じているので、プロセスごとに独立して実行できる
+# デコードした音声とピッチ推定の結果は録音の内容ごとに feature_cache に残すので、同じ録音を別の楽譜やBPMで
+# 採点し直すときは、八分音符ごとの集計と正解との比較だけで済む
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".flac", ".ogg")
+
+# 1つの録音を採点する
+# cache_bytes: 特徴量のキャッシュの容量の上限(バイト)
+def score_file(audio_file_path, reference_notes, sr=22050, split_time=TimingModel(bpm=DEFAULT_BPM).note_seconds, backend="pyin",
+               cache_bytes=FEATURE_CACHE_MAX_BYTES):
+    start = time.perf_counter()
+    cache = FeatureCache(max_bytes=cache_bytes)
+    reader = AudioReader(audio_file_path, sr=sr, cache=cache)
+    recognitions = transcribe_reader(reader, split_time=split_time, backend=backend)
+
+    # realtime.py と同じく楽譜追従で音階を楽譜の位置に揃える(テンポの揺れや弾き直しがあっても位置がずれない)
+    follower = OnlineScoreFollower(reference_notes)
+    for recognition in recognitions:
+        follower.update(recognition.note)
+    played = follower.position + 1 if follower.started else 0
+    return {
+        "file": os.path.basename(audio_file_path),
+        "duration": reader.duration,
+        "processing_time": time.perf_counter() - start,
+        "cached": cache.hits > 0,
+        "accuracy": follower.accuracy(),
+        "notes": follower.aligned_notes(played),
+        "correct": follower.correct[:played].tolist(),
+        # 八分音符ごとの判定の詳細(JSONにできるように nan は None にする)
+        "recognitions": [{key: None if isinstance(value, float) and np.isnan(value) else value
+                          for key, value in recognition._asdict().items()} for recognition in recognitions],
+    }
+
+# ディレクトリ内の音声ファイルを列挙する
+def list_audio_files(audio_dir):
+    return sorted(
+        os.path.join(audio_dir, name) for name in os.listdir(audio_dir)
+        if name.lower().endswith(AUDIO_EXTENSIONS)
+    )
+
+# ディレクトリ内の録音をプロセスプールで並列に採点し、ファイルごとに結果を保存する
+# reference_path は正解の音階のJSONか、楽譜ファイル(.mxl などは score_index でコンパイルしたものを使う)
+def score_directory(audio_dir, reference_path, output_dir, workers=None, backend="pyin", split_time=TimingModel(bpm=DEFAULT_BPM).note_seconds,
+                    cache_bytes=FEATURE_CACHE_MAX_BYTES):
+    reference_notes = load_reference(reference_path)
+
+    os.makedirs(output_dir, exist_ok=True)
+    audio_files = list_audio_files(audio_dir)
+    results = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(score_file, path, reference_notes, split_time=split_time, backend=backend,
+                            cache_bytes=cache_bytes): path
+            for path in audio_files
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{os.path.basename(path)} の採点に失敗しました: {e}")
+                continue
+
+            result_path = os.path.join(output_dir, os.path.splitext(result["file"])[0] + ".json")
+            with open(result_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=4)
+            cached = ", キャッシュ" if result["cached"] else ""
+            print(f"{result['file']}: 正解率 {result['accuracy'] * 100:.1f}% ({result['processing_time']:.2f}秒{cached})")
+            results.append(result)
+
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(result["duration"] for result in results)
+    if elapsed > 0:
+        print(f"{len(results)}ファイルを{elapsed:.2f}秒で処理しました: "
+              f"{len(results) / elapsed:.2f} files/sec, {audio_seconds / elapsed:.2f} audio-seconds/sec")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="録音ファイルをまとめて採点する")
+    parser.add_argument("audio_dir", nargs="?", default=os.path.join(current_dir, "audio_files"), help="録音ファイルのディレクトリ")
+    parser.add_argument("--reference", default=os.path.join(current_dir, "doremi_notes_list.json"), help="正解の音階のJSON、または楽譜ファイル(.mxl)")
+    parser.add_argument("--output", default=os.path.join(current_dir, "results"), help="結果を保存するディレクトリ")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数(省略時はCPU数)")
+    parser.add_argument("--backend", default="pyin", help="ピッチ推定バックエンド(pyin または yin)")
+    parser.add_argument("--bpm", type=float, default=DEFAULT_BPM, help="演奏のBPM(八分音符の秒数はここから計算する)")
+    parser.add_argument("--cache-mb", type=float, default=FEATURE_CACHE_MAX_BYTES / 1024 ** 2,
+                        help="デコードした音声とピッチ推定の結果のキャッシュの容量の上限(MB)")
+    parser.add_argument("--clear-cache", action="store_true", help="採点の前にキャッシュを消す")
+    args = parser.parse_args()
+
+    # 容量の上限を下げたときは、採点の前に上限まで消しておく
+    cache_bytes = int(args.cache_mb * 1024 ** 2)
+    cache = FeatureCache(max_bytes=cache_bytes)
+    if args.clear_cache:
+        cache.clear()
+    else:
+        cache.evict()
+    split_time = TimingModel(bpm=args.bpm).note_seconds
+    score_directory(args.audio_dir, args.reference, args.output, args.workers, args.backend, split_time, cache_bytes)
+
+if __name__ == "__main__":
+    main()
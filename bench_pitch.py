@@ -0,0 +1,70 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import librosa
+
+from pitch_backends import PITCH_BACKENDS, get_estimator
+from note_table import REST_CODE, hz_to_codes, natural_codes, code_to_label
+from recognizer import dominant_pitch
+from timing import DEFAULT_BPM, TimingModel
+
+# ピッチ推定バックエンドごとの、ブロックあたりのCPU時間と音階の一致率を比較するベンチマーク
+# pyin の推定結果を正解とみなして、他のバックエンドの音階がどれだけ一致するかを測る
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+SR = 22050
+SPLIT_TIME = TimingModel(bpm=DEFAULT_BPM).note_seconds  # 八分音符の秒数(temp.py と同じく TimingModel から求める)
+
+# ブロックの f0 から音階(例: ファ5)を求める。無声なら休符
+# recognizer.NoteRecognizer と同じく、代表の f0 を音高コードにしてから音階にする
+def block_note(f0):
+    valid_f0 = f0[~np.isnan(f0)]
+    if len(valid_f0) == 0:
+        return code_to_label(REST_CODE)
+    return code_to_label(int(natural_codes(hz_to_codes(dominant_pitch(valid_f0)))))
+
+# 1つのバックエンドで全ブロックを推定し、ブロックごとの処理時間と音階を返す
+def run_backend(estimator, blocks):
+    times = []
+    notes = []
+    for block in blocks:
+        start = time.process_time()
+        f0, _, _ = estimator.estimate(block)
+        times.append(time.process_time() - start)
+        notes.append(block_note(f0))
+    return np.array(times), notes
+
+def main():
+    parser = argparse.ArgumentParser(description="ピッチ推定バックエンドの速度と精度を比較する")
+    parser.add_argument("files", nargs="*", help="音声ファイル(省略時は audio_files/*.mp3)")
+    parser.add_argument("--reference", default="pyin", choices=sorted(PITCH_BACKENDS), help="正解とみなすバックエンド")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(current_dir, "audio_files", "*.mp3")))
+    block_size = int(SR * SPLIT_TIME)
+
+    # 最初の呼び出しに含まれる numba の JIT コンパイル時間を除くため、先に1回ずつ実行しておく
+    estimators = {name: get_estimator(name, sr=SR) for name in PITCH_BACKENDS}
+    warmup = np.sin(2 * np.pi * 440 * np.arange(block_size) / SR)
+    for estimator in estimators.values():
+        estimator.estimate(warmup)
+
+    for audio_file_path in files:
+        audio_data, _ = librosa.load(audio_file_path, sr=SR)
+        blocks = [audio_data[i:i + block_size] for i in range(0, len(audio_data) - block_size + 1, block_size)]
+
+        results = {name: run_backend(estimator, blocks) for name, estimator in estimators.items()}
+        _, reference_notes = results[args.reference]
+
+        print(f"{os.path.basename(audio_file_path)} ({len(blocks)} ブロック)")
+        for name, (times, notes) in results.items():
+            accuracy = np.mean([a == b for a, b in zip(notes, reference_notes)]) if notes else 0.0
+            print(f"  {name:>6}: 平均 {times.mean() * 1000:7.2f} ms/ブロック, "
+                  f"最大 {times.max() * 1000:7.2f} ms, 合計 {times.sum():6.2f} s, "
+                  f"{args.reference}との一致率 {accuracy * 100:5.1f}%")
+
+if __name__ == "__main__":
+    main()
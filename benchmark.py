@@ -0,0 +1,173 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# 音階認識の速度と精度を測るベンチマーク
+# オフライン(temp.ms_recognition)とリアルタイムを模擬した経路(realtime.ms_recognition)を同梱の音声ファイルで実行し、
+# ブロックごとの処理時間のパーセンタイル、実時間比、最大メモリ使用量、正解率をJSONに書き出す
+# 各経路は新しいプロセスで実行するので、モジュールの状態やメモリ使用量が互いに影響しない
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+AUDIO_FILES = ["IMG_3570.mp3", "IMG_6043.mp3", "hole_new_world.mp3", "violin_test.mp3"]
+PATHS = ["offline", "realtime"]
+SR = 22050
+START_NOTE = "ファ5"  # この音階が検知されてから記録を始める(temp.py と同じ)
+
+# 最初に start_note が検知されたところからの音階を返す(見つからなければ空)
+def trim_to_start(notes, start_note=START_NOTE):
+    if start_note in notes:
+        return notes[notes.index(start_note):]
+    return []
+
+# 音階の数を正解の数に揃える(realtime.start_stream と同じく、足りなければ末尾の音階を複製する)
+def fit_to_length(notes, length):
+    if len(notes) >= length:
+        return notes[:length]
+    fill = notes[-1] if notes else "休符"
+    return notes + [fill] * (length - len(notes))
+
+# temp.ms_recognition を八分音符ごとのブロックに対して実行する
+def run_offline(audio_data):
+    import temp
+
+    blocks = temp.split_audio(audio_data, split_time=temp.SPLIT_TIME, sr=SR)
+    latencies = []
+    notes = []
+    for block in blocks:
+        start = time.perf_counter()
+        notes.append(temp.ms_recognition(block))
+        latencies.append(time.perf_counter() - start)
+    return latencies, notes
+
+# realtime.ms_recognition にオーディオコールバックと同じ大きさのブロックを順番に渡す
+def run_realtime(audio_data):
+    import realtime
+
+    latencies = []
+    notes = []
+    for k, start_index in enumerate(range(0, len(audio_data) - realtime.BLOCK_SIZE + 1, realtime.BLOCK_SIZE)):
+        block = audio_data[start_index:start_index + realtime.BLOCK_SIZE]
+        start = time.perf_counter()
+        note = realtime.ms_recognition(block)
+        latencies.append(time.perf_counter() - start)
+        # 楽譜追従と同じく、八分音符ごとに1つの音階を採用する
+        if (k + 1) % realtime.timing.hops_per_note == 0:
+            notes.append(note)
+    return latencies, notes
+
+# 最初のブロックに含まれる import や JIT コンパイルの時間を除くため、先にピッチ推定を1回動かしておく
+# (計測する経路の認識器の状態は変えないように、推定器や認識器の warm_up() を使う)
+def warm_up(path):
+    if path == "offline":
+        import temp
+        from pitch_backends import get_estimator
+        get_estimator(temp.PITCH_BACKEND, sr=SR).warm_up()
+    else:
+        import realtime
+        realtime.recognizer.warm_up()
+
+# 最大メモリ使用量(MB)。ru_maxrss の単位は Linux ではキロバイト、macOS ではバイト
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+# 1つの経路と音声ファイルの組み合わせを計測する(子プロセスで実行される)
+def run_case(path, audio_file_path, reference_notes):
+    import librosa
+    from score_follower import OnlineScoreFollower
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        audio_data, _ = librosa.load(audio_file_path, sr=SR)
+        warm_up(path)
+        runner = run_offline if path == "offline" else run_realtime
+
+        start = time.perf_counter()
+        latencies, notes = runner(audio_data)
+        elapsed = time.perf_counter() - start
+
+        follower = OnlineScoreFollower(reference_notes)
+        for note in notes:
+            follower.update(note)
+
+    aligned = fit_to_length(trim_to_start(notes), len(reference_notes))
+    correct = [detected == answer for detected, answer in zip(aligned, reference_notes)]
+    latencies_ms = np.array(latencies) * 1000
+    duration = len(audio_data) / SR
+    return {
+        "path": path,
+        "file": os.path.basename(audio_file_path),
+        "duration": duration,
+        "blocks": len(latencies),
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+        "processing_time": elapsed,
+        "real_time_factor": elapsed / duration,
+        "peak_rss_mb": peak_rss_mb(),
+        "accuracy": sum(correct) / len(correct) if correct else 0.0,
+        "follower_accuracy": follower.accuracy(),
+    }
+
+# 計測した環境の情報
+def environment_info():
+    import librosa
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=current_dir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "librosa": librosa.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="音階認識の速度と精度を計測する")
+    parser.add_argument("files", nargs="*", help="音声ファイル(省略時は audio_files の4ファイル)")
+    parser.add_argument("--paths", nargs="+", default=PATHS, choices=PATHS, help="計測する経路")
+    parser.add_argument("--reference", default=os.path.join(current_dir, "doremi_notes_list.json"), help="正解の音階のJSON")
+    parser.add_argument("--output", default=os.path.join(current_dir, "benchmark_results.json"), help="結果を書き出すJSON")
+    args = parser.parse_args()
+
+    files = args.files or [os.path.join(current_dir, "audio_files", name) for name in AUDIO_FILES]
+    with open(args.reference, 'r', encoding='utf-8') as json_file:
+        reference_notes = json.load(json_file)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for path in args.paths:
+        for audio_file_path in files:
+            # 計測ごとに新しいプロセスを使う(最大メモリ使用量を個別に測るため)
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (path, audio_file_path, reference_notes))
+            latency = result["latency_ms"]
+            print(f"{path:>8} {result['file']:>20}: p50 {latency['p50']:7.2f} ms, p95 {latency['p95']:7.2f} ms, "
+                  f"p99 {latency['p99']:7.2f} ms, 実時間比 {result['real_time_factor']:.3f}, "
+                  f"最大RSS {result['peak_rss_mb']:.0f} MB, 正解率 {result['accuracy'] * 100:.1f}% "
+                  f"(楽譜追従 {result['follower_accuracy'] * 100:.1f}%)")
+            results.append(result)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment_info(), "results": results}, f, ensure_ascii=False, indent=4)
+    print(f"結果を保存しました: {args.output}")
+
+if __name__ == "__main__":
+    main()
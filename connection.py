@@ -1,5 +1,9 @@
-import json
-from UnityConnector import UnityConnector
+import os
+
+from transport import UnityTransport
+
+# 環境変数 MOCK_UNITY_PORT を指定すると、UnityConnector の代わりに模擬Unity(mock_unity.py)用のTCP接続を使う
+MOCK_UNITY_PORT = os.environ.get("MOCK_UNITY_PORT")
 
 # タイムアウト時のコールバック
 def on_timeout():
@@ -9,28 +13,47 @@ def on_timeout():
 def on_stopped():
     print("stopped")
 
-# インスタンス
-connector = UnityConnector(on_timeout=on_timeout, on_stopped=on_stopped)
-
 # データが飛んできたときのコールバック
 def on_data_received(data_type, data):
     print(data_type, data)
 
-print("connecting...")
+# UnityConnector のインスタンスを作る(接続が切れたら on_disconnect も呼ぶ)
+def create_connector(on_disconnect_timeout, on_disconnect_stopped):
+    def timeout():
+        on_timeout()
+        on_disconnect_timeout()
+
+    def stopped():
+        on_stopped()
+        on_disconnect_stopped()
+
+    if MOCK_UNITY_PORT:
+        from socket_connector import SocketConnector
+        return SocketConnector(timeout, stopped, port=int(MOCK_UNITY_PORT))
+
+    from UnityConnector import UnityConnector
+    return UnityConnector(on_timeout=timeout, on_stopped=stopped)
 
-# Unity側の接続を待つ
-connector.start_listening(on_data_received)
+# 送信レイヤー(最初に使うときに起動し、Unityとの接続は裏で待つ)
+transport = None
 
-print("connected")
+def get_transport():
+    global transport
+    if transport is None:
+        transport = UnityTransport(create_connector, data_type="test", on_data_received=on_data_received).start()
+    return transport
 
-# デモ用のループ
+# Unityへデータを送る(送信キューに積むだけで、接続や送信の完了は待たない)
 def send_data_loop(data):
-        # 送るデータをJSON形式に変換
-        json_data = json.dumps(data)
-        print(f"send_data: {data}")
+    print(f"send_data: {data}")
+    get_transport().send(data)
 
-        # Unityへ送る
-        connector.send("test", data)
+# 送信待ちのデータを送りきってから送信レイヤーを止める
+def close_transport(timeout=5.0):
+    if transport is not None:
+        transport.close(timeout)
+        print(f"送信の統計: {transport.stats()}")
 
 if __name__ == "__main__":
     send_data_loop({"test": "test"})
+    close_transport()
@@ -1,6 +1,6 @@
 from music21 import *
 import json
-import copy
+from collections import namedtuple
 
 # C, D, E, F, G, A, B の音符をドレミファソラシドに対応させる辞書
 note_to_doremi = {
@@ -22,61 +22,62 @@ def note_to_doremi_converter(note):
 def get_octave(note):
     return note.pitch.octave if note.isNote else None
 
-# 楽譜をドレミファソラシドとオクターブのリストに変換する関数
-def score_to_doremi_list(score):
-    notes_list = []
-
-    # パートがあるかを確認
-    if hasattr(score, 'parts'):
-        # 複数のパートがある場合
-        for part in score.parts:  # 楽譜の各パートをループ
-            for note in part.flat.notes:  # 各音符をループ
-                if note.isNote:  # 音符であるかを確認
-                    note_doremi = note_to_doremi_converter(note)  # 音符をドレミファソラシドに変換
-                    octave = get_octave(note)  # オクターブを取得
-                    # 'ド4'のように音符とオクターブを結合してリストに追加
-                    notes_list.append(f"{note_doremi}{octave}")
-    else:
-        # 単一のパートまたはフラット化されたスコア
-        for note in score.flat.notes:
-            if note.isNote:
-                note_doremi = note_to_doremi_converter(note)
-                octave = get_octave(note)
-                notes_list.append(f"{note_doremi}{octave}")
-
-    # リスト形式で返す
-    return notes_list
-
-# 楽譜の全音符を8分音符に変換する関数
-def convert_to_eighth_notes(score):
-    new_score = stream.Stream()  # 新しい楽譜を作成
-    for part in score.parts:  # 楽譜が複数のパートで構成されている場合
-        new_part = stream.Part()
-        for note in part.flat.notes:  # 各音符を8分音符に変換
-            if note.quarterLength > 0.5:  # 4分音符より長い場合
+# 八分音符1つ分の音符(pitch は C, D などの音名、休符の場合は pitch と octave が None)
+# tied は前の八分音符から音が続いている(長い音符の2つ目以降、またはタイでつながっている)かどうか
+EighthNote = namedtuple('EighthNote', ['pitch', 'octave', 'eighth_index', 'tied'])
+
+# 楽譜のパートを列挙する(パートがなければ楽譜全体を1つのパートとして扱う)
+def iter_parts(score):
+    if hasattr(score, 'parts') and len(score.parts) > 0:
+        return iter(score.parts)
+    return iter([score])
+
+# 楽譜の全音符を八分音符単位に展開しながら1つずつ返すジェネレータ
+# 音符オブジェクトをコピーせず、各パートの音符を1回だけ走査する
+def iter_eighth_notes(score):
+    for part in iter_parts(score):
+        eighth_index = 0
+        tie_continues = False
+        for note in part.recurse().notesAndRests:
+            if note.isRest:
+                pitch, octave = None, None
+            elif note.isNote:
+                pitch, octave = note.name[0], get_octave(note)
+            else:
+                # 和音は対象外
+                continue
+
+            # 4分音符以上は八分音符の個数分、それより短い音符は八分音符1つとして扱う
+            if note.quarterLength > 0.5:
                 num_eighth_notes = int(note.quarterLength / 0.5)
-                for _ in range(num_eighth_notes):
-                    new_note = copy.deepcopy(note)  # 元の音符をディープコピー
-                    new_note.quarterLength = 0.5  # 8分音符の長さに設定
-                    new_part.append(new_note)
             else:
-                # そのまま8分音符として追加
-                new_note = copy.deepcopy(note)  # ディープコピー
-                new_note.quarterLength = 0.5  # 8分音符に調整
-                new_part.append(new_note)
-        new_score.append(new_part)
-    return new_score
+                num_eighth_notes = 1
+
+            for k in range(num_eighth_notes):
+                yield EighthNote(pitch, octave, eighth_index, tie_continues or k > 0)
+                eighth_index += 1
+
+            # タイの開始・途中なら、次の音符は前の音符の続き
+            tie_continues = note.tie is not None and note.tie.type in ('start', 'continue')
+
+# 八分音符を「ド4」形式(休符は「休符」)に変換する
+def eighth_note_to_doremi(eighth_note):
+    if eighth_note.pitch is None:
+        return "休符"
+    return f"{note_to_doremi.get(eighth_note.pitch, eighth_note.pitch)}{eighth_note.octave}"
+
+# 楽譜を八分音符ごとのドレミファソラシドとオクターブのリストに変換する関数
+# 以前の(音符をコピーして八分音符の楽譜を作り直す)変換と同じく、全パートの音符を順に並べ、休符は含めない
+def score_to_doremi_list(score):
+    return [eighth_note_to_doremi(eighth_note) for eighth_note in iter_eighth_notes(score) if eighth_note.pitch is not None]
 
 # メイン処理部分
 def main():
     # 楽譜の読み込み
     score = converter.parse('music_score.mxl')
 
-    # 楽譜を8分音符に変換
-    new_score = convert_to_eighth_notes(score)
-
-    # 楽譜をドレミファソラシドとオクターブのリストに変換
-    doremi_list = score_to_doremi_list(new_score)
+    # 楽譜を八分音符ごとのドレミファソラシドとオクターブのリストに変換
+    doremi_list = score_to_doremi_list(score)
 
     # 結果をファイルに保存（リストをJSON形式に変換して保存）
     with open('doremi_notes_list.json', 'w', encoding='utf-8') as f:
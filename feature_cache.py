@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from score_index import file_hash
+
+# 録音から求めた中間の特徴量(デコードした音声、フレームごとの f0 と有声確率、オンセット)をディスクに残すキャッシュ
+# 録音の内容のハッシュと解析のパラメータからファイル名を決めるので、同じ録音を別の楽譜やBPMで採点し直すときは
+# デコードやピッチ推定をやり直さず、八分音符ごとの集計と比較だけで済む
+# キャッシュの合計サイズが max_bytes を超えたら、最後に使ってから長いファイルから消す(使うたびに更新時刻を新しくする)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+FEATURE_CACHE_DIR = os.path.join(current_dir, "audio_cache")  # audio_reader のデコード済みの音声と同じ場所で容量を管理する
+FEATURE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# 最後に使ってからこの秒数以内のファイルは消さない
+# (batch_score のように複数のプロセスが同じキャッシュを使うとき、別のプロセスが確かめたばかりで
+#  これから開くファイルを消さないため。keep は同じプロセスの中で使っているファイルを守る)
+EVICT_GRACE_SECONDS = 60.0
+
+# 同じプロセスで同じ録音を何度も開くときに、ファイル全体を読んでハッシュを計算し直さない
+# (パス、サイズ、更新時刻が同じなら内容も同じとみなす)
+_hash_memo = {}
+
+def audio_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _hash_memo.get(key)
+    if digest is None:
+        digest = _hash_memo[key] = file_hash(path)
+    return digest
+
+# 解析のパラメータ(JSONにできる値の辞書)を短いハッシュにする
+def params_hash(params):
+    text = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class FeatureCache:
+    def __init__(self, cache_dir=FEATURE_CACHE_DIR, max_bytes=FEATURE_CACHE_MAX_BYTES, grace_seconds=EVICT_GRACE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # 録音のハッシュ digest の kind の特徴量を params で求めたときのファイル
+    def path(self, digest, kind, params):
+        return os.path.join(self.cache_dir, f"{digest}_{kind}_{params_hash(params)}.npz")
+
+    # キャッシュがあれば配列の辞書を返す(なければ None)
+    def load(self, path):
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            # ない、または別のプロセスが消した・書きかけのファイルは、ないものとして計算し直す
+            self.misses += 1
+            return None
+        self.touch(path)
+        self.hits += 1
+        return arrays
+
+    # keep: 容量を超えても消さないファイル(保存したファイルと、呼び出し元が今使っているファイル)
+    def save(self, path, arrays, keep=()):
+        temporary_path = f"{path}.{os.getpid()}.tmp"  # 別のプロセスが同じ特徴量を書いていてもぶつからない
+        with open(temporary_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temporary_path, path)
+        self.evict(keep=(path, *keep))
+
+    # キャッシュがあれば読み込み、なければ compute() で配列の辞書を求めて保存する
+    def get_or_compute(self, digest, kind, params, compute, keep=()):
+        path = self.path(digest, kind, params)
+        arrays = self.load(path)
+        if arrays is None:
+            arrays = compute()
+            self.save(path, arrays, keep)
+        return arrays
+
+    # 使ったファイルの更新時刻を新しくする(消す順番は更新時刻の古い順)
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    # キャッシュのファイルの一覧 [(更新時刻, サイズ, パス)](書きかけのファイルは除く)
+    def entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    # 合計サイズが max_bytes 以下になるまで、最後に使ってから長いファイルを消す
+    # (keep のファイルと、grace_seconds 秒以内に使ったファイルは、今使っているものなので消さない)。消したファイルの数を返す
+    def evict(self, keep=()):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        recent = time.time() - self.grace_seconds
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep or mtime > recent:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        entries = self.entries()
+        return {"files": len(entries), "bytes": sum(size for _, size, _ in entries), "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,130 @@
+from collections import namedtuple
+
+import numpy as np
+
+from pitch_backends import VIOLIN_FMIN_NOTE, VIOLIN_FMAX_NOTE
+from note_table import hz_to_midi, note_to_midi
+
+# 楽器の音域の半音ごとのエネルギーとオンセットを、1ブロックにつき1回の計算でまとめて求めるフィルタバンク
+# 1つの音ごとにバンドパスフィルタをかける代わりに、ブロックのフレームをまとめて FFT し、
+# 最初に作っておいた (半音の数, 周波数ビンの数) の重み行列を掛けるだけで全部の半音のエネルギーを得る
+# 重音(ダブルストップ)や複数の目標の音が鳴っているかを1回で確かめられる
+
+# 1ブロック分の結果
+# midi: 各列の半音のMIDIノート番号, energy: (フレーム数, 半音の数) のエネルギー(dB、そのフレームの最大値が 0)
+# positions: 各フレームの末尾のサンプル位置, onsets: [(サンプル位置, MIDIノート番号)]
+FilterbankFrames = namedtuple('FilterbankFrames', ['midi', 'energy', 'positions', 'onsets'])
+
+# 半音ごとの三角形の重み(対数周波数で隣の半音の中心まで)を並べた行列を作る
+# harmonics が2以上なら、倍音の位置にも 1/h の重みをつける
+def semitone_weights(midi, sr, n_fft, harmonics=1):
+    bin_midi = hz_to_midi(np.maximum(np.fft.rfftfreq(n_fft, 1.0 / sr), 1e-6))
+    weights = np.zeros((len(midi), len(bin_midi)))
+    for h in range(1, harmonics + 1):
+        centers = midi[:, None] + 12 * np.log2(h)
+        weights += np.maximum(0.0, 1.0 - np.abs(bin_midi[None, :] - centers)) / h
+    # 低い音ほど帯域に入るビンが少ないので、半音ごとに重みの合計を揃える
+    return weights / np.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+
+
+class SemitoneFilterbank:
+    # fmin_note〜fmax_note の半音ごとにエネルギーとオンセットを求める
+    # n_fft: 低い音の隣り合う半音を分けられる長さにする(22050Hz で 4096 なら1ビン約5.4Hz、G3 と G♯3 の差は約11.7Hz)
+    # delta: 半音ごとの正規化したエネルギーの増加が直近の平均をこれだけ超えたらオンセット
+    # floor_db: フレームの最大値からこれより小さい半音は鳴っていないとみなす
+    def __init__(self, sr=22050, fmin_note=VIOLIN_FMIN_NOTE, fmax_note=VIOLIN_FMAX_NOTE, n_fft=4096, hop_length=512,
+                 harmonics=1, delta=0.2, floor_db=-30.0, average_seconds=0.1, wait_seconds=0.1, decay_seconds=4.0):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.delta = delta
+        self.floor_db = floor_db
+        self.midi = np.arange(note_to_midi(fmin_note), note_to_midi(fmax_note) + 1)
+        self.weights = semitone_weights(self.midi, sr, n_fft, harmonics).T  # (ビンの数, 半音の数)
+        self.window = np.hanning(n_fft)
+        self.average_frames = max(1, int(round(average_seconds * sr / hop_length)))
+        self.wait_frames = max(1, int(round(wait_seconds * sr / hop_length)))
+        self.decay = 0.5 ** (hop_length / sr / decay_seconds)
+        self.reset()
+
+    def reset(self):
+        n_pitches = len(self.midi)
+        self.buffer = np.zeros(self.n_fft - self.hop_length)  # 次のフレームに必要な直前のサンプル
+        self.frames_seen = 0
+        self.previous_level = None
+        self.peak = np.full(n_pitches, 1e-6)
+        self.flux_history = np.zeros((self.average_frames + 2, n_pitches))  # 直近の正規化したフラックス(古い順)
+        self.last_onset_frame = np.full(n_pitches, -self.wait_frames)
+
+    # ノート名(例: "F#4")またはMIDIノート番号を、エネルギーの列の番号にする
+    def column(self, note):
+        midi = note_to_midi(note) if isinstance(note, str) else int(note)
+        return int(np.searchsorted(self.midi, midi)) if self.midi[0] <= midi <= self.midi[-1] else None
+
+    # 新しい音声ブロックを追加し、新しく計算できたフレームのエネルギーとオンセットを返す
+    def update(self, block):
+        samples = np.concatenate([self.buffer, np.asarray(block, dtype=np.float64)])
+        n_frames = max(0, (len(samples) - self.n_fft) // self.hop_length + 1)
+        if n_frames == 0:
+            self.buffer = samples
+            return FilterbankFrames(self.midi, np.zeros((0, len(self.midi))), np.zeros(0, dtype=int), [])
+
+        # 新しいフレームをまとめて FFT して、重み行列で半音ごとのエネルギーにする
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.n_fft)[:n_frames * self.hop_length:self.hop_length]
+        power = np.abs(np.fft.rfft(frames * self.window, axis=-1)) ** 2
+        energy = power @ self.weights
+        self.buffer = samples[n_frames * self.hop_length:]
+
+        positions = (self.frames_seen + np.arange(n_frames) + 1) * self.hop_length
+        onsets = []
+        for k in range(n_frames):
+            for column in self.pick_onsets(energy[k]):
+                onsets.append((int(positions[k] - self.hop_length), int(self.midi[column])))
+
+        with np.errstate(divide="ignore"):
+            energy_db = 10 * np.log10(energy + 1e-12)
+        energy_db -= energy_db.max(axis=1, keepdims=True)
+        return FilterbankFrames(self.midi, energy_db, positions, onsets)
+
+    # 1フレーム分の半音ごとのエネルギーから、1つ前のフレームでオンセットがあった半音の列の番号を返す
+    # (onset.StreamingOnsetDetector と同じ判定を、全部の半音についてまとめて行う)
+    # 周りの半音への漏れや雑音で誤検出しないように、そのフレームで鳴っている半音(active_notes と同じ条件)に限る
+    def pick_onsets(self, energy):
+        level = np.log1p(1e4 * energy)
+        previous, self.previous_level = self.previous_level, level
+        flux = np.zeros_like(level) if previous is None else np.maximum(level - previous, 0)
+        self.peak = np.maximum(flux, self.peak * self.decay)
+        self.flux_history = np.roll(self.flux_history, -1, axis=0)
+        self.flux_history[-1] = flux / self.peak
+        self.frames_seen += 1
+        if self.frames_seen < 3:
+            return []
+
+        before, candidate, after = self.flux_history[-3], self.flux_history[-2], self.flux_history[-1]
+        average = self.flux_history[:-1].mean(axis=0)
+        with np.errstate(divide="ignore"):
+            audible = self.sounding(10 * np.log10(energy + 1e-12) - 10 * np.log10(energy.max() + 1e-12))
+        candidate_frame = self.frames_seen - 2
+        is_onset = ((candidate >= before) & (candidate > after) & (candidate >= average + self.delta) & audible
+                    & (candidate_frame - self.last_onset_frame >= self.wait_frames))
+        self.last_onset_frame[is_onset] = candidate_frame
+        return np.nonzero(is_onset)[0]
+
+    # 鳴っている半音か(最大値から floor_db 以内で、隣の半音より大きい)
+    def sounding(self, energy_db):
+        local_peak = np.ones(energy_db.shape, dtype=bool)
+        local_peak[..., 1:] &= energy_db[..., 1:] >= energy_db[..., :-1]
+        local_peak[..., :-1] &= energy_db[..., :-1] >= energy_db[..., 1:]
+        return local_peak & (energy_db >= self.floor_db)
+
+    # フレームごとに、鳴っている半音のMIDIノート番号
+    def active_notes(self, energy_db):
+        return [self.midi[row].tolist() for row in self.sounding(energy_db)]
+
+    # フレームごとに、notes の音がすべて鳴っているか(重音や複数の目標の音の確認)
+    def contains(self, energy_db, notes, threshold_db=None):
+        threshold_db = self.floor_db if threshold_db is None else threshold_db
+        columns = [self.column(note) for note in notes]
+        if any(column is None for column in columns):
+            return np.zeros(len(energy_db), dtype=bool)
+        return np.all(energy_db[:, columns] >= threshold_db, axis=1)
@@ -0,0 +1,169 @@
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+import soxr
+
+# ソケットやHTTPで少しずつ届く音声を、届いた分だけデコード・リサンプリングして解析に渡す受信口
+# ファイル全体を読み込んでからデコードしないので、アップロードが終わる前に最初の音符を返せて、
+# 録音がどれだけ長くてもメモリの使用量は変わらない
+#   PCM("f32", "s16", "s32"): そのまま数値にして、サンプリングレートが違えば soxr のストリームでリサンプリングする
+#   圧縮された音声("mp3", "ogg", "webm" など): ffmpeg をパイプでつないでデコードする(リサンプリングも ffmpeg で行う)
+
+# PCMの形式ごとの numpy の型と、-1〜1 に揃えるための倍率
+PCM_FORMATS = {
+    "f32": ("<f4", 1.0),
+    "s16": ("<i2", 1.0 / 32768),
+    "s32": ("<i4", 1.0 / 2147483648),
+}
+COMPRESSED_FORMATS = ("auto", "mp3", "ogg", "opus", "webm", "m4a", "aac", "flac", "wav")
+FFMPEG_REQUIRED = "圧縮された音声のデコードには ffmpeg が必要です(インストールして PATH から実行できるようにしてください)"
+
+# ffmpeg の実行ファイルのパスを返す(見つからなければ RuntimeError)
+# session_server は起動時にこれを呼んで、最初の演奏者が接続してから失敗しないようにする
+def find_ffmpeg(ffmpeg="ffmpeg"):
+    path = shutil.which(ffmpeg)
+    if path is None:
+        raise RuntimeError(f"{ffmpeg} が見つかりません。{FFMPEG_REQUIRED}")
+    return path
+
+
+# 届いたバイト列を float32 のモノラル音声にする(サンプルの途中で切れたバイトは次に回す)
+class PcmDecoder:
+    def __init__(self, on_samples, sample_format="f32", channels=1):
+        if sample_format not in PCM_FORMATS:
+            raise ValueError(f"不明なPCMの形式です: {sample_format} (選択肢: {', '.join(PCM_FORMATS)})")
+        dtype, self.scale = PCM_FORMATS[sample_format]
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.frame_bytes = self.dtype.itemsize * channels
+        self.on_samples = on_samples
+        self.pending = b""
+
+    def feed(self, data):
+        data = self.pending + bytes(data)
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        if usable == 0:
+            return
+        samples = np.frombuffer(data, dtype=self.dtype, count=usable // self.dtype.itemsize).astype(np.float32)
+        if self.scale != 1.0:
+            samples *= self.scale
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        self.on_samples(samples)
+
+    def finish(self):
+        self.pending = b""
+
+    def close(self):
+        pass
+
+
+# ffmpeg をパイプでつないで、圧縮された音声を届いた分だけデコードする
+# デコードされた音声は読み込みスレッドから on_samples で渡す
+class FfmpegDecoder:
+    def __init__(self, on_samples, sample_rate, ffmpeg="ffmpeg", read_size=16384):
+        self.on_samples = on_samples
+        self.read_size = read_size
+        command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+                   "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"]
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError(FFMPEG_REQUIRED)
+        self.error = None
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def read_loop(self):
+        pending = b""
+        try:
+            while True:
+                data = self.process.stdout.read1(self.read_size)
+                if not data:
+                    break
+                data = pending + data
+                usable = len(data) - len(data) % 4
+                pending = data[usable:]
+                if usable:
+                    self.on_samples(np.frombuffer(data, dtype="<f4", count=usable // 4).copy())
+        except Exception as e:
+            self.error = e
+
+    # ffmpeg の入力に書き込む(ffmpeg が追いつかないときはパイプが空くまで待つ)
+    def feed(self, data):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg が終了しました(終了コード: {self.process.poll()})")
+
+    # 入力を閉じて、残りをデコードしきるまで待つ
+    def finish(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.reader.join()
+        self.process.wait()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+# soxr のストリームで、ブロックの境目をまたいで途切れなくリサンプリングする
+class StreamingResampler:
+    def __init__(self, in_rate, out_rate, quality="HQ"):
+        self.stream = soxr.ResampleStream(in_rate, out_rate, 1, dtype="float32", quality=quality)
+
+    def process(self, samples, last=False):
+        return self.stream.resample_chunk(np.asarray(samples, dtype=np.float32), last=last)
+
+
+# 音声の受信口: feed() で届いたバイト列を渡すと、target_rate の float32 のモノラル音声を on_samples に渡す
+class AudioIngest:
+    # sample_rate: 届く音声のサンプリングレート(圧縮された音声ではファイルの情報を使うので無視する)
+    # audio_format: PCM_FORMATS か COMPRESSED_FORMATS のどれか
+    def __init__(self, on_samples, sample_rate, target_rate, audio_format="f32", channels=1):
+        self.on_samples = on_samples
+        self.resampler = None
+        if audio_format in PCM_FORMATS:
+            self.decoder = PcmDecoder(self.emit, audio_format, channels)
+            if sample_rate != target_rate:
+                self.resampler = StreamingResampler(sample_rate, target_rate)
+        elif audio_format in COMPRESSED_FORMATS:
+            self.decoder = FfmpegDecoder(self.emit, target_rate)
+        else:
+            raise ValueError(f"不明な音声の形式です: {audio_format} "
+                             f"(選択肢: {', '.join(list(PCM_FORMATS) + list(COMPRESSED_FORMATS))})")
+        self.bytes_received = 0
+        self.samples_decoded = 0
+
+    def emit(self, samples):
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        if len(samples) > 0:
+            self.samples_decoded += len(samples)
+            self.on_samples(samples)
+
+    def feed(self, data):
+        self.bytes_received += len(data)
+        self.decoder.feed(data)
+
+    # 入力の終わり: デコーダとリサンプラーに残っている音声を出しきる
+    def finish(self):
+        self.decoder.finish()
+        if self.resampler is not None:
+            tail = self.resampler.process(np.zeros(0, dtype=np.float32), last=True)
+            if len(tail) > 0:
+                self.samples_decoded += len(tail)
+                self.on_samples(tail)
+
+    def close(self):
+        self.decoder.close()
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from note_table import label_to_code, midi_to_hz
+from session import Session, SessionScheduler
+from socket_connector import SocketConnector
+from timing import DEFAULT_BPM, TimingModel
+from transport import UnityTransport
+
+# 送信の経路の負荷試験
+# N人分の演奏を模擬して、合成した音声をホップの長さのブロックずつ Session に渡し(SessionScheduler のワーカーで音階を認識し)、
+# 音符イベントを UnityTransport + SocketConnector で送って、別プロセスの模擬Unity(mock_unity.py)で受け取る
+# 遅延はブロックをキャプチャした時刻(time.monotonic())から模擬Unityが受け取るまでで、認識の時間も含む
+# 人数を増やしながら実行して、1つのバックエンドプロセスで何人まで遅延の予算内で扱えるかを調べる
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+NOTES = ["ド4", "レ4", "ミ4", "ファ4", "ソ4", "ラ4", "シ4", "ド5", "レ5", "ミ5", "ファ5", "ソ5", "休符"]
+
+# 模擬Unityのプロセスで実行する
+def run_mock_unity(ports, duration, reconnect_every, result_queue):
+    from mock_unity import run_clients
+    result_queue.put(asyncio.run(run_clients(ports, duration, reconnect_every=reconnect_every)))
+
+# 音階のリストを八分音符ごとのサイン波(休符は無音)にして、ホップの長さのブロックを順番に返す
+def synthetic_blocks(notes, timing):
+    note_length = timing.hop_size * timing.hops_per_note
+    t = np.arange(note_length) / timing.sr
+    while True:
+        for note in notes:
+            code = label_to_code(note)
+            if code >= 0:
+                tone = 0.3 * np.sin(2 * np.pi * float(midi_to_hz(code)) * t)
+            else:
+                tone = np.zeros(note_length)
+            tone = (tone + 0.001 * np.random.randn(note_length)).astype(np.float32)
+            for k in range(timing.hops_per_note):
+                yield tone[k * timing.hop_size:(k + 1) * timing.hop_size]
+
+# 1人分の演奏: マイクと同じくホップの秒数(speedup 倍速)ごとにブロックをキャプチャして解析に渡す
+def play_session(scheduler, session, speedup, duration, stop_event):
+    interval = session.timing.hop_seconds / speedup
+    next_time = time.monotonic()
+    deadline = next_time + duration
+    for block in synthetic_blocks(session.reference, session.timing):
+        if stop_event.is_set() or time.monotonic() >= deadline:
+            break
+        scheduler.submit(session, block, time.monotonic())
+        next_time += interval
+        time.sleep(max(0.0, next_time - time.monotonic()))
+
+# N人分を同時に演奏して、模擬Unity側とバックエンド側の結果をまとめる
+def run_load(sessions, duration, speedup, base_port, reconnect_every, length, batch_interval, timing, workers=4):
+    ports = [base_port + k for k in range(sessions)]
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    mock = context.Process(target=run_mock_unity, args=(ports, duration + 2.0, reconnect_every, result_queue))
+    mock.start()
+
+    transports = []
+    for port in ports:
+        factory = lambda on_timeout, on_stopped, port=port: SocketConnector(on_timeout, on_stopped, port=port)
+        transports.append(UnityTransport(factory, data_type="note", batch_interval=batch_interval).start())
+    for transport in transports:
+        transport.connected.wait(10.0)
+
+    # 演奏者ごとに正解の楽譜(ランダムな音階)を作り、その通りに演奏する
+    scheduler = SessionScheduler(workers=workers)
+    players = []
+    for k, transport in enumerate(transports):
+        session = Session(f"load{k}", [random.choice(NOTES) for _ in range(length)], timing, output=transport)
+        session.recognizer.warm_up()
+        players.append(scheduler.add(session))
+
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=play_session, args=(scheduler, session, speedup, duration, stop_event), daemon=True)
+        for session in players
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for session in players:
+        scheduler.remove(session, timeout=5.0)
+        session.finish()
+    elapsed = time.monotonic() - start
+    scheduler.shutdown()
+
+    backend_stats = [transport.stats() for transport in transports]
+    session_stats = [session.stats() for session in players]
+    clients = result_queue.get()
+    mock.join()
+    for transport in transports:
+        transport.close(timeout=1.0)
+
+    latencies = np.concatenate([np.array(client["latencies_ms"]) for client in clients]) if clients else np.zeros(1)
+    events = sum(client["events"] for client in clients)
+    gaps = [gap for client in clients for gap in client["reconnect_gaps"]]
+    return {
+        "sessions": sessions,
+        "events": events,
+        "events_per_sec": events / elapsed,
+        "bytes_per_sec": sum(client["bytes"] for client in clients) / elapsed,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        },
+        "missing_events": sum(client["missing_events"] for client in clients),
+        "dropped": sum(stats["dropped"] for stats in backend_stats),
+        "dropped_blocks": sum(stats["dropped"] for stats in session_stats),
+        "mean_block_ms": float(np.mean([stats["mean_block_ms"] for stats in session_stats])),
+        "reconnects": sum(client["reconnects"] for client in clients),
+        "resynced": sum(client["resynced"] for client in clients),
+        "reconnect_gap_ms": float(np.mean(gaps) * 1000) if gaps else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Unityへの送信経路の負荷試験")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16, 64], help="同時に演奏する人数(複数指定で順に試す)")
+    parser.add_argument("--duration", type=float, default=10.0, help="1回の試験の秒数")
+    parser.add_argument("--bpm", type=float, default=DEFAULT_BPM, help="演奏のBPM(八分音符ごとに1イベント送る)")
+    parser.add_argument("--speedup", type=float, default=1.0, help="ブロックをキャプチャする頻度の倍率")
+    parser.add_argument("--workers", type=int, default=4, help="音階を認識するワーカーのスレッド数")
+    parser.add_argument("--base-port", type=int, default=6000, help="1人目のポート番号(2人目以降は1つずつずらす)")
+    parser.add_argument("--reconnect-every", type=float, default=None, help="模擬Unityがこの秒数ごとに切断・再接続する")
+    parser.add_argument("--batch-interval", type=float, default=0.01, help="イベントをまとめる秒数")
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="許容する p95 遅延(ミリ秒)")
+    parser.add_argument("--output", default=os.path.join(current_dir, "load_test_results.json"), help="結果を書き出すJSON")
+    args = parser.parse_args()
+
+    timing = TimingModel(bpm=args.bpm)
+    results = []
+    for sessions in args.sessions:
+        result = run_load(sessions, args.duration, args.speedup, args.base_port, args.reconnect_every, 512,
+                          args.batch_interval, timing, args.workers)
+        latency = result["latency_ms"]
+        ok = latency["p95"] <= args.budget_ms and result["missing_events"] == 0 and result["dropped_blocks"] == 0
+        result["within_budget"] = ok
+        print(f"{sessions:4d}人: {result['events_per_sec']:8.1f} events/s, 遅延 p50 {latency['p50']:6.2f} ms / "
+              f"p95 {latency['p95']:6.2f} ms / p99 {latency['p99']:6.2f} ms, 欠落 {result['missing_events']}, "
+              f"捨てたブロック {result['dropped_blocks']} (認識 {result['mean_block_ms']:.2f} ms/ブロック), "
+              f"再接続 {result['reconnects']}回 (平均 {result['reconnect_gap_ms']:.0f} ms, 再同期 {result['resynced']}回) "
+              f"{'OK' if ok else 'NG'}")
+        results.append(result)
+
+    capacity = max((result["sessions"] for result in results if result["within_budget"]), default=0)
+    print(f"p95 遅延 {args.budget_ms:.0f} ms 以内で扱えた最大人数: {capacity}人")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"budget_ms": args.budget_ms, "capacity": capacity, "results": results}, f, ensure_ascii=False, indent=4)
+
+if __name__ == "__main__":
+    main()
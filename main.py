@@ -2,26 +2,12 @@ import sounddevice as sd
 import numpy as np
 import librosa
 
+from note_table import hz_to_codes, code_to_label
+
 # サンプリングレートとバッファサイズを設定
 sr = 22050  # サンプリングレート
 buffer_size = 2048  # バッファサイズ
 
-# 英語音階名をドレミファソラシドに変換する辞書
-note_to_doremi = {
-    'C': 'ド',
-    'C#': 'ド#',
-    'D': 'レ',
-    'D#': 'レ#',
-    'E': 'ミ',
-    'F': 'ファ',
-    'F#': 'ファ#',
-    'G': 'ソ',
-    'G#': 'ソ#',
-    'A': 'ラ',
-    'A#': 'ラ#',
-    'B': 'シ'
-}
-
 # 音声データをリアルタイムで処理するコールバック関数
 def audio_callback(indata, frames, time, status):
     if status:
@@ -39,12 +25,10 @@ def audio_callback(indata, frames, time, status):
         valid_f0 = f0[~np.isnan(f0)]
         if len(valid_f0) > 0:
             dominant_f0 = np.mean(valid_f0)
-            note = librosa.hz_to_note(dominant_f0)
+            code = int(hz_to_codes(dominant_f0))  # 周波数を対応する音高コードに変換する
             
-            # 音階をドレミファソラシドに変換
-            base_note = note[:-1]  # 音階（例: C, D#, E）
-            octave = note[-1]      # オクターブ番号（例: 4）
-            doremi_note = note_to_doremi.get(base_note, "不明") + octave  # ドレミファソラシド形式に変換
+            # 音階をドレミファソラシド形式(♯つき)に変換
+            doremi_note = code_to_label(code, sharps=True)
             
             print(f"基本周波数: {dominant_f0:.2f} Hz, 音階: {doremi_note}")
         else:
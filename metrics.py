@@ -0,0 +1,169 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# リアルタイム処理の計測(段階ごとの処理時間のヒストグラム、カウンタ、キューの深さ)
+# 1ブロックごとに print する代わりにプロセスの中で集計だけしておき、一定間隔で要約を表示(またはJSONに書き出し)したり、
+# ローカルのHTTP(GET /metrics)でJSONとして返したりする
+# 記録はロックを取って数を足すだけなので、オーディオコールバックからも呼べる
+
+# 処理時間のヒストグラムのバケットの上限(秒、10マイクロ秒から約10秒まで約19%ずつ)
+TIMER_BUCKETS = [1e-5 * 2 ** (k / 4) for k in range(81)]
+
+
+# 固定のバケットに数えるだけのヒストグラム(値を全部は残さないので、長く動かしてもメモリは増えない)
+class Histogram:
+    def __init__(self, bounds=TIMER_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最後は最大のバケットを超えた分
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # q (0〜1) 分位点のおおよその値(そのバケットの上限、最大値を超えない)
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}  # 名前 -> 値を返す関数(キューの深さなど、読むときに呼ぶ)
+        self.started = time.monotonic()
+        self.stopping = threading.Event()
+        self.server = None
+
+    # name の段階の処理時間(秒)を記録する
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    # with metrics.timer("pitch"): ... の中の処理時間を記録する
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    # 読むときに func() を呼んで値を得るゲージを登録する
+    def gauge(self, name, func):
+        with self.lock:
+            self.gauges[name] = func
+
+    def snapshot(self):
+        with self.lock:
+            timers = {name: histogram.summary() for name, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        values = {}
+        for name, func in gauges.items():
+            try:
+                values[name] = func()
+            except Exception as e:
+                values[name] = f"エラー: {e}"
+        return {"uptime": time.monotonic() - self.started, "timers": timers, "counters": counters, "gauges": values}
+
+    # 人が読むための要約(処理時間はミリ秒)
+    def format_summary(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        lines = [f"計測 ({snapshot['uptime']:.0f}秒経過)"]
+        for name, summary in sorted(snapshot["timers"].items()):
+            lines.append(f"  {name}: {summary['count']}回, 平均 {summary['mean'] * 1000:.2f}ms, "
+                         f"p95 {summary['p95'] * 1000:.2f}ms, p99 {summary['p99'] * 1000:.2f}ms, 最大 {summary['max'] * 1000:.2f}ms")
+        if snapshot["counters"]:
+            lines.append("  " + ", ".join(f"{name}: {value}" for name, value in sorted(snapshot["counters"].items())))
+        if snapshot["gauges"]:
+            lines.append("  " + ", ".join(f"{name}: {value}" for name, value in sorted(snapshot["gauges"].items())))
+        return "\n".join(lines)
+
+    # interval 秒ごとに要約を表示する(path を指定するとJSONで書き出す)
+    def start_dump(self, interval, path=None):
+        def dump_loop():
+            while not self.stopping.wait(interval):
+                self.dump(path)
+        threading.Thread(target=dump_loop, daemon=True).start()
+
+    def dump(self, path=None):
+        snapshot = self.snapshot()
+        if path is None:
+            print(self.format_summary(snapshot))
+            return
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(temporary_path, path)
+
+    # ローカルのHTTPサーバで GET /metrics に JSON を返す(別スレッドで動かす)
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot(), ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # アクセスごとの表示はしない
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"http://{host}:{self.server.server_address[1]}/metrics で計測結果を返します")
+        return self.server
+
+    def close(self):
+        self.stopping.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# プロセス全体で共有する計測
+metrics = Metrics()
@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from note_events import NoteEvent, Snapshot, decode_messages, code_to_doremi
+from socket_connector import FRAME_HEADER, decode_frame_body
+
+# 手元で動かす模擬Unity
+# バックエンド(SocketConnector)が待ち受けているポートに接続し、届いたフレームを受け取って
+# 音符イベントのキャプチャ時刻からの遅延、受信数、再接続にかかった時間を記録する
+# キャプチャ時刻は time.monotonic() を前提にしている(同じマシンのプロセス間で共通の時計)
+
+
+class MockUnityClient:
+    def __init__(self, host="127.0.0.1", port=5000, reconnect_every=None, reconnect_delay=0.5, verbose=False):
+        self.host = host
+        self.port = port
+        self.reconnect_every = reconnect_every
+        self.reconnect_delay = reconnect_delay
+        self.verbose = verbose
+
+        self.latencies = []     # 音符イベントの遅延(秒)
+        self.frames = 0
+        self.events = 0
+        self.snapshots = 0
+        self.bytes_received = 0
+        self.reconnects = 0
+        self.reconnect_gaps = []  # 切断してから次のフレームが届くまでの時間(秒)
+        self.resynced = 0         # 再接続後に最初に届いたのがスナップショットだった回数
+        self.last_seq = -1
+        self.missing_events = 0
+
+    # バックエンドが待ち受けを始めるまで接続を試みる
+    async def connect(self, deadline):
+        while time.monotonic() < deadline:
+            try:
+                return await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(0.05)
+        return None, None
+
+    def handle_payload(self, data_type, data, after_reconnect):
+        now = time.monotonic()
+        messages = decode_messages(data) if isinstance(data, bytes) else [data]
+        for k, message in enumerate(messages):
+            if isinstance(message, NoteEvent):
+                self.events += 1
+                self.latencies.append(now - message.timestamp)
+                if message.seq > self.last_seq + 1:
+                    self.missing_events += message.seq - self.last_seq - 1
+                self.last_seq = max(self.last_seq, message.seq)
+                if self.verbose:
+                    print(f"[{self.port}] {data_type}: #{message.seq} 位置 {message.position} {code_to_doremi(message.pitch)}")
+            elif isinstance(message, Snapshot):
+                self.snapshots += 1
+                if after_reconnect and k == 0:
+                    self.resynced += 1
+                # スナップショットまでのイベントは受け取ったものとみなす
+                self.last_seq = max(self.last_seq, message.seq - 1)
+            elif self.verbose:
+                print(f"[{self.port}] {data_type}: {message}")
+
+    # duration 秒の間フレームを受け取り続ける(reconnect_every 秒ごとに自分から切断して再接続する)
+    async def run(self, duration):
+        deadline = time.monotonic() + duration
+        disconnected_at = None
+        while time.monotonic() < deadline:
+            reader, writer = await self.connect(deadline)
+            if reader is None:
+                break
+            next_disconnect = time.monotonic() + self.reconnect_every if self.reconnect_every else deadline
+            after_reconnect = disconnected_at is not None
+            try:
+                while True:
+                    timeout = min(next_disconnect, deadline) - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        header = await asyncio.wait_for(reader.readexactly(FRAME_HEADER.size), timeout)
+                        length, encoding, type_length = FRAME_HEADER.unpack(header)
+                        body = await reader.readexactly(length)
+                    except asyncio.TimeoutError:
+                        break
+                    except asyncio.IncompleteReadError:
+                        break
+                    if disconnected_at is not None:
+                        self.reconnect_gaps.append(time.monotonic() - disconnected_at)
+                        disconnected_at = None
+                    self.frames += 1
+                    self.bytes_received += FRAME_HEADER.size + length
+                    self.handle_payload(*decode_frame_body(encoding, type_length, body), after_reconnect)
+                    after_reconnect = False
+            finally:
+                writer.close()
+
+            if time.monotonic() < deadline:
+                # 切断して少し待ってから再接続する
+                disconnected_at = time.monotonic()
+                self.reconnects += 1
+                await asyncio.sleep(self.reconnect_delay)
+
+    def summary(self):
+        latencies_ms = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "port": self.port,
+            "frames": self.frames,
+            "events": self.events,
+            "snapshots": self.snapshots,
+            "bytes": self.bytes_received,
+            "missing_events": self.missing_events,
+            "reconnects": self.reconnects,
+            "resynced": self.resynced,
+            "reconnect_gaps": self.reconnect_gaps,
+            "latencies_ms": latencies_ms.tolist(),
+        }
+
+
+# 複数のポートに模擬Unityをつないで、全員分の結果を返す
+async def run_clients(ports, duration, host="127.0.0.1", reconnect_every=None, verbose=False):
+    clients = [MockUnityClient(host, port, reconnect_every, verbose=verbose) for port in ports]
+    await asyncio.gather(*(client.run(duration) for client in clients))
+    return [client.summary() for client in clients]
+
+def main():
+    parser = argparse.ArgumentParser(description="模擬Unity: バックエンドに接続して届いた音符を表示する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--duration", type=float, default=60.0, help="受信を続ける秒数")
+    parser.add_argument("--reconnect-every", type=float, default=None, help="この秒数ごとに切断して再接続する")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_clients([args.port], args.duration, args.host, args.reconnect_every, verbose=True))[0]
+    latencies = np.array(summary["latencies_ms"])
+    print(f"フレーム数: {summary['frames']}, 音符イベント: {summary['events']}, スナップショット: {summary['snapshots']}, "
+          f"遅延 p50 {np.percentile(latencies, 50):.2f} ms / p95 {np.percentile(latencies, 95):.2f} ms, "
+          f"再接続: {summary['reconnects']}回")
+
+if __name__ == "__main__":
+    main()
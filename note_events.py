@@ -0,0 +1,99 @@
+import struct
+from collections import namedtuple
+
+# 音高コード(MIDIノート番号、ド4 = 60。休符と不明な音は負の値)と音階の変換は note_table の表を使う
+from note_table import REST_CODE, label_to_code as doremi_to_code, code_to_label as code_to_doremi
+
+# Unityへ送る差分の音符イベントと、そのバイナリ形式
+# 演奏の全履歴を毎回送る代わりに、新しい音符ごとに固定長のイベントを送り、
+# 再接続したクライアントが状態を取り戻せるように、一定間隔で全体のスナップショットも送る
+#
+# バイナリ形式(リトルエンディアン)
+#   イベント:       type(B)=1, seq(I), position(i), pitch(h), confidence(f), timestamp(d)  計23バイト
+#   スナップショット: type(B)=2, seq(I), position(i), count(I), pitch(h) x count
+#   (スナップショットの seq は、それに含まれていない最初のイベントの通し番号)
+
+EVENT_TYPE = 1
+SNAPSHOT_TYPE = 2
+EVENT_FORMAT = struct.Struct("<BIihfd")
+SNAPSHOT_HEADER_FORMAT = struct.Struct("<BIiI")
+
+# 1つの音符イベント
+# seq: 通し番号, position: 楽譜上の位置, pitch: 音高コード, confidence: 有声の確からしさ(0〜1), timestamp: キャプチャ時刻(秒)
+NoteEvent = namedtuple('NoteEvent', ['seq', 'position', 'pitch', 'confidence', 'timestamp'])
+Snapshot = namedtuple('Snapshot', ['seq', 'position', 'pitches'])
+
+def encode_event(event):
+    return EVENT_FORMAT.pack(EVENT_TYPE, event.seq, event.position, event.pitch, event.confidence, event.timestamp)
+
+def encode_snapshot(snapshot):
+    header = SNAPSHOT_HEADER_FORMAT.pack(SNAPSHOT_TYPE, snapshot.seq, snapshot.position, len(snapshot.pitches))
+    return header + struct.pack(f"<{len(snapshot.pitches)}h", *snapshot.pitches)
+
+# バイナリのメッセージ(複数のイベントを連結したものも可)を NoteEvent / Snapshot のリストに戻す
+# data はフレーム1つ分の本体なので、途中で切れていれば(メッセージの一部しかなければ)ValueError にする
+def decode_messages(data):
+    messages = []
+    offset = 0
+    while offset < len(data):
+        message_type = data[offset]
+        try:
+            if message_type == EVENT_TYPE:
+                _, *fields = EVENT_FORMAT.unpack_from(data, offset)
+                messages.append(NoteEvent(*fields))
+                offset += EVENT_FORMAT.size
+            elif message_type == SNAPSHOT_TYPE:
+                _, seq, position, count = SNAPSHOT_HEADER_FORMAT.unpack_from(data, offset)
+                offset += SNAPSHOT_HEADER_FORMAT.size
+                pitches = list(struct.unpack_from(f"<{count}h", data, offset))
+                offset += 2 * count
+                messages.append(Snapshot(seq, position, pitches))
+            else:
+                raise ValueError(f"不明なメッセージの種類です: {message_type}")
+        except struct.error:
+            raise ValueError(f"メッセージが途中で切れています({offset}バイト目から)") from None
+    return messages
+
+# デバッグ用のJSON形式
+def event_to_json(event):
+    return {"type": "note", **event._asdict(), "note": code_to_doremi(event.pitch)}
+
+def snapshot_to_json(snapshot):
+    return {"type": "snapshot", "seq": snapshot.seq, "position": snapshot.position,
+            "key": ','.join(code_to_doremi(code) for code in snapshot.pitches)}
+
+
+# 検出した音符を通し番号つきのイベントにして、定期的にスナップショットを作る
+# wire_format が "binary" なら bytes を、"json" なら dict を返す
+class NoteEventEncoder:
+    def __init__(self, length, wire_format="binary", snapshot_interval=32):
+        if wire_format not in ("binary", "json"):
+            raise ValueError(f"不明な形式です: {wire_format}")
+        self.wire_format = wire_format
+        self.snapshot_interval = snapshot_interval
+        self.pitches = [REST_CODE] * length  # 楽譜の位置ごとの最新の音高コード
+        self.seq = 0
+        self.position = 0
+
+    # 音符を1つ追加し、送るべきイベントとスナップショット(なければ None)を返す
+    def note(self, position, note, confidence, timestamp):
+        code = doremi_to_code(note)
+        event = NoteEvent(self.seq, position, code, float(confidence), float(timestamp))
+        self.seq += 1
+        self.position = position
+        if 0 <= position < len(self.pitches):
+            self.pitches[position] = code
+
+        snapshot = None
+        if self.seq % self.snapshot_interval == 0:
+            snapshot = self.snapshot()
+        if self.wire_format == "json":
+            return event_to_json(event), snapshot
+        return encode_event(event), snapshot
+
+    # 現在の全体の状態
+    def snapshot(self):
+        snapshot = Snapshot(self.seq, self.position, list(self.pitches))
+        if self.wire_format == "json":
+            return snapshot_to_json(snapshot)
+        return encode_snapshot(snapshot)
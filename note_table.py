@@ -0,0 +1,91 @@
+import numpy as np
+
+# 周波数と音階の対応表(どのファイルからも同じものを使う)
+# 音高コードは MIDI ノート番号(ド4 = 60)の整数で、休符と不明な音は負の値にする
+# librosa.hz_to_note の文字列を切り出して辞書で引く代わりに、f0 の配列をまとめて音高コードに変換し、
+# 判定や比較は整数のコードのまま行って、結果を表示・保存・送信するときだけ「ファ5」形式の音階にする
+
+REST_CODE = -1
+UNKNOWN_CODE = -2
+REST_LABEL = "休符"
+UNKNOWN_LABEL = "不明"
+
+# 半音ごとの音名(楽譜の音階に合わせて、♯は1つ下の音名にまとめる)
+PITCH_CLASS_LABELS = ['ド', 'ド', 'レ', 'レ', 'ミ', 'ファ', 'ファ', 'ソ', 'ソ', 'ラ', 'ラ', 'シ']
+# ♯を区別する音名(表示用)
+SHARP_PITCH_CLASS_LABELS = ['ド', 'ド#', 'レ', 'レ#', 'ミ', 'ファ', 'ファ#', 'ソ', 'ソ#', 'ラ', 'ラ#', 'シ']
+SHARPS = np.array([0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0])
+
+# MIDI ノート番号 0〜127 ごとの表
+MIDI_CODES = np.arange(128)
+OCTAVES = MIDI_CODES // 12 - 1
+NATURAL_CODES = MIDI_CODES - SHARPS[MIDI_CODES % 12]  # ♯を1つ下の音にまとめた音高コード
+LABELS = np.array([f"{PITCH_CLASS_LABELS[code % 12]}{code // 12 - 1}" for code in MIDI_CODES], dtype=object)
+SHARP_LABELS = np.array([f"{SHARP_PITCH_CLASS_LABELS[code % 12]}{code // 12 - 1}" for code in MIDI_CODES], dtype=object)
+
+# 音階 -> 音高コード(♯つきの音階も受け付ける)
+LABEL_TO_CODE = {REST_LABEL: REST_CODE}
+LABEL_TO_CODE.update((label, int(code)) for code, label in zip(MIDI_CODES, SHARP_LABELS))
+LABEL_TO_CODE.update((label, int(code)) for code, label in zip(NATURAL_CODES, LABELS))
+
+# 英語の音名(例: "G3", "F#4", "Bb5")を MIDI ノート番号にする(librosa.note_to_midi を読み込まずに済ませる)
+ENGLISH_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+ACCIDENTALS = {'#': 1, '♯': 1, 'b': -1, '♭': -1}
+
+def note_to_midi(name):
+    step = ENGLISH_PITCH_CLASSES.get(name[:1].upper())
+    accidentals = name[1:].rstrip("-0123456789")
+    octave = name[1 + len(accidentals):]
+    if step is None or not octave.lstrip("-").isdigit() or any(a not in ACCIDENTALS for a in accidentals):
+        raise ValueError(f"音名を読み取れません: {name}")
+    return (int(octave) + 1) * 12 + step + sum(ACCIDENTALS[a] for a in accidentals)
+
+def midi_to_hz(midi):
+    return 440.0 * 2.0 ** ((np.asarray(midi, dtype=np.float64) - 69) / 12)
+
+def note_to_hz(name):
+    return float(midi_to_hz(note_to_midi(name)))
+
+# 周波数(Hz、配列でもよい)を MIDI ノート番号の実数にする(nan と 0 以下は nan)
+def hz_to_midi(f0):
+    f0 = np.asarray(f0, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(f0 > 0, 12 * np.log2(f0 / 440.0) + 69, np.nan)
+
+# 周波数をいちばん近い半音の音高コードにする(nan は休符、表の範囲外は不明)
+def hz_to_codes(f0):
+    midi = np.round(hz_to_midi(f0))
+    codes = np.full(midi.shape, REST_CODE, dtype=np.int64)
+    voiced = ~np.isnan(midi)
+    codes[voiced] = np.where((midi[voiced] >= 0) & (midi[voiced] < len(MIDI_CODES)), midi[voiced], UNKNOWN_CODE)
+    return codes
+
+# 周波数が音高コードの音からどれだけずれているか(セント)
+def hz_to_cents(f0, codes):
+    return 100 * (hz_to_midi(f0) - codes)
+
+# 音高コードの♯を1つ下の音にまとめる(休符・不明はそのまま)
+def natural_codes(codes):
+    codes = np.asarray(codes)
+    return np.where(codes >= 0, NATURAL_CODES[np.maximum(codes, 0)], codes)
+
+# 音高コードがオクターブ octaves の範囲内か
+def in_octaves(codes, octaves=(4, 5, 6)):
+    codes = np.asarray(codes)
+    return (codes >= (min(octaves) + 1) * 12) & (codes < (max(octaves) + 2) * 12)
+
+# 音高コードを「ファ5」形式の音階にする(sharps=True なら♯を区別する)
+def code_to_label(code, sharps=False):
+    if code == REST_CODE:
+        return REST_LABEL
+    if not 0 <= code < len(MIDI_CODES):
+        return UNKNOWN_LABEL
+    return (SHARP_LABELS if sharps else LABELS)[code]
+
+# 音高コードの配列を音階のリストにする
+def codes_to_labels(codes, sharps=False):
+    return [code_to_label(int(code), sharps) for code in np.asarray(codes).ravel()]
+
+# 「ファ5」形式の音階を音高コードにする(知らない音階は不明)
+def label_to_code(label):
+    return LABEL_TO_CODE.get(label, UNKNOWN_CODE)
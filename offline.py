@@ -0,0 +1,114 @@
+import numpy as np
+
+from pitch_backends import get_estimator
+from note_table import REST_CODE, REST_LABEL, hz_to_codes, hz_to_cents, natural_codes, in_octaves, code_to_label, label_to_code
+from recognizer import ENERGY_GATE, Recognition, dominant_pitch
+
+# 録音全体を1回でピッチ推定してから、八分音符のマスごとに temp.ms_recognition と同じ判定をする一括モード
+# ピッチ推定(フレームごとの f0・有声確率・RMS)は八分音符の長さによらないので、feature_cache に録音ごとに残しておけば、
+# BPMや楽譜を変えて採点し直すときはマスごとの判定だけで済む
+
+# pitch_track で求める配列を変えたときに上げる(古いキャッシュを使わないように、キャッシュのキーに含める)
+PITCH_TRACK_VERSION = 2
+
+# フレームごとの RMS(k 番目のフレームは中心 k * hop_length の前後 hop_length サンプル、範囲外は無音とする)
+def frame_rms(audio_data, hop_length, first, last):
+    start = first * hop_length - hop_length // 2
+    samples = np.zeros((last - first) * hop_length)
+    lo, hi = max(0, start), min(len(audio_data), start + len(samples))
+    if hi > lo:
+        samples[lo - start:hi - start] = audio_data[lo:hi]
+    return np.sqrt(np.mean(np.square(samples.reshape(-1, hop_length)), axis=1))
+
+# 音声全体のフレームごとの f0、有声確率、RMS を求める(k 番目のフレームの中心は k * hop_length)
+# chunk_frames フレームずつ(前後に margin_frames フレームの余白をつけて)推定するので、録音が長くてもメモリの使用量は一定
+# (audio_data は np.memmap でもよい)
+def pitch_track(audio_data, sr=22050, hop_length=512, backend="pyin", chunk_frames=2048, margin_frames=16):
+    n_frames = 1 + len(audio_data) // hop_length if len(audio_data) else 0
+    f0 = np.full(n_frames, np.nan)
+    voiced_prob = np.zeros(n_frames)
+    rms = np.zeros(n_frames)
+    if n_frames == 0:
+        return f0, voiced_prob, rms
+
+    estimator = get_estimator(backend, sr=sr, hop_length=hop_length)
+    for first in range(0, n_frames, chunk_frames):
+        last = min(first + chunk_frames, n_frames)
+        chunk_start = max(0, first - margin_frames) * hop_length
+        chunk_stop = min(len(audio_data), (last + margin_frames) * hop_length)
+        chunk_f0, _, chunk_prob = estimator.estimate(np.asarray(audio_data[chunk_start:chunk_stop], dtype=np.float32))
+
+        # 余白の部分のフレームは除いて、このチャンクのフレームだけを残す
+        frames = chunk_start // hop_length + np.arange(len(chunk_f0))
+        inside = (frames >= first) & (frames < last)
+        f0[frames[inside]] = chunk_f0[inside]
+        voiced_prob[frames[inside]] = chunk_prob[inside]
+        rms[first:last] = frame_rms(audio_data, hop_length, first, last)
+    return f0, voiced_prob, rms
+
+# フレームごとの f0・有声確率・RMS を八分音符のマスごとにまとめて、マスごとの Recognition のリストを返す
+# temp.ms_recognition と同じく、RMS が energy_gate より小さいマスは休符、有声のフレームがなければ休符、
+# 代表の f0 は recognizer.dominant_pitch で選び、オクターブ4〜6以外は直前の(範囲内の)音階にする
+# temp.split_audio と同じく、先頭の skip_cells マス分は読み飛ばす(n_samples は音声全体のサンプル数)
+def track_to_recognitions(f0, voiced_prob, rms, n_samples, sr=22050, split_time=0.27, hop_length=512, skip_cells=2,
+                          energy_gate=ENERGY_GATE, pitch_method="mode", previous_note="不明"):
+    cell_size = int(sr * split_time)
+    skip = skip_cells * cell_size
+    n_cells = int(np.ceil(max(0, n_samples - skip) / cell_size))
+    if n_cells == 0:
+        return []
+
+    # フレームの中心がどのマスに入るか(フレームは位置の順に並んでいるので、マスごとに連続した範囲になる)
+    frame_positions = np.arange(len(f0)) * hop_length - skip
+    inside = (frame_positions >= 0) & (frame_positions < n_cells * cell_size)
+    f0, voiced_prob, rms = f0[inside], voiced_prob[inside], rms[inside]
+    cells = frame_positions[inside] // cell_size
+    bounds = np.searchsorted(cells, np.arange(n_cells + 1))
+    counts = np.diff(bounds)
+    cell_rms = np.sqrt(np.bincount(cells, weights=np.square(rms), minlength=n_cells) / np.maximum(counts, 1))
+    cell_prob = np.bincount(cells, weights=voiced_prob, minlength=n_cells) / np.maximum(counts, 1)
+
+    previous_code = label_to_code(previous_note)
+    recognitions = []
+    for k in range(n_cells):
+        # 休符は recognizer.NoteRecognizer.rest と同じ形にする(ピッチ推定を省いたマスは有声確率 0)
+        rest = Recognition(REST_LABEL, REST_CODE, np.nan, float(cell_prob[k]), float(cell_rms[k]), 0.0, False)
+        if counts[k] == 0 or (energy_gate is not None and cell_rms[k] < energy_gate):
+            recognitions.append(rest._replace(voiced_prob=0.0, gated=True))
+            continue
+        cell_f0 = f0[bounds[k]:bounds[k + 1]]
+        valid_f0 = cell_f0[~np.isnan(cell_f0)]
+        if len(valid_f0) == 0:
+            recognitions.append(rest)
+            continue
+
+        dominant_f0 = dominant_pitch(valid_f0, pitch_method)
+        nearest_code = int(hz_to_codes(dominant_f0))
+        code = int(natural_codes(nearest_code))
+        if in_octaves(code):
+            previous_code = code
+        recognitions.append(Recognition(code_to_label(previous_code), previous_code, dominant_f0, float(cell_prob[k]),
+                                        float(cell_rms[k]), float(hz_to_cents(dominant_f0, nearest_code)), False))
+    return recognitions
+
+# 音声全体に対してピッチ推定を行い、八分音符ごとの Recognition のリストを返す
+def transcribe_batch(audio_data, sr=22050, split_time=0.27, hop_length=512, backend="pyin", skip_cells=2,
+                     chunk_frames=2048, margin_frames=16):
+    f0, voiced_prob, rms = pitch_track(audio_data, sr, hop_length, backend, chunk_frames, margin_frames)
+    return track_to_recognitions(f0, voiced_prob, rms, len(audio_data), sr, split_time, hop_length, skip_cells)
+
+# AudioReader で開いた録音の pitch_track を、reader.cache のキャッシュがあればそこから読み込む
+def cached_pitch_track(reader, hop_length=512, backend="pyin", chunk_frames=2048, margin_frames=16):
+    params = {"sr": reader.sr, "hop_length": hop_length, "backend": backend,
+              "chunk_frames": chunk_frames, "margin_frames": margin_frames, "version": PITCH_TRACK_VERSION}
+
+    def compute():
+        f0, voiced_prob, rms = pitch_track(reader.audio, reader.sr, hop_length, backend, chunk_frames, margin_frames)
+        return {"f0": f0, "voiced_prob": voiced_prob, "rms": rms}
+    arrays = reader.cache.get_or_compute(reader.content_hash, "pitch", params, compute, keep=(reader.cache_path,))
+    return arrays["f0"], arrays["voiced_prob"], arrays["rms"]
+
+# transcribe_batch と同じ結果を、録音のピッチ推定のキャッシュを使って返す
+def transcribe_reader(reader, split_time=0.27, hop_length=512, backend="pyin", skip_cells=2):
+    f0, voiced_prob, rms = cached_pitch_track(reader, hop_length, backend)
+    return track_to_recognitions(f0, voiced_prob, rms, len(reader), reader.sr, split_time, hop_length, skip_cells)
@@ -1,96 +1,213 @@
 import numpy as np
-import sounddevice as sd
-import librosa
 import queue
-from scipy.signal import butter, lfilter
-import matplotlib.pyplot as plt
+from collections import deque
 
 # 設定
 samplerate = 22050  # サンプリングレート
 blocksize = 1024    # ブロックサイズ
-onset_threshold = 0.01  # オンセット検出の閾値
+onset_threshold = 0.2  # オンセット検出の閾値(正規化したスペクトルフラックスが直近の平均をこれだけ超えたらオンセット)
 noise_gate_threshold = 0.02  # ノイズゲートの閾値
 
+# ファ#4の周波数範囲に設定（約368.29Hz〜371.69Hz）
+lowcut = 368.29
+highcut = 371.69
+
 # バンドパスフィルタを作成（ファ#4の範囲にフィルタ）
+# 帯域が狭いと (b, a) 形式では係数の丸め誤差で不安定になるので、2次セクション(SOS)形式で作る
+# (scipy.signal は読み込みに時間がかかるので、フィルタを使うときだけ読み込む)
 def butter_bandpass(lowcut, highcut, fs, order=5):
+    from scipy.signal import butter
     nyq = 0.5 * fs
     low = lowcut / nyq
     high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
-
-def bandpass_filter(data, lowcut, highcut, fs):
-    b, a = butter_bandpass(lowcut, highcut, fs)
-    return lfilter(b, a, data)
+    return butter(order, [low, high], btype='band', output='sos')
 
 def noise_gate(data, threshold):
     # ノイズゲートを適用
     return np.where(np.abs(data) < threshold, 0, data)
 
+
+# ブロックごとに少しずつ音声を受け取って、オンセット(音の立ち上がり)を検出するストリーミングのオンセット検出器
+# フィルタは最初に1回だけ設計し、フィルタの内部状態(zi)・直近のスペクトル・スペクトルフラックスの包絡を
+# ブロックをまたいで保持するので、ブロックの境目で過渡応答が出たり、同じ区間を何度も計算したりしない
+class StreamingOnsetDetector:
+    # band: (下限Hz, 上限Hz) のバンドパスフィルタ(None ならフィルタなし)
+    # gate_threshold: ノイズゲートの閾値(None ならゲートなし)
+    # delta: 正規化したフラックスが直近 average_seconds 秒の平均をこれだけ超えたらオンセットにする
+    # wait_seconds: オンセットの最小間隔, decay_seconds: 正規化に使う最大値が半分になるまでの秒数
+    # keep_envelope: True なら全フレームの正規化したフラックスを envelope_history に残す(オフラインの解析用)
+    def __init__(self, sr=22050, hop_length=512, n_fft=2048, band=None, gate_threshold=None, delta=onset_threshold,
+                 average_seconds=0.1, wait_seconds=0.1, decay_seconds=4.0, order=5, keep_envelope=False):
+        self.sr = sr
+        self.keep_envelope = keep_envelope
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.gate_threshold = gate_threshold
+        self.delta = delta
+        self.sos = butter_bandpass(band[0], band[1], sr, order) if band is not None else None
+        self.window = np.hanning(n_fft)
+        self.average_frames = max(1, int(round(average_seconds * sr / hop_length)))
+        self.wait_frames = max(1, int(round(wait_seconds * sr / hop_length)))
+        self.decay = 0.5 ** (hop_length / sr / decay_seconds)
+        self.reset()
+
+    def reset(self):
+        self.zi = np.zeros((len(self.sos), 2)) if self.sos is not None else None
+        self.frame = np.zeros(self.n_fft)  # 直近 n_fft サンプル
+        self.pending = np.zeros(0)         # フレームにまだ入っていないサンプル
+        self.previous_spectrum = None
+        self.envelope = deque(maxlen=self.average_frames + 2)  # 直近の正規化したフラックス
+        self.peak = 1e-6  # フラックスの(ゆっくり減衰する)最大値
+        self.frames_seen = 0
+        self.samples_seen = 0
+        self.last_onset_frame = -self.wait_frames
+        self.onsets = []  # 検出したオンセットのサンプル位置
+        self.envelope_history = [] if self.keep_envelope else None
+
+    # フィルタの状態を引き継いでノイズゲートとバンドパスフィルタをかける
+    def filter(self, block):
+        if self.gate_threshold is not None:
+            block = noise_gate(block, self.gate_threshold)
+        if self.sos is not None:
+            from scipy.signal import sosfilt
+            block, self.zi = sosfilt(self.sos, block, zi=self.zi)
+        return block
+
+    # 1フレーム分のスペクトルフラックス(対数振幅の増加分の平均)を計算する
+    def flux(self):
+        spectrum = np.log1p(100 * np.abs(np.fft.rfft(self.frame * self.window)))
+        previous, self.previous_spectrum = self.previous_spectrum, spectrum
+        if previous is None:
+            return 0.0
+        return float(np.mean(np.maximum(spectrum - previous, 0)))
+
+    # 新しいフレームのフラックスを包絡に加え、1つ前のフレームがオンセットかを判定する
+    # (1つ前のフレームが前後のフレームより大きく、直近の平均を delta 以上超えていればオンセット)
+    def pick_peak(self, flux):
+        self.peak = max(flux, self.peak * self.decay)
+        self.envelope.append(flux / self.peak)
+        if self.envelope_history is not None:
+            self.envelope_history.append(self.envelope[-1])
+        if len(self.envelope) < 3:
+            return False
+        envelope = list(self.envelope)
+        before, candidate, after = envelope[-3], envelope[-2], envelope[-1]
+        average = np.mean(envelope[:-1])
+        candidate_frame = self.frames_seen - 1
+        if candidate >= before and candidate > after and candidate >= average + self.delta \
+                and candidate_frame - self.last_onset_frame >= self.wait_frames:
+            self.last_onset_frame = candidate_frame
+            return True
+        return False
+
+    # 新しい音声ブロックを追加し、新しく検出したオンセットのサンプル位置(最初のブロックの先頭が 0)のリストを返す
+    def update(self, block):
+        self.pending = np.concatenate([self.pending, self.filter(np.asarray(block, dtype=np.float64))])
+        self.samples_seen += len(block)
+        onsets = []
+        while len(self.pending) >= self.hop_length:
+            hop, self.pending = self.pending[:self.hop_length], self.pending[self.hop_length:]
+            self.frame = np.concatenate([self.frame[self.hop_length:], hop])
+            self.frames_seen += 1
+            if self.pick_peak(self.flux()):
+                # 1つ前のフレームで新しい音が入ってきた位置(フレームの末尾のホップ)をオンセットとする
+                onsets.append((self.frames_seen - 1) * self.hop_length)
+        self.onsets.extend(onsets)
+        return onsets
+
+
+# 音声全体のオンセットの包絡(フレームごとの正規化したフラックス)と、オンセットのサンプル位置の配列を返す
+def onset_envelope(audio_data, sr=22050, block_size=8192, **kwargs):
+    detector = StreamingOnsetDetector(sr=sr, keep_envelope=True, **kwargs)
+    for start_index in range(0, len(audio_data), block_size):
+        detector.update(audio_data[start_index:start_index + block_size])
+    return np.array(detector.envelope_history), np.array(detector.onsets, dtype=np.int64)
+
+# AudioReader で開いた録音の onset_envelope を、reader.cache のキャッシュがあればそこから読み込む
+def cached_onset_envelope(reader, block_size=8192, **kwargs):
+    params = {"sr": reader.sr, "block_size": block_size, **kwargs}
+
+    def compute():
+        envelope, onsets = onset_envelope(reader.audio, reader.sr, block_size, **kwargs)
+        return {"envelope": envelope, "onsets": onsets}
+    arrays = reader.cache.get_or_compute(reader.content_hash, "onset", params, compute, keep=(reader.cache_path,))
+    return arrays["envelope"], arrays["onsets"]
+
+# 音声全体をオンセットで区切った区間を順番に返す(オフラインでの音の切り出し用)
+# 区間が max_length サンプルより長ければ max_length ごとに分け、min_length より短い区間は次の区間につなげる
+# onsets: 求めてあるオンセットのサンプル位置(cached_onset_envelope など。None ならここで検出する)
+def segment_by_onsets(audio_data, sr=22050, max_length=None, min_length=None, block_size=8192, onsets=None, **kwargs):
+    if onsets is None:
+        detector = StreamingOnsetDetector(sr=sr, **kwargs)
+        for start_index in range(0, len(audio_data), block_size):
+            detector.update(audio_data[start_index:start_index + block_size])
+        onsets = detector.onsets
+    boundaries = [0] + [int(onset) for onset in onsets if 0 < onset < len(audio_data)] + [len(audio_data)]
+
+    start = 0
+    for boundary in boundaries[1:]:
+        if min_length and boundary - start < min_length and boundary < len(audio_data):
+            continue
+        while max_length and boundary - start > max_length:
+            yield start, start + max_length
+            start += max_length
+        if boundary > start:
+            yield start, boundary
+        start = boundary
+
+
 # 音声データを格納するキュー
 audio_queue = queue.Queue()
-onset_detected = False  # オンセット検知フラグ
-audio_buffer = []  # 音声データを蓄積するバッファ
 
 # 音声データ取得のコールバック関数
 def callback(indata, frames, time, status):
     if status:
         print(status)
     # キューに音声データを追加
-    audio_queue.put(indata.copy())
+    audio_queue.put(indata[:, 0].copy())
 
-# オンセット検出用関数
-def detect_onset(y):
-    # オンセットを検出
-    onsets = librosa.onset.onset_detect(y=y, sr=samplerate, hop_length=512, units='time')
-    return onsets
+# マイクの音声から目標の音(ファ#4)のオンセットを検出し、演奏が始まった時間を表示する
+# 半音ごとのフィルタバンクで音域の全部の半音のエネルギーとオンセットを1回で計算し、その中から目標の音を探す
+def main(target_notes=("F#4",)):
+    import sounddevice as sd
+    import matplotlib.pyplot as plt
+    from filterbank import SemitoneFilterbank
 
-# ファ#4の周波数範囲に設定（約368.29Hz〜371.69Hz）
-lowcut = 368.29
-highcut = 371.69
+    filterbank = SemitoneFilterbank(sr=samplerate)
+    targets = {filterbank.midi[filterbank.column(note)] for note in target_notes}
+    recent_energy = deque(maxlen=64)  # 表示用に直近のフレームの半音ごとのエネルギーを残す
+
+    # ストリーミングの開始
+    with sd.InputStream(samplerate=samplerate, channels=1, blocksize=blocksize, callback=callback):
+        print("リアルタイム音声検知を開始します...")
+
+        while True:
+            # キューにデータが届くまで待つ(空のキューを回し続けない)
+            try:
+                audio_data = audio_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            frames = filterbank.update(noise_gate(audio_data, noise_gate_threshold))
+            recent_energy.extend(frames.energy)
+            onsets = [position for position, midi in frames.onsets if midi in targets]
+
+            if len(onsets) > 0:
+                print(f'演奏が始まった時間: {onsets[0] / samplerate:.2f}秒')
+                if len(recent_energy) > 0:
+                    print(f'鳴っている音: {filterbank.active_notes(np.array(recent_energy)[-1:])[0]}')
+
+                # 直近の半音ごとのエネルギーを表示
+                plt.figure(figsize=(10, 4))
+                plt.imshow(np.array(recent_energy).T, aspect="auto", origin="lower", vmin=filterbank.floor_db, vmax=0,
+                           extent=(0, len(recent_energy), filterbank.midi[0] - 0.5, filterbank.midi[-1] + 0.5))
+                plt.title(f"Semitone Energy ({', '.join(target_notes)})")
+                plt.xlabel("Frames")
+                plt.ylabel("MIDI Note")
+                plt.show()
+
+                break  # ループを終了
+
+    print("プログラムを終了します。")
 
-# ストリーミングの開始
-with sd.InputStream(samplerate=samplerate, channels=1, blocksize=blocksize, callback=callback):
-    print("リアルタイム音声検知を開始します...")
-    
-    while True:
-        # キューからデータを取得
-        if not audio_queue.empty():
-            # 音声データを取得
-            audio_data = audio_queue.get()
-            audio_buffer.append(audio_data.flatten())  # 1次元配列に変換し、バッファに追加
-
-            # バッファのサイズが一定以上になったら処理
-            if len(audio_buffer) * blocksize >= 2048:  # バッファのサンプル数が2048以上
-                # バッファの音声データを結合
-                combined_audio = np.concatenate(audio_buffer)
-                
-                # ノイズゲートを適用
-                gated_audio = noise_gate(combined_audio, noise_gate_threshold)
-                
-                # ファ#4の範囲にフィルタリング
-                filtered_audio = bandpass_filter(gated_audio, lowcut, highcut, samplerate)
-                
-                # 音声データの振幅を正規化（ゼロ除算を避ける）
-                max_value = np.max(np.abs(filtered_audio))
-                if max_value > 0:
-                    filtered_audio = filtered_audio / max_value
-                
-                # オンセットを検出
-                onsets = detect_onset(filtered_audio)
-
-                if len(onsets) > 0 and not onset_detected:
-                    print(f'演奏が始まった時間: {onsets[0]:.2f}秒')
-                    onset_detected = True  # 最初のオンセットを検知したのでフラグを立てる
-                    
-                    # 波形を表示
-                    plt.figure(figsize=(10, 4))
-                    plt.plot(filtered_audio)
-                    plt.title("Filtered Audio Waveform (F#4 Range)")
-                    plt.xlabel("Samples")
-                    plt.ylabel("Amplitude")
-                    plt.show()
-                    
-                    break  # ループを終了
-
-    print("プログラムを終了します。")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
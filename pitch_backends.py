@@ -0,0 +1,122 @@
+import numpy as np
+
+from streaming_pitch import yin_cmnd, parabolic_shift
+from note_table import note_to_hz
+from startup import enable_numba_cache
+
+# pyin の numba の関数のコンパイル結果を numba_cache/ に残して、次回の起動から再利用する
+enable_numba_cache()
+
+# バイオリンの音域(ms_recognition はオクターブ4〜6以外を捨てるので、それより広く探索する必要はない)
+VIOLIN_FMIN_NOTE = 'G3'
+VIOLIN_FMAX_NOTE = 'C7'
+
+# pyin で従来使っていた探索範囲
+PYIN_FMIN_NOTE = 'C2'
+PYIN_FMAX_NOTE = 'C7'
+
+
+# ピッチ推定バックエンドの共通インターフェース
+# estimate() は librosa.pyin と同じく (f0, voiced_flag, voiced_probs) を返す
+class PitchEstimator:
+    name = "base"
+
+    def __init__(self, sr=22050, fmin=None, fmax=None, frame_length=2048, hop_length=512):
+        self.sr = sr
+        self.fmin = fmin
+        self.fmax = fmax
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+
+    def estimate(self, audio_data):
+        raise NotImplementedError
+
+    # 起動時に短い合成音で1回推定しておき、最初のブロックで初回の読み込みやJITコンパイルを待たないようにする
+    def warm_up(self, seconds=0.5, frequency=440.0):
+        t = np.arange(int(self.sr * seconds)) / self.sr
+        self.estimate((0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32))
+        return self
+
+
+# librosa.pyin を使う正確な参照用バックエンド
+# (pyin の numba の関数は初回の呼び出しでコンパイルされるので、リアルタイムで使う前に warm_up() する)
+class PyinEstimator(PitchEstimator):
+    name = "pyin"
+
+    def __init__(self, sr=22050, fmin=None, fmax=None, frame_length=2048, hop_length=512):
+        if fmin is None:
+            fmin = note_to_hz(PYIN_FMIN_NOTE)
+        if fmax is None:
+            fmax = note_to_hz(PYIN_FMAX_NOTE)
+        super().__init__(sr, fmin, fmax, frame_length, hop_length)
+
+    # librosa(と numba)は読み込みに時間がかかるので、pyin を使うときだけ読み込む
+    def estimate(self, audio_data):
+        import librosa
+        return librosa.pyin(audio_data, fmin=self.fmin, fmax=self.fmax, sr=self.sr,
+                            frame_length=self.frame_length, hop_length=self.hop_length)
+
+
+# FFT の自己相関で YIN を全フレームまとめて計算する高速バックエンド
+# 探索するラグをバイオリンの音域に限定している
+class YinEstimator(PitchEstimator):
+    name = "yin"
+
+    def __init__(self, sr=22050, fmin=None, fmax=None, frame_length=1024, hop_length=512,
+                 threshold=0.1, voicing_threshold=0.35):
+        if fmin is None:
+            fmin = note_to_hz(VIOLIN_FMIN_NOTE)
+        if fmax is None:
+            fmax = note_to_hz(VIOLIN_FMAX_NOTE)
+        super().__init__(sr, fmin, fmax, frame_length, hop_length)
+        self.threshold = threshold
+        self.voicing_threshold = voicing_threshold
+        self.win_length = frame_length // 2
+        self.min_period = max(int(np.floor(sr / fmax)), 1)
+        self.max_period = min(int(np.ceil(sr / fmin)), frame_length - self.win_length - 1)
+
+    # pyin と同じ数のフレームになるように、前後をパディングしてフレームに分割する
+    def frame(self, audio_data):
+        padded = np.pad(np.asarray(audio_data, dtype=np.float64), self.frame_length // 2)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, self.frame_length)
+        return windows[::self.hop_length]
+
+    def estimate(self, audio_data):
+        frames = self.frame(audio_data)
+        n_frames = len(frames)
+        if n_frames == 0:
+            return np.zeros(0), np.zeros(0, dtype=bool), np.zeros(0)
+
+        cmnd = yin_cmnd(frames, self.win_length, self.max_period)
+        search = cmnd[:, self.min_period:self.max_period + 1]
+
+        # 閾値を下回る最初の谷、なければ最小値の位置を周期とする
+        is_trough = np.zeros(search.shape, dtype=bool)
+        is_trough[:, 1:-1] = (search[:, 1:-1] < search[:, :-2]) & (search[:, 1:-1] <= search[:, 2:])
+        below = is_trough & (search < self.threshold)
+        taus = np.where(below.any(axis=1), np.argmax(below, axis=1), np.argmin(search, axis=1))
+
+        rows = np.arange(n_frames)
+        aperiodicity = search[rows, taus]
+        taus = taus + self.min_period
+        f0 = self.sr / (taus + parabolic_shift(cmnd, taus))
+
+        # 谷が浅いフレームや無音のフレームは無声(nan)にする
+        silent = np.all(frames == 0, axis=1)
+        voiced_flag = (aperiodicity < self.voicing_threshold) & ~silent
+        voiced_probs = np.clip(1 - aperiodicity, 0, 1) * ~silent
+        f0 = np.where(voiced_flag, f0, np.nan)
+        return f0, voiced_flag, voiced_probs
+
+
+# 名前からバックエンドを選ぶための一覧
+PITCH_BACKENDS = {
+    PyinEstimator.name: PyinEstimator,
+    YinEstimator.name: YinEstimator,
+}
+
+# 名前を指定してピッチ推定バックエンドを作成する
+def get_estimator(name, **kwargs):
+    if name not in PITCH_BACKENDS:
+        raise ValueError(f"不明なピッチ推定バックエンドです: {name} (選択肢: {', '.join(PITCH_BACKENDS)})")
+    return PITCH_BACKENDS[name](**kwargs)
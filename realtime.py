@@ -1,192 +1,255 @@
-import sounddevice as sd
-import numpy as np
-import librosa
-import json
 import os
+import time as time_module
 
-from connection import send_data_loop
+from startup import StartupTimer
 
-# 定数の設定
-SR = 22050  # サンプリングレート(Hz)
-DURATION = 0.0086  # 110BPMの場合の八分音符の秒数
-BLOCK_SIZE = int(SR * DURATION)  # 0.27秒分のサンプル数
+# 起動時間の計測(重いモジュールは使うときに読み込み、ピッチ推定はストリームを開く前に温めておく)
+startup_timer = StartupTimer()
+
+from connection import send_data_loop, get_transport, close_transport
+from audio_pipeline import BlockRingBuffer, AnalysisWorker, capture_timestamp
+from recognizer import NoteRecognizer
+from score_index import load_reference
+from score_follower import OnlineScoreFollower
+from timing import load_timing
+from note_events import NoteEventEncoder
+from results_store import ResultsStore, new_session_id
+from note_table import label_to_code
+from metrics import metrics
+
+startup_timer.mark("モジュールの読み込み")
 
-# 音階名を保存するフォルダのパス
 current_dir = os.path.dirname(os.path.abspath(__file__))
-ms_dict_path = os.path.join(current_dir, "ms_dict")
 
-# 答えの音階が書いてあるjsonのパス
+# 音符ごとの表示(コンソールへの出力はブロックごとの処理を遅らせるので、既定では表示しない)
+# REALTIME_VERBOSE=1 で表示する
+VERBOSE = os.environ.get("REALTIME_VERBOSE") == "1"
+
+# 計測結果を返すローカルのHTTPのポート(省略時はHTTPで返さない)と、要約を表示する間隔(秒、0 なら表示しない)
+METRICS_PORT = os.environ.get("METRICS_PORT")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "10"))
+
+def log(message):
+    if VERBOSE:
+        print(message)
+
+# 答えの音階が書いてあるjsonのパス(music_score.mxl などの楽譜ファイルを指定すると、コンパイル済みの楽譜から読み込む)
 ans_json_path = os.path.join(current_dir, "doremi_notes_list.json")
 
-# UTF-8 エンコーディングでJSONファイルを読み込む
-with open(ans_json_path, 'r', encoding='utf-8') as json_file:
-    json_load = json.load(json_file)
-    print("正解ファイルの読み取りに成功!!")
+json_load = load_reference(ans_json_path)
+print("正解ファイルの読み取りに成功!!")
+
+# BPM・拍子から解析の窓とホップ(ブロックサイズ)を決める
+# 110BPMの八分音符は約0.27秒で、1音を2ホップに分けて、窓は八分音符1つ分とする
+timing = load_timing(ans_json_path, bpm=110)
+SR = timing.sr  # サンプリングレート(Hz)
+DURATION = timing.note_seconds  # 八分音符の秒数
+BLOCK_SIZE = timing.hop_size  # ホップ分のサンプル数
+print(timing)
 
 ans_json_path_length = len(json_load)
 print(f"正解ファイルの長さ: {ans_json_path_length}")
 print("-----------------------------------------------------")
 
-# 音階変換用の辞書
-note_to_doremi = {
-    'C': 'ド',
-    'C♯': 'ド',
-    'D': 'レ',
-    'D♯': 'レ',
-    'E': 'ミ',
-    'F': 'ファ',
-    'F♯': 'ファ',
-    'G': 'ソ',
-    'G♯': 'ソ',
-    'A': 'ラ',
-    'A♯': 'ラ',
-    'B': 'シ'
-}
+# 1小節の八分音符の数
+NOTES_PER_MEASURE = timing.notes_per_measure
 
 # フラグやグローバル変数の初期化
-found_fa5 = False
-ms_dict = {}
-ms_list = []
-previous_doremi_note = "不明"
-doremi_note = "不明"
-current_i = 0
-i = 0
-
-# ファイル名の連番を作成する
-def get_next_filename(base_filename, extension, i):
-    return f"{base_filename}_{i}.{extension}"
+i = 0  # 保存・送信済みの小節数
+block_count = 0  # 解析したブロック(ホップ)の数
+
+# 検出された音階を正解の楽譜に逐次アラインメントする楽譜追従
+# 最初の音(ファ5)が検知されるまでは追従を始めない
+score_follower = OnlineScoreFollower(json_load)
+
+# 1人分のピッチトラッカーと解析の窓を持つ認識器
+recognizer = NoteRecognizer(timing, verbose=VERBOSE)
+startup_timer.mark("楽譜と認識器の準備")
 
 # 音声データの処理（基本周波数と音階を推定）
 def ms_recognition(audio_data):
-    global previous_doremi_note, doremi_note
-    f0, _, _ = librosa.pyin(audio_data, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=SR, hop_length=256)
-    
-    if f0 is not None:
-        valid_f0 = f0[~np.isnan(f0)]
-        if len(valid_f0) > 0:
-            # nanを除いた周波数の平均を取得
-            dominant_f0 = np.mean(valid_f0)
-            note = librosa.hz_to_note(dominant_f0) # 周波数を対応する音階に変換する
-            
-            base_note = note[:-1]
-            octave = note[-1]
-            
-            if octave in ["4", "5", "6"]:
-                doremi_note = note_to_doremi.get(base_note, "不明") + octave
-            else:
-                print("音階が4, 5, 6の範囲外です")
-                doremi_note = previous_doremi_note
-            print(f"基本周波数: {dominant_f0:.2f} Hz, 音階: {doremi_note}")
-            previous_doremi_note = doremi_note
-            return doremi_note
-        else:
-            print("休符判定")
-            return "休符"
-    else:
-        print("ピッチ検知に失敗した!!")
-        return "検知失敗"
-
-# ファイルにJSONデータを保存
-def save_to_json(ms_dict, i):
-    filename = get_next_filename("ms_dict", "json", i)
-    ms_save_path = os.path.join(ms_dict_path, filename)
-    with open(ms_save_path, "w", encoding="utf-8") as f:
-        json.dump(ms_dict, f, ensure_ascii=False, indent=4)
-    print(f"JSONファイルを保存しました: {ms_save_path}")
+    return recognizer.recognize(audio_data)
+
+# 小節ごとの音階を保存する結果ストア(書き込みは裏のスレッドで行う)と、この演奏のID
+results_store = None
+session_id = None
+
+# 1小節分の音階を保存する(キューに積むだけで、ディスクへの書き込みは待たない)
+def save_measure(ms_dict, i):
+    results_store.save_measure(session_id, i, ms_dict)
+    log(f"{i + 1}小節目の音階を保存しました: {session_id}")
+
+# Unityに送る音符イベントの形式("binary": 固定長のバイナリ, "json": デバッグ用)
+WIRE_FORMAT = "binary"
+note_encoder = NoteEventEncoder(ans_json_path_length, wire_format=WIRE_FORMAT)
 
 # Unityにデータを送信
+# (送信キューに積むだけで、Unityとの接続や送信の完了は待たない)
 def send_data_to_unity(ms_list):
     data = {"key": ','.join(ms_list)}
     print(f"Unityにデータを送信: {data}")
     send_data_loop(data)  # 実際のデータ送信処理
 
-# コールバック関数
+# 新しい音符だけをイベントとしてUnityに送る(一定間隔で全体のスナップショットも送る)
+def send_note_event(result, confidence, timestamp):
+    event, snapshot = note_encoder.note(result.position, result.detected, confidence, timestamp)
+    transport = get_transport()
+    transport.send_event(event)
+    if snapshot is not None:
+        transport.send(snapshot, key="notes")
+
+# オーディオコールバックから解析スレッドへブロックを渡すリングバッファ
+ring_buffer = BlockRingBuffer(BLOCK_SIZE)
+
+# コールバック関数(ブロックをリングバッファにコピーするだけで、重い処理は行わない)
+# 表示はせず、status やブロックの取りこぼし、コールバックにかかった時間を計測に数える
+BLOCK_SECONDS = BLOCK_SIZE / SR
+CALLBACK_FLAGS = ("input_overflow", "input_underflow", "output_overflow", "output_underflow", "priming_output")
+
 def audio_callback(indata, frames, time, status):
-    global found_fa5, current_i, i, ms_dict, ms_list
-    
+    start = time_module.perf_counter()
     if status:
-        print(status)
-    
-    # 音声データの処理
-    audio_data = indata[:, 0]  # 1チャンネル分の音声
-    doremi_note = ms_recognition(audio_data)
-    print(f"検出された音階: {doremi_note}")
-    print("----------------------------------------------------")
-    # "ファ5"検出フラグの確認
-    if not found_fa5 and doremi_note == "ファ5":
-        print("ファ5が検知されました。JSONファイルを生成開始。")
-        found_fa5 = True
-
-    # "ファ5"が検出された後の処理
-    if found_fa5:
-        ms_dict[current_i] = doremi_note
-        ms_list.append(ms_dict[current_i])
-        current_i += 1
-
-        # 1小節分の音階を処理
-        if current_i == 8:
-            print(f"{i + 1}小節目のデータを保存します。-------------------------------")
-            save_to_json(ms_dict, i)
-            send_data_to_unity(ms_list)
-            print("------------------------------------------------------------")
-            # 次の小節のためにリセット
-            ms_dict = {}
-            current_i = 0
-            i += 1
-
-# ms_dict以下のファイルを削除
-for file in os.listdir(ms_dict_path):
-    file_path = os.path.join(ms_dict_path, file)
-    os.remove(file_path)
+        metrics.increment("callback_status")
+        for flag in CALLBACK_FLAGS:
+            if getattr(status, flag, False):
+                metrics.increment(flag)
+
+    # 1チャンネル分の音声をキャプチャ時刻と一緒に積む
+    if not ring_buffer.push(indata[:, 0], capture_timestamp(time)):
+        metrics.increment("dropped_blocks")
+    elapsed = time_module.perf_counter() - start
+    metrics.observe("capture", elapsed)
+    if elapsed > BLOCK_SECONDS:
+        metrics.increment("callback_overruns")
+
+# 1小節分の音階を楽譜上の位置から取り出す
+def measure_dict(measure, stop=None):
+    if stop is None:
+        stop = (measure + 1) * NOTES_PER_MEASURE
+    notes = score_follower.aligned_notes(stop, start=measure * NOTES_PER_MEASURE)
+    return {k: note for k, note in enumerate(notes)}
+
+# 解析スレッドで1ブロック分の音声を処理する
+# 段階ごと(pitch: 音階の判定, follower: 楽譜追従, send: Unityへの送信, persistence: 小節の保存)の処理時間を計測する
+def process_block(audio_data, timestamp):
+    global i, block_count
+
+    block_start = time_module.perf_counter()
+    with metrics.timer("pitch"):
+        doremi_note = ms_recognition(audio_data)
+    if label_to_code(doremi_note) >= 0:
+        startup_timer.note_recognized()
+    log(f"検出された音階: {doremi_note} (キャプチャ時刻: {timestamp:.3f}s, キュー長: {ring_buffer.depth()})")
+
+    # 楽譜追従には1音(八分音符)につき1回だけ渡す
+    block_count += 1
+    if block_count % timing.hops_per_note != 0:
+        metrics.observe("block", time_module.perf_counter() - block_start)
+        return doremi_note
+
+    # 楽譜上の位置を更新する(最初の音が検知されるまでは None)
+    with metrics.timer("follower"):
+        result = score_follower.update(doremi_note)
+    if result is None:
+        log("----------------------------------------------------")
+        metrics.observe("block", time_module.perf_counter() - block_start)
+        return doremi_note
+    metrics.increment("notes")
+    if result.correct:
+        metrics.increment("correct_notes")
+    log(f"楽譜上の位置: {result.position + 1}/{ans_json_path_length}, 正解: {result.expected}, "
+        f"判定: {'○' if result.correct else '×'}, テンポのずれ: {result.drift:+.0%}")
+    log("----------------------------------------------------")
+    with metrics.timer("send"):
+        send_note_event(result, recognizer.confidence, timestamp)
+
+    # 楽譜上の位置が次の小節に進んだら、前の小節の音階を保存する
+    # (Unityには音符ごとのイベントで送っているので、ここでは全履歴を送らない)
+    while result.position // NOTES_PER_MEASURE > i:
+        log(f"{i + 1}小節目のデータを保存します。-------------------------------")
+        with metrics.timer("persistence"):
+            ms_dict = measure_dict(i)
+            save_measure(ms_dict, i)
+        log("------------------------------------------------------------")
+        i += 1
+
+    metrics.observe("block", time_module.perf_counter() - block_start)
+    return doremi_note
 
 # ストリームを開始し、リアルタイムで音声を処理
-def start_stream():
-    global ms_list
-    with sd.InputStream(callback=audio_callback, channels=1, samplerate=SR, blocksize=BLOCK_SIZE):
+# input_stream: sd.InputStream と同じ引数で作れる入力ストリーム(省略時はマイク。replay.ReplayInputStream で録音を流せる)
+# duration: 録音する秒数(wait() を持つ入力ストリームなら、入力が終わるか duration 秒経つまで。None なら終わるまで)
+# (sounddevice はマイクを使うときだけ必要なので、ここで読み込む)
+def start_stream(input_stream=None, duration=60.0):
+    global results_store, session_id
+    if input_stream is None:
+        import sounddevice as sd
+        input_stream = sd.InputStream
+
+    # Unityとの接続は裏で待つ(接続前の送信はキューに溜まる)
+    get_transport()
+
+    # 最初のブロックが届く前に、ピッチ推定とオンセット検出を合成音で1回動かしておく
+    recognizer.warm_up()
+    startup_timer.mark("ウォームアップ")
+
+    # 以前の演奏の結果は消さずに、新しい演奏として記録する
+    results_store = ResultsStore()
+    session_id = new_session_id("realtime")
+    results_store.start_session(session_id)
+
+    # キューの深さと取りこぼしは読むときに取りに行く
+    metrics.gauge("ring_buffer_depth", ring_buffer.depth)
+    metrics.gauge("ring_buffer_max_depth", lambda: ring_buffer.max_depth)
+    metrics.gauge("ring_buffer_dropped", lambda: ring_buffer.dropped)
+    metrics.gauge("send_queue_depth", lambda: get_transport().queue_depth())
+    metrics.gauge("results_queue_depth", results_store.queue.qsize)
+    if METRICS_PORT:
+        metrics.serve(int(METRICS_PORT))
+    if METRICS_INTERVAL > 0:
+        metrics.start_dump(METRICS_INTERVAL)
+
+    worker = AnalysisWorker(ring_buffer, process_block)
+    metrics.gauge("analysis_errors", lambda: worker.errors)
+    worker.start()
+    with input_stream(callback=audio_callback, channels=1, samplerate=SR, blocksize=BLOCK_SIZE) as stream:
+        startup_timer.mark("ストリームを開く")
+        startup_timer.report()
         print("リアルタイム音声処理中... Ctrl+C で終了")
-        sd.sleep(60000)  # 1分間録音（任意の時間に設定可能）
-        
-    print(ms_list)
-    print(f"音符の数: {len(ms_list)}")
-    
-    # 8個未満の音符を保存
-    if current_i > 0 and ms_dict:
-        test = {"key": ','.join(ms_list)}
-        filename = get_next_filename("ms_dict", "json", i)
-        ms_save_path = os.path.join(ms_dict_path, filename)
-        print(f"Sending remaining data (less than 8 notes): {current_i} notes.")
-        
-        # Save remaining notes to a JSON file
-        with open(ms_save_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(ms_dict, ensure_ascii=False, indent=4))
-        # Send the remaining data to Unity
-        send_data_loop(test)
-
-    # Unityに送信する音階の数を、正解の数と同数にする処理
-    sub_ms = ans_json_path_length - len(ms_list)
-    print(sub_ms)
-    # 正解の音階の数よりも推定された音階の数が少なかったら
-    if sub_ms > 0:
-        # ms_listが空でない場合に末尾の要素を複製
-        if ms_list:
-            last_note = ms_list[-1]  # 最後の要素を取得
-            for _ in range(sub_ms):
-                ms_list.append(last_note)  # 末尾の要素を複製して追加
+        if hasattr(stream, "wait"):
+            stream.wait(duration)
         else:
-            print("ms_listが空です。")
-            # 必要に応じてデフォルト値を設定
-            for _ in range(sub_ms):
-                ms_list.append("休符")  # 休符で埋めるなど
-    elif sub_ms < 0:
-        ms_list = ms_list[:ans_json_path_length]
-    else:
-        pass
-    
+            time_module.sleep(duration)  # 1分間録音（任意の時間に設定可能）
+
+    # 溜まっているブロックを処理しきってから解析スレッドを止める
+    worker.stop()
+    stats = worker.stats()
+    print(f"解析済みブロック数: {stats['processed']}, 取りこぼし: {stats['dropped']}, 最大キュー長: {stats['max_queue_depth']}, "
+          f"処理に失敗したブロック: {stats['errors']}")
+    print(metrics.format_summary())
+
+    # 途中までの小節を保存
+    if score_follower.started and score_follower.position // NOTES_PER_MEASURE == i:
+        ms_dict = measure_dict(i, score_follower.position + 1)
+        print(f"残りの音階を保存します(8個未満): {len(ms_dict)}個")
+        save_measure(ms_dict, i)
+
+    # 楽譜の位置ごとに揃えた音階をUnityに送る(弾かれなかった位置は直前の音階で埋める)
+    ms_list = score_follower.aligned_notes()
+    print(ms_list)
+    print(f"音符の数: {len(ms_list)}, 正解率: {score_follower.accuracy():.0%}")
+
     if len(ms_list) == ans_json_path_length:
         print("同数に調整できました")
-    test = {"key": ','.join(ms_list)}
-    send_data_loop(test)
-    print(test)
+    # 最後に全体のスナップショットと、楽譜の位置に揃えた音階の一覧を送る
+    get_transport().send(note_encoder.snapshot(), key="notes")
+    send_data_to_unity(ms_list)
+
+    # 保存待ちの結果と送信待ちのデータを書き出してから終了する
+    results_store.finish_session(session_id, score_follower.accuracy())
+    results_store.close()
+    close_transport()
+    metrics.close()
     
 if __name__ == "__main__":
     start_stream()
@@ -0,0 +1,146 @@
+from collections import deque, namedtuple
+
+import numpy as np
+
+from streaming_pitch import StreamingPitchTracker
+from pitch_backends import VIOLIN_FMIN_NOTE, VIOLIN_FMAX_NOTE
+from onset import StreamingOnsetDetector
+from note_table import REST_CODE, UNKNOWN_CODE, hz_to_codes, hz_to_cents, natural_codes, in_octaves, code_to_label, note_to_hz
+
+# ブロックごとに音階を判定するリアルタイムの認識器
+# ピッチトラッカーとオンセット検出器の状態、解析の窓の f0、直前の音階を1人分ずつ持つので、複数の演奏者を同じプロセスで扱える
+# 判定は整数の音高コード(note_table)で行い、recognize() で返すときだけ「ファ5」形式の音階にする
+
+# 1ブロック分の判定結果
+# note: 音階, code: 音高コード(♯は1つ下の音にまとめる), f0: 代表の基本周波数(Hz、休符なら nan)
+# voiced_prob: 解析の窓の有声の確からしさの平均(0〜1), rms: ブロックの RMS, cents: f0 の半音からのずれ(セント)
+# gated: エネルギーが小さいのでピッチ推定を省いたか
+Recognition = namedtuple('Recognition', ['note', 'code', 'f0', 'voiced_prob', 'rms', 'cents', 'gated'])
+
+# RMS がこれより小さいブロックはピッチ推定を省いて休符とする(onset.noise_gate と同じく小さな音は無視する)
+ENERGY_GATE = 0.005
+
+# 有声のフレームの f0 から代表の f0 を選ぶ
+# "mode": いちばん多い半音のフレームの中央値(オクターブ誤りや音の変わり目のフレームを混ぜない)
+# "median": 全部のフレームの中央値, "mean": 全部のフレームの平均(以前の方法)
+def dominant_pitch(f0, method="mode"):
+    if method == "mean":
+        return float(np.mean(f0))
+    if method == "median":
+        return float(np.median(f0))
+    codes = hz_to_codes(f0)
+    values, counts = np.unique(codes, return_counts=True)
+    return float(np.median(f0[codes == values[np.argmax(counts)]]))
+
+
+class NoteRecognizer:
+    # timing: TimingModel (サンプリングレートと解析の窓の長さに使う)
+    # verbose: 判定した音階を表示する(たくさんのセッションを扱うときは False にする)
+    # segment_by_onsets: True なら、オンセット(音の立ち上がり)を検出したら窓をそこから始め直し、
+    #   前の音のフレームを混ぜずに新しい音を判定する(False なら決まった長さの窓をずらすだけ)
+    # energy_gate: ブロックの RMS がこれより小さければピッチ推定を省いて休符にする(None なら省かない)
+    # pitch_method: 窓の f0 から代表の f0 を選ぶ方法(dominant_pitch を参照)
+    # min_voiced_prob: 窓の有声の確からしさの平均がこれより小さければ休符にする
+    def __init__(self, timing, hop_length=256, verbose=False, segment_by_onsets=True, energy_gate=ENERGY_GATE,
+                 pitch_method="mode", min_voiced_prob=0.0):
+        self.timing = timing
+        self.verbose = verbose
+        self.energy_gate = energy_gate
+        self.pitch_method = pitch_method
+        self.min_voiced_prob = min_voiced_prob
+        self.onset_detector = StreamingOnsetDetector(sr=timing.sr) if segment_by_onsets else None
+        # ブロックをまたいでオーバーラップとHMMの状態を保持するピッチトラッカー(探索範囲はバイオリンの音域)
+        self.tracker = StreamingPitchTracker(sr=timing.sr, fmin=note_to_hz(VIOLIN_FMIN_NOTE),
+                                             fmax=note_to_hz(VIOLIN_FMAX_NOTE), hop_length=hop_length)
+        # 解析の窓に含まれる直近のフレームの (中心のサンプル位置, f0, 有声の確からしさ)
+        # (ホップごとに窓をずらしながら音階を判定する)
+        self.f0_window = deque(maxlen=max(1, timing.window_size // hop_length))
+        self.previous_code = UNKNOWN_CODE
+        self.last_result = None
+
+    def reset(self):
+        self.tracker.reset()
+        if self.onset_detector is not None:
+            self.onset_detector.reset()
+        self.f0_window.clear()
+        self.previous_code = UNKNOWN_CODE
+        self.last_result = None
+
+    # 起動時に短い合成音で1回判定してから状態を戻す
+    # (FFT などの初回の準備を、ストリームを開く前に済ませ、最初のブロックの判定を遅らせない)
+    def warm_up(self, seconds=0.5, frequency=440.0):
+        verbose, self.verbose = self.verbose, False
+        t = np.arange(int(self.timing.sr * seconds)) / self.timing.sr
+        audio = (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+        for start in range(0, len(audio), self.timing.hop_size):
+            self.recognize(audio[start:start + self.timing.hop_size])
+        self.verbose = verbose
+        self.reset()
+        return self
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    # 最後に判定したブロックの有声の確からしさ
+    @property
+    def confidence(self):
+        return self.last_result.voiced_prob if self.last_result is not None else 0.0
+
+    # 1ブロック分の音声から音階を判定する
+    def recognize(self, audio_data):
+        return self.analyze(audio_data).note
+
+    # 1ブロック分の音声から音高コードを判定する(♯は1つ下の音にまとめる)
+    def recognize_code(self, audio_data):
+        return self.analyze(audio_data).code
+
+    # 1ブロック分の音声を判定して Recognition を返す
+    def analyze(self, audio_data):
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        rms = float(np.sqrt(np.mean(np.square(audio_data, dtype=np.float64)))) if len(audio_data) else 0.0
+        gated = self.energy_gate is not None and rms < self.energy_gate
+
+        # 新しく届いたホップ分だけピッチを更新し、窓に含まれるフレームの f0 で音階を判定する
+        # (無音のブロックはピッチ推定を省き、フレームの位置だけ進める)
+        first_frame = self.tracker.frames_seen
+        new_f0, _, new_probs = self.tracker.skip(audio_data) if gated else self.tracker.update(audio_data)
+        positions = (first_frame + np.arange(len(new_f0))) * self.tracker.hop_length + self.tracker.frame_length // 2
+        self.f0_window.extend(zip(positions, new_f0, new_probs))
+
+        # 新しい音が始まっていたら、それより前のフレーム(前の音)を窓から外す(最新のフレームは残す)
+        if self.onset_detector is not None:
+            onsets = self.onset_detector.update(audio_data)
+            if onsets:
+                while len(self.f0_window) > 1 and self.f0_window[0][0] < onsets[-1]:
+                    self.f0_window.popleft()
+
+        if gated:
+            self.log(f"無音判定 (RMS: {rms:.4f})")
+            return self.rest(0.0, rms, gated)
+
+        f0 = np.array([f0 for _, f0, _ in self.f0_window])
+        voiced_prob = float(np.mean([prob for _, _, prob in self.f0_window]))
+        valid_f0 = f0[~np.isnan(f0)]
+        if len(valid_f0) == 0 or voiced_prob < self.min_voiced_prob:
+            self.log("休符判定")
+            return self.rest(voiced_prob, rms, gated)
+
+        # 代表の f0 を選び、対応する音高コードとずれ(セント)にする
+        dominant_f0 = dominant_pitch(valid_f0, self.pitch_method)
+        nearest_code = int(hz_to_codes(dominant_f0))
+        cents = float(hz_to_cents(dominant_f0, nearest_code))
+        code = int(natural_codes(nearest_code))
+
+        if in_octaves(code):
+            self.previous_code = code
+        else:
+            self.log("音階が4, 5, 6の範囲外です")
+        note = code_to_label(self.previous_code)
+        self.log(f"基本周波数: {dominant_f0:.2f} Hz ({cents:+.0f}セント), 有声の確からしさ: {voiced_prob:.2f}, 音階: {note}")
+        self.last_result = Recognition(note, self.previous_code, dominant_f0, voiced_prob, rms, cents, False)
+        return self.last_result
+
+    def rest(self, voiced_prob, rms, gated):
+        self.last_result = Recognition(code_to_label(REST_CODE), REST_CODE, np.nan, voiced_prob, rms, 0.0, gated)
+        return self.last_result
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from audio_reader import AudioReader
+
+# マイクの代わりに録音ファイルを realtime.audio_callback に流す再生ハーネス
+# ReplayInputStream は sd.InputStream と同じ引数とコールバックの形で、音声ファイルを BLOCK_SIZE フレームずつ渡す
+# 実時間のペースで渡せば締め切り(1ブロックの秒数)に間に合っているかを、できるだけ速く渡せば処理量を確かめられる
+# マイクのないCIのマシンでも、realtime.py の遅延と正解率を temp.py (オフライン) や doremi_notes_list.json と比べられる
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# コールバックに渡す time(sounddevice と同じ属性名。時刻は time.monotonic())
+ReplayTimeInfo = namedtuple('ReplayTimeInfo', ['inputBufferAdcTime', 'currentTime'])
+
+
+# コールバックに渡す status(sounddevice.CallbackFlags と同じ属性名)
+class ReplayStatus:
+    def __init__(self, input_overflow=False):
+        self.input_overflow = input_overflow
+        self.input_underflow = False
+
+    def __bool__(self):
+        return self.input_overflow
+
+    def __repr__(self):
+        return "input overflow" if self.input_overflow else ""
+
+
+class ReplayInputStream:
+    # path: 再生する音声ファイル(samplerate にリサンプリングしてモノラルにする)
+    # realtime: True なら1ブロックの秒数ごとに渡す(speed 倍速)、False なら待たずに渡す
+    # ready: 速く渡すときに、次のブロックを渡してよいかを返す関数(受け取る側のキューが溢れないように待つ)
+    def __init__(self, path, samplerate=22050, blocksize=1024, channels=1, callback=None, realtime=True, speed=1.0,
+                 ready=None, **kwargs):
+        self.reader = AudioReader(path, sr=samplerate)
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.callback = callback
+        self.realtime = realtime
+        self.speed = speed
+        self.ready = ready
+        self.thread = None
+        self.stopping = threading.Event()
+        self.finished = threading.Event()
+        # 統計
+        self.blocks = 0
+        self.late_blocks = 0  # 実時間で渡すときに、1ブロック以上遅れた(実際の機器なら入力が溢れる)ブロック数
+        self.max_lateness = 0.0  # 予定の時刻からの最大の遅れ(秒)
+
+    @property
+    def active(self):
+        return self.thread is not None and not self.finished.is_set()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ファイルの最後まで渡し終えるまで待つ(timeout 秒で諦める)
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def run(self):
+        block_seconds = self.blocksize / self.samplerate / self.speed
+        started = time.perf_counter()
+        for index, block in enumerate(self.reader.blocks(self.blocksize)):
+            if self.stopping.is_set():
+                break
+            late = False
+            if self.realtime:
+                delay = started + index * block_seconds - time.perf_counter()
+                if delay > 0:
+                    self.stopping.wait(delay)
+                else:
+                    self.max_lateness = max(self.max_lateness, -delay)
+                    late = -delay > block_seconds
+                    self.late_blocks += late
+            elif self.ready is not None:
+                while not self.ready() and not self.stopping.is_set():
+                    time.sleep(0.001)
+
+            # 最後のブロックは実際の機器と同じく blocksize に揃える(足りない分は無音)
+            indata = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+            indata[:len(block)] = np.asarray(block, dtype=np.float32)[:, None]
+            now = time.monotonic()
+            self.callback(indata, self.blocksize, ReplayTimeInfo(now, now), ReplayStatus(late))
+            self.blocks += 1
+        self.finished.set()
+
+    def stats(self):
+        return {"blocks": self.blocks, "late_blocks": self.late_blocks, "max_lateness": self.max_lateness}
+
+
+# temp.py と同じオフラインの経路で音階を推定し、楽譜追従での正解率を求める
+def offline_accuracy(path, reference, split_time, sr, backend):
+    from offline import transcribe_reader
+    from score_follower import OnlineScoreFollower
+
+    follower = OnlineScoreFollower(reference)
+    for recognition in transcribe_reader(AudioReader(path, sr=sr), split_time=split_time, backend=backend):
+        follower.update(recognition.note)
+    return follower.accuracy(), follower.aligned_notes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録音ファイルを realtime.py のオーディオコールバックに流して、遅延と正解率を確かめる")
+    parser.add_argument("path", nargs="?", default=os.path.join(current_dir, "audio_files", "IMG_6043.mp3"))
+    parser.add_argument("--fast", action="store_true", help="実時間を待たずに、できるだけ速く流す")
+    parser.add_argument("--speed", type=float, default=1.0, help="実時間で流すときの再生速度(倍)")
+    parser.add_argument("--compare-offline", default=None, metavar="BACKEND",
+                        help="temp.py と同じオフラインの経路(pyin / yin)の正解率と比べる")
+    parser.add_argument("--min-accuracy", type=float, default=None, help="正解率がこれより低ければ終了コード1にする")
+    parser.add_argument("--max-latency-ms", type=float, default=None,
+                        help="キャプチャから判定までの遅延の p99 がこれより大きければ終了コード1にする")
+    parser.add_argument("--output", default=None, help="結果をJSONで書き出すファイル")
+    args = parser.parse_args()
+
+    # Unityがないマシンでも動くように、指定がなければ模擬Unity用の接続を使う(つながらなくても解析は続く)
+    os.environ.setdefault("MOCK_UNITY_PORT", "5000")
+    os.environ.setdefault("METRICS_INTERVAL", "0")
+    import realtime
+    from metrics import metrics
+
+    # キャプチャ(コールバックに渡した時刻)から音階を判定し終えるまでの遅延を測る
+    # (最後のブロックを判定し終えた時刻を、処理にかかった時間の計算に使う)
+    process_block = realtime.process_block
+    last_processed = [None]
+
+    def timed_process_block(audio_data, timestamp):
+        note = process_block(audio_data, timestamp)
+        metrics.observe("latency", time.monotonic() - timestamp)
+        last_processed[0] = time.perf_counter()
+        return note
+    realtime.process_block = timed_process_block
+
+    ring_buffer = realtime.ring_buffer
+    streams = []
+
+    def input_stream(**kwargs):
+        stream = ReplayInputStream(args.path, realtime=not args.fast, speed=args.speed,
+                                   ready=lambda: ring_buffer.depth() < ring_buffer.capacity - 1, **kwargs)
+        streams.append(stream)
+        return stream
+
+    started = time.perf_counter()
+    realtime.start_stream(input_stream, duration=None)
+    elapsed = (last_processed[0] or time.perf_counter()) - started
+
+    snapshot = metrics.snapshot()
+    latency = snapshot["timers"].get("latency", {})
+    audio_seconds = len(streams[0].reader) / realtime.SR
+    summary = {
+        "path": args.path,
+        "mode": "fast" if args.fast else f"realtime x{args.speed:g}",
+        "audio_seconds": audio_seconds,
+        "elapsed_seconds": elapsed,
+        "realtime_factor": audio_seconds / elapsed,
+        "block_seconds": realtime.BLOCK_SIZE / realtime.SR,
+        "accuracy": realtime.score_follower.accuracy(),
+        "latency": latency,
+        "replay": streams[0].stats(),
+        "metrics": snapshot,
+    }
+    print(f"再生: {summary['mode']}, {audio_seconds:.1f}秒の録音を {elapsed:.1f}秒で処理 (実時間の {summary['realtime_factor']:.1f}倍)")
+    print(f"正解率: {summary['accuracy']:.1%}")
+    if latency:
+        print(f"遅延: p50 {latency['p50'] * 1000:.1f}ms, p99 {latency['p99'] * 1000:.1f}ms, 最大 {latency['max'] * 1000:.1f}ms "
+              f"(1ブロック {summary['block_seconds'] * 1000:.0f}ms)")
+    print(f"1ブロック以上遅れたブロック: {summary['replay']['late_blocks']}, 取りこぼし: {ring_buffer.dropped}")
+
+    if args.compare_offline:
+        reference = realtime.json_load
+        accuracy, offline_notes = offline_accuracy(args.path, reference, realtime.DURATION, realtime.SR, args.compare_offline)
+        realtime_notes = realtime.score_follower.aligned_notes()
+        agreement = float(np.mean([a == b for a, b in zip(realtime_notes, offline_notes)])) if realtime_notes else 0.0
+        summary["offline"] = {"backend": args.compare_offline, "accuracy": accuracy, "agreement": agreement}
+        print(f"オフライン({args.compare_offline})の正解率: {accuracy:.1%}, リアルタイムとの一致: {agreement:.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+    failures = []
+    if args.min_accuracy is not None and summary["accuracy"] < args.min_accuracy:
+        failures.append(f"正解率 {summary['accuracy']:.1%} が {args.min_accuracy:.1%} より低い")
+    if args.max_latency_ms is not None and latency.get("p99", 0.0) * 1000 > args.max_latency_ms:
+        failures.append(f"遅延の p99 {latency['p99'] * 1000:.1f}ms が {args.max_latency_ms:.0f}ms より大きい")
+    for failure in failures:
+        print(f"失敗: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+# 小節ごとの音階を保存する結果ストア(SQLite の WAL モード)
+# 解析スレッドからは save_measure() でキューに積むだけで、ディスクへの書き込みは裏の書き込みスレッドが
+# flush_interval 秒ごと(または batch_size 個溜まったら)にまとめて1回のトランザクションで行う
+# 以前の ms_dict/ms_dict_{i}.json の代わりに、演奏(セッション)ごとの履歴を小節番号で引けるようにする
+# (Unity など ms_dict のJSONファイルを読む側のために、export_json() で同じ形式に書き出せる)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DB_PATH = os.path.join(current_dir, "results.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    started_at REAL,
+    finished_at REAL,
+    accuracy REAL
+);
+CREATE TABLE IF NOT EXISTS measures (
+    session_id TEXT NOT NULL,
+    measure INTEGER NOT NULL,
+    notes TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (session_id, measure)
+);
+"""
+
+# 演奏ごとのID(起動した時刻と、同じ秒に始めた演奏と区別するためのランダムな文字列)
+# (別のプロセスやセッションが同じ prefix で同時に始めても、互いの記録を上書きしない)
+def new_session_id(prefix):
+    return f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=10.0)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class ResultsStore:
+    def __init__(self, path=RESULTS_DB_PATH, flush_interval=1.0, batch_size=64):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        with connect(path) as connection:
+            connection.executescript(SCHEMA)
+        self.queue = queue.Queue()
+        self.local = threading.local()  # 読み込み用の接続(スレッドごと)
+        self.written = 0
+        self.batches = 0
+        self.failed = 0  # 書き込みに失敗して捨てたもの(小節やセッション)の数
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    # どのスレッドからでも呼べる: 1小節分の音階を保存する(同じ小節をもう一度保存したら上書きする)
+    def save_measure(self, session_id, measure, notes):
+        if isinstance(notes, dict):
+            notes = [notes[k] for k in sorted(notes)]
+        self.queue.put(("measure", (session_id, measure, json.dumps(list(notes), ensure_ascii=False), time.time())))
+
+    def start_session(self, session_id):
+        self.queue.put(("start", (session_id, time.time())))
+
+    def finish_session(self, session_id, accuracy=None):
+        self.queue.put(("finish", (time.time(), accuracy, session_id)))
+
+    # 書き込みスレッド: キューから取り出したものを溜めて、まとめて書き込む
+    def write_loop(self):
+        connection = connect(self.path)
+        pending = []
+        waiters = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ("flush", None)
+
+            kind, data = item
+            if kind in ("flush", "close"):
+                if data is not None:
+                    waiters.append(data)
+            else:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.batch_size:
+                    continue
+
+            try:
+                self.write_batch(connection, pending)
+            except Exception as e:
+                # データベースがロックされている、不正な行があるなどで失敗しても、書き込みスレッドは止めない
+                # (with connection でトランザクションは巻き戻されるので、このまとまりは捨てる)
+                self.failed += len(pending)
+                print(f"結果の書き込みに失敗しました({len(pending)}件): {e}")
+            pending = []
+            deadline = None
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+            if kind == "close":
+                connection.close()
+                return
+
+    def write_batch(self, connection, items):
+        if not items:
+            return
+        with connection:
+            for kind, data in items:
+                if kind == "measure":
+                    connection.execute("INSERT OR REPLACE INTO measures VALUES (?, ?, ?, ?)", data)
+                elif kind == "start":
+                    connection.execute("INSERT OR REPLACE INTO sessions (session_id, started_at) VALUES (?, ?)", data)
+                elif kind == "finish":
+                    connection.execute("UPDATE sessions SET finished_at = ?, accuracy = ? WHERE session_id = ?", data)
+        self.written += len(items)
+        self.batches += 1
+
+    # キューに積まれているものを書き終えるまで待つ
+    def flush(self, timeout=None):
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        return done.wait(timeout)
+
+    # 残りを書き終えてから書き込みスレッドを止める
+    def close(self, timeout=None):
+        if not self.writer.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(("close", done))
+        done.wait(timeout)
+        self.writer.join(timeout)
+
+    def reader(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = connect(self.path)
+        return connection
+
+    # 1小節分の音階(なければ None)
+    def measure(self, session_id, measure):
+        row = self.reader().execute("SELECT notes FROM measures WHERE session_id = ? AND measure = ?",
+                                    (session_id, measure)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # 小節番号 -> 音階のリスト(start 〜 stop-1 小節目)
+    def history(self, session_id, start=0, stop=None):
+        rows = self.reader().execute(
+            "SELECT measure, notes FROM measures WHERE session_id = ? AND measure >= ? AND measure < ? ORDER BY measure",
+            (session_id, start, stop if stop is not None else 2 ** 62)).fetchall()
+        return {measure: json.loads(notes) for measure, notes in rows}
+
+    def sessions(self, limit=20):
+        rows = self.reader().execute(
+            "SELECT s.session_id, s.started_at, s.finished_at, s.accuracy, COUNT(m.measure) FROM sessions s "
+            "LEFT JOIN measures m ON m.session_id = s.session_id GROUP BY s.session_id ORDER BY s.started_at DESC LIMIT ?",
+            (limit,)).fetchall()
+        return [{"session_id": row[0], "started_at": row[1], "finished_at": row[2], "accuracy": row[3], "measures": row[4]}
+                for row in rows]
+
+    # 以前と同じ ms_dict_{i}.json の形式で書き出す
+    def export_json(self, session_id, directory):
+        os.makedirs(directory, exist_ok=True)
+        history = self.history(session_id)
+        for measure, notes in history.items():
+            with open(os.path.join(directory, f"ms_dict_{measure}.json"), "w", encoding="utf-8") as f:
+                json.dump({k: note for k, note in enumerate(notes)}, f, ensure_ascii=False, indent=4)
+        return len(history)
+
+def main():
+    parser = argparse.ArgumentParser(description="保存された演奏の結果を表示・書き出す")
+    parser.add_argument("session_id", nargs="?", help="表示する演奏(省略時は最近の演奏の一覧)")
+    parser.add_argument("--db", default=RESULTS_DB_PATH)
+    parser.add_argument("--measure", type=int, default=None, help="この小節だけを表示する")
+    parser.add_argument("--export", default=None, help="ms_dict_{i}.json の形式で書き出すフォルダ")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.session_id is None:
+        for session in store.sessions():
+            accuracy = "-" if session["accuracy"] is None else f"{session['accuracy']:.0%}"
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session["started_at"] or 0))
+            print(f"{session['session_id']}: {started}, {session['measures']}小節, 正解率 {accuracy}")
+    elif args.export:
+        count = store.export_json(args.session_id, args.export)
+        print(f"{count}小節分を {args.export} に書き出しました")
+    elif args.measure is not None:
+        print(store.measure(args.session_id, args.measure))
+    else:
+        for measure, notes in store.history(args.session_id).items():
+            print(f"{measure + 1}小節目: {','.join(notes)}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
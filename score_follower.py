@@ -0,0 +1,127 @@
+from collections import deque, namedtuple
+
+import numpy as np
+
+from note_table import label_to_code
+
+# 検出された音階を正解の楽譜に逐次アラインメントする楽譜追従(オンラインDTW)
+# 1音ごとの計算は現在位置の周りの band 個の位置だけで行うので、演奏が長くなっても全体を並べ直すことはない
+
+# 1音ごとの追従結果
+# position: 楽譜上の位置(八分音符の番号), expected: その位置の正解の音階, correct: 正解と一致したか
+# drift: テンポのずれ(0 なら楽譜どおり、正なら速い、負なら遅い)
+FollowResult = namedtuple('FollowResult', ['position', 'detected', 'expected', 'correct', 'drift', 'cost'])
+
+# 検出された音と正解の音(音高コードの配列)の距離
+# 同じ音なら 0、オクターブ違いなら 0.5、それ以外は 1(休符・不明はコードが同じときだけ一致)
+def note_costs(detected_code, expected_codes):
+    costs = np.ones(len(expected_codes))
+    if detected_code >= 0:
+        costs[(expected_codes >= 0) & (expected_codes % 12 == detected_code % 12)] = 0.5
+    costs[expected_codes == detected_code] = 0.0
+    return costs
+
+
+class OnlineScoreFollower:
+    # reference: 八分音符ごとの正解の音階のリスト
+    # band: 1音ごとに計算する楽譜上の位置の数
+    # skip_penalty: 楽譜の音を飛ばす(弾き逃す)コスト, extra_penalty: 楽譜にない余分な音のコスト
+    def __init__(self, reference, band=16, skip_penalty=0.6, extra_penalty=0.4, drift_window=16, wait_for_first_note=True):
+        self.reference = list(reference)
+        self.reference_codes = np.array([label_to_code(note) for note in self.reference], dtype=np.int64)
+        self.band = band
+        self.skip_penalty = skip_penalty
+        self.extra_penalty = extra_penalty
+        self.wait_for_first_note = wait_for_first_note
+        self.recent_positions = deque(maxlen=drift_window)
+        self.reset()
+
+    def reset(self):
+        self.started = not self.wait_for_first_note
+        self.position = 0
+        # 前の音での累積コスト(window_start から始まる band 個分)
+        self.window_start = 0
+        self.costs = np.zeros(0)
+        self.steps = 0
+        # 楽譜の位置ごとの検出された音階と判定
+        self.aligned = [None] * len(self.reference)
+        self.correct = np.zeros(len(self.reference), dtype=bool)
+        self.recent_positions.clear()
+
+    # 前の音での累積コスト(計算範囲外は無限大、最初の音だけは楽譜の開始前を 0 とする)
+    def previous_cost(self, j):
+        if j < 0:
+            return 0.0 if self.steps == 0 else np.inf
+        k = j - self.window_start
+        if 0 <= k < len(self.costs):
+            return self.costs[k]
+        return np.inf
+
+    # テンポのずれ(最近の入力1つあたりに楽譜が何個進んだか - 1)
+    def drift(self):
+        if len(self.recent_positions) < 2:
+            return 0.0
+        steps = len(self.recent_positions) - 1
+        return (self.recent_positions[-1] - self.recent_positions[0]) / steps - 1.0
+
+    # 検出された音階を1つ追加して楽譜上の位置を更新する(演奏が始まる前は None を返す)
+    # 比較は音高コードで行い、音階の文字列は結果に入れるだけ
+    def update(self, detected):
+        if not self.reference:
+            return None
+        detected_code = label_to_code(detected)
+        if not self.started:
+            if detected_code != self.reference_codes[0]:
+                return None
+            self.started = True
+
+        # 現在位置の少し手前から先の band 個の位置だけを計算する
+        start = max(0, min(self.position - self.band // 4, len(self.reference) - self.band))
+        stop = min(len(self.reference), start + self.band)
+        costs = np.full(stop - start, np.inf)
+        note_cost = note_costs(detected_code, self.reference_codes[start:stop])
+        skipped = np.inf  # j の直前の音まで弾き逃して j に来るコスト
+        for j in range(start, stop):
+            # 楽譜も入力も1つ進む、または前の音の位置からいくつか弾き逃して進む
+            # (弾き逃した音は、この入力の音と比べずに1つごとに skip_penalty とする)
+            skipped = min(self.previous_cost(j - 1), skipped + self.skip_penalty)
+            best = min(
+                skipped,
+                self.previous_cost(j) + self.extra_penalty,     # 入力だけ進む(余分な音)
+            )
+            costs[j - start] = note_cost[j - start] + best
+
+        self.window_start = start
+        self.costs = costs
+        self.steps += 1
+        self.position = start + int(np.argmin(costs))
+        self.recent_positions.append(self.position)
+
+        expected = self.reference[self.position]
+        correct = bool(detected_code == self.reference_codes[self.position])
+        self.aligned[self.position] = detected
+        self.correct[self.position] = correct
+        return FollowResult(self.position, detected, expected, correct, self.drift(), float(costs[self.position - start]))
+
+    # 楽譜の位置ごとに揃えた検出結果のリスト(音がなかった位置は直前の音階で埋める)
+    # start を指定すると start から stop までだけを返す(小節ごとに取り出すときに最初から作り直さない)
+    def aligned_notes(self, stop=None, start=0):
+        if stop is None:
+            stop = len(self.reference)
+        # start より前で最後に音があった位置の音階から埋め始める
+        last = start - 1
+        while last >= 0 and self.aligned[last] is None:
+            last -= 1
+        previous = self.aligned[last] if last >= 0 else "休符"
+        notes = []
+        for note in self.aligned[start:stop]:
+            if note is not None:
+                previous = note
+            notes.append(previous)
+        return notes
+
+    # 楽譜の最初から position までの正解率
+    def accuracy(self):
+        if not self.started:
+            return 0.0
+        return float(np.mean(self.correct[:self.position + 1]))
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+
+# MusicXML の楽譜を、音高・開始位置・長さ・小節番号の配列にコンパイルしてディスクにキャッシュする
+# キャッシュは楽譜ファイルの内容のハッシュで管理するので、.mxl が変わったときだけ作り直す
+# music21 は楽譜をコンパイルするときだけ読み込む(起動時の import と解析のコストを避けるため)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+SCORE_CACHE_DIR = os.path.join(current_dir, "score_cache")
+
+# 音名(C, D, E, F, G, A, B の順番)をドレミファソラシドに対応させる
+STEP_TO_DOREMI = ['ド', 'レ', 'ミ', 'ファ', 'ソ', 'ラ', 'シ']
+STEP_NAMES = 'CDEFGAB'
+REST = -1  # 休符の音高
+
+# ファイルの内容のハッシュ値を計算する
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# コンパイル済みの楽譜
+# 各配列は楽譜の音符(休符を含む)の順番に並んでいる
+class ScoreIndex:
+    def __init__(self, midi, step, octave, onset, duration, measure, bpm=np.nan, time_signature=(4, 4)):
+        self.midi = midi          # MIDIノート番号(休符は -1)
+        self.step = step          # 音名(0=C 〜 6=B、休符は -1)
+        self.octave = octave      # 音名のオクターブ
+        self.onset = onset        # 開始位置(八分音符単位)
+        self.duration = duration  # 長さ(八分音符単位)
+        self.measure = measure    # 小節番号
+        self.bpm = bpm
+        self.time_signature = tuple(time_signature)
+
+    def __len__(self):
+        return len(self.midi)
+
+    # 各音符が何個の八分音符になるか(converted_music.iter_eighth_notes と同じく、八分音符より短い音符も1個と数える)
+    def eighth_counts(self):
+        return np.maximum(self.duration.astype(np.int64), 1)
+
+    # 八分音符ごとに展開した音符の番号の配列
+    def eighth_note_indices(self):
+        return np.repeat(np.arange(len(self)), self.eighth_counts())
+
+    # 八分音符ごとに展開した「ド4」形式の音階のリスト(converted_music.score_to_doremi_list と同じく休符は含めない)
+    def doremi_list(self):
+        labels = [f"{STEP_TO_DOREMI[step]}{octave}" for step, octave in zip(self.step, self.octave)]
+        return [labels[index] for index in self.eighth_note_indices() if self.step[index] != REST]
+
+    # 一時ファイルに書いてから置き換えるので、読み込む側が書きかけのファイルを開くことはない
+    def save(self, path):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.savez(f, midi=self.midi, step=self.step, octave=self.octave, onset=self.onset,
+                     duration=self.duration, measure=self.measure, bpm=self.bpm,
+                     time_signature=np.array(self.time_signature))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["midi"], data["step"], data["octave"], data["onset"], data["duration"],
+                       data["measure"], float(data["bpm"]), tuple(int(v) for v in data["time_signature"]))
+
+
+# music21 で楽譜を解析して ScoreIndex を作る
+def compile_score(score_path):
+    from music21 import converter, meter, tempo
+
+    score = converter.parse(score_path)
+    parts = score.parts if hasattr(score, 'parts') and len(score.parts) > 0 else [score]
+
+    rows = []
+    for part in parts:
+        for note in part.flatten().notesAndRests:
+            # 和音は score_to_doremi_list と同じく対象外
+            if note.isRest:
+                midi, step, octave = REST, REST, 0
+            elif note.isNote:
+                midi, step, octave = note.pitch.midi, STEP_NAMES.index(note.pitch.step), note.pitch.octave
+            else:
+                continue
+            measure = note.measureNumber if note.measureNumber is not None else 0
+            rows.append((midi, step, octave, float(note.offset) * 2, float(note.quarterLength) * 2, measure))
+
+    columns = list(zip(*rows)) if rows else [()] * 6
+    flat_score = score.flatten()
+    metronome = flat_score.getElementsByClass(tempo.MetronomeMark).first()
+    signature = flat_score.getElementsByClass(meter.TimeSignature).first()
+    bpm = float(metronome.number) if metronome is not None and metronome.number else np.nan
+    time_signature = (signature.numerator, signature.denominator) if signature is not None else (4, 4)
+
+    return ScoreIndex(
+        np.array(columns[0], dtype=np.int16),
+        np.array(columns[1], dtype=np.int8),
+        np.array(columns[2], dtype=np.int8),
+        np.array(columns[3], dtype=np.float32),
+        np.array(columns[4], dtype=np.float32),
+        np.array(columns[5], dtype=np.int32),
+        bpm,
+        time_signature,
+    )
+
+
+# 複数の楽譜を管理し、必要になったときにキャッシュから読み込む
+class ScoreLibrary:
+    def __init__(self, cache_dir=SCORE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.loaded = {}  # 楽譜ファイルの内容のハッシュ -> ScoreIndex
+
+    def cache_path(self, score_path, digest):
+        name = os.path.splitext(os.path.basename(score_path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{digest[:16]}.npz")
+
+    # 楽譜を取得する(メモリ → ディスクのキャッシュ → music21 での解析の順に探す)
+    def get(self, score_path):
+        digest = file_hash(score_path)
+        if digest in self.loaded:
+            return self.loaded[digest]
+
+        cache_path = self.cache_path(score_path, digest)
+        index = None
+        if os.path.exists(cache_path):
+            try:
+                index = ScoreIndex.load(cache_path)
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                # 以前の書きかけのファイルなどで読めなければ、コンパイルし直して置き換える
+                print(f"楽譜のキャッシュを読めないため作り直します: {cache_path} ({e})")
+        if index is None:
+            print(f"楽譜をコンパイルします: {score_path}")
+            index = compile_score(score_path)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            index.save(cache_path)
+
+        self.loaded[digest] = index
+        return index
+
+
+# 既定のライブラリ
+score_library = ScoreLibrary()
+
+# 正解の音階のリストを読み込む(.json はそのまま、楽譜ファイルはコンパイル済みの楽譜から作る)
+def load_reference(path):
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
+    return score_library.get(path).doremi_list()
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from recognizer import NoteRecognizer
+from score_follower import OnlineScoreFollower
+from note_events import NoteEventEncoder
+from results_store import new_session_id
+
+# 1人の演奏者(1本のマイク・1つの楽譜)ごとの状態をまとめたセッションと、
+# たくさんのセッションのブロックを共有のワーカーで処理するスケジューラ
+# realtime.py のモジュールのグローバル変数の代わりに、認識器・楽譜追従・送信先をセッションごとに持つ
+
+
+class Session:
+    # reference: 八分音符ごとの正解の音階のリスト, timing: TimingModel
+    # output: send_event(event) と send(data, key) を持つ送信先(UnityTransport など)。None なら送らない
+    # realtime: マイクからの演奏なら True(解析が追いつかなければ古いブロックを捨てる)、アップロードされた録音なら False(受信を待たせる)
+    # store: 小節ごとの音階を記録する ResultsStore(None なら記録しない)
+    def __init__(self, session_id, reference, timing, output=None, wire_format="binary", realtime=True, store=None):
+        self.session_id = session_id
+        self.realtime = realtime
+        self.reference = list(reference)
+        self.timing = timing
+        self.output = output
+        self.recognizer = NoteRecognizer(timing)
+        self.follower = OnlineScoreFollower(self.reference)
+        self.encoder = NoteEventEncoder(len(self.reference), wire_format=wire_format)
+
+        # 同じ名前で何度演奏しても履歴が分かれるように、記録には演奏を始めた時刻をつける
+        self.store = store
+        self.record_id = new_session_id(session_id)
+        self.saved_measures = 0
+        if store is not None:
+            store.start_session(self.record_id)
+
+        # ソケットから届いた半端なサンプル(ホップの長さに揃えてから解析する)
+        self.remainder = np.zeros(0, dtype=np.float32)
+        self.block_count = 0
+
+        # スケジューラが使う: 解析待ちのブロックと、ワーカーで処理中かどうか
+        self.backlog = deque()
+        self.scheduled = False
+        self.idle = threading.Event()
+        self.idle.set()
+
+        # 統計
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_backlog = 0
+        self.processing_time = 0.0
+        self.last_note = "不明"
+
+    # 届いたサンプルをホップの長さのブロックに切り分ける(余りは次に回す)
+    def split_blocks(self, samples):
+        samples = np.concatenate([self.remainder, np.asarray(samples, dtype=np.float32)])
+        hop_size = self.timing.hop_size
+        n_blocks = len(samples) // hop_size
+        self.remainder = samples[n_blocks * hop_size:]
+        return [samples[k * hop_size:(k + 1) * hop_size] for k in range(n_blocks)]
+
+    # 1ブロック分の音声を処理する(同じセッションのブロックは必ず1つずつ順番に呼ばれる)
+    def process_block(self, audio_data, timestamp):
+        start = time.perf_counter()
+        note = self.recognizer.recognize(audio_data)
+        self.last_note = note
+
+        # 楽譜追従には1音(八分音符)につき1回だけ渡す
+        self.block_count += 1
+        result = None
+        if self.block_count % self.timing.hops_per_note == 0:
+            result = self.follower.update(note)
+            if result is not None:
+                self.send_note_event(result, self.recognizer.confidence, timestamp)
+                self.save_measures(result.position // self.timing.notes_per_measure)
+        self.processed += 1
+        self.processing_time += time.perf_counter() - start
+        return result
+
+    # 新しい音符だけをイベントとして送る(一定間隔で全体のスナップショットも送る)
+    def send_note_event(self, result, confidence, timestamp):
+        event, snapshot = self.encoder.note(result.position, result.detected, confidence, timestamp)
+        if self.output is None:
+            return
+        self.output.send_event(event)
+        if snapshot is not None:
+            self.output.send(snapshot, key="notes")
+
+    # 楽譜上の位置が進んで終わった小節の音階を記録する(書き込みは ResultsStore の裏のスレッドで行う)
+    def save_measures(self, measure, stop=None):
+        if self.store is None:
+            return
+        notes_per_measure = self.timing.notes_per_measure
+        while self.saved_measures < measure:
+            start = self.saved_measures * notes_per_measure
+            self.store.save_measure(self.record_id, self.saved_measures,
+                                    self.follower.aligned_notes(start + notes_per_measure, start=start))
+            self.saved_measures += 1
+        if stop is not None and stop > measure * notes_per_measure:
+            # 途中までの小節
+            self.store.save_measure(self.record_id, measure, self.follower.aligned_notes(stop, start=measure * notes_per_measure))
+
+    # 演奏の終わり: 最後のスナップショットを送り、楽譜の位置に揃えた音階と正解率を返す
+    def finish(self):
+        if self.output is not None:
+            self.output.send(self.encoder.snapshot(), key="notes")
+        if self.store is not None and self.follower.started:
+            self.save_measures(self.follower.position // self.timing.notes_per_measure, self.follower.position + 1)
+            self.store.finish_session(self.record_id, self.follower.accuracy())
+        return {
+            "session_id": self.session_id,
+            "record_id": self.record_id,
+            "notes": self.follower.aligned_notes(),
+            "accuracy": self.follower.accuracy(),
+        }
+
+    def stats(self):
+        return {
+            "session_id": self.session_id,
+            "processed": self.processed,
+            "backlog": len(self.backlog),
+            "max_backlog": self.max_backlog,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "mean_block_ms": self.processing_time / self.processed * 1000 if self.processed else 0.0,
+            "position": self.follower.position if self.follower.started else None,
+        }
+
+
+# たくさんのセッションのブロックを共有のスレッドプールで処理するスケジューラ
+# セッションは状態(ピッチトラッカーのHMMや楽譜追従のコスト)を持つので、
+# 同じセッションのブロックは1つのワーカーで順番に処理し、別々のセッションは並行して処理する
+# (numpy の FFT や行列計算の間は GIL が外れるので、スレッドでも複数のコアを使える)
+class SessionScheduler:
+    # workers: ワーカーの数, max_backlog: セッションごとに溜められる解析待ちのブロック数(超えたら古いものを捨てる)
+    # max_batch: 1回の割り当てで続けて処理するブロック数(1人が長くワーカーを占有しないようにする)
+    def __init__(self, workers=4, max_backlog=64, max_batch=4):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="session")
+        self.max_backlog = max_backlog
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.space = threading.Condition(self.lock)  # 解析待ちが空いたことを知らせる
+        self.sessions = {}
+
+    def add(self, session):
+        with self.lock:
+            if session.session_id in self.sessions:
+                raise ValueError(f"同じIDのセッションがすでにあります: {session.session_id}")
+            self.sessions[session.session_id] = session
+        return session
+
+    # 解析待ちのブロックを処理しきってからセッションを外す
+    def remove(self, session, timeout=None):
+        self.wait_idle(session, timeout)
+        with self.lock:
+            self.sessions.pop(session.session_id, None)
+
+    def wait_idle(self, session, timeout=None):
+        return session.idle.wait(timeout)
+
+    # どのスレッドからでも呼べる: ブロックを解析待ちに積み、ワーカーが割り当てられていなければ割り当てる
+    # wait=True なら、解析待ちが溜まっているときは捨てずに空くまで呼び出し元を待たせる(アップロードされた録音など)
+    def submit(self, session, block, timestamp, wait=False):
+        with self.lock:
+            while wait and len(session.backlog) >= self.max_backlog:
+                self.space.wait()
+            if len(session.backlog) >= self.max_backlog:
+                # 解析が追いつかないときは古いブロックを捨てて遅延を抑える
+                session.backlog.popleft()
+                session.dropped += 1
+            session.backlog.append((block, timestamp))
+            session.max_backlog = max(session.max_backlog, len(session.backlog))
+            if session.scheduled:
+                return
+            session.scheduled = True
+            session.idle.clear()
+        self.executor.submit(self.drain, session)
+
+    # ワーカーで実行する: セッションの解析待ちのブロックを順番に処理する
+    def drain(self, session):
+        for _ in range(self.max_batch):
+            with self.lock:
+                if not session.backlog:
+                    session.scheduled = False
+                    session.idle.set()
+                    return
+                block, timestamp = session.backlog.popleft()
+                self.space.notify_all()
+            try:
+                session.process_block(block, timestamp)
+            except Exception as e:
+                session.errors += 1
+                print(f"[{session.session_id}] ブロックの処理に失敗しました: {e}")
+
+        # まだ残っていれば、他のセッションの後ろに並び直す
+        with self.lock:
+            if not session.backlog:
+                session.scheduled = False
+                session.idle.set()
+                return
+        self.executor.submit(self.drain, session)
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {
+            "sessions": len(sessions),
+            "backlog": sum(len(session.backlog) for session in sessions),
+            "dropped": sum(session.dropped for session in sessions),
+            "per_session": [session.stats() for session in sessions],
+        }
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import glob
+import os
+import time
+
+import librosa
+import numpy as np
+
+from note_events import NoteEvent, decode_messages, code_to_doremi
+from socket_connector import FRAME_HEADER, decode_frame_body, encode_frame
+
+# session_server.py に音声ファイルを演奏として送るクライアント
+# 1ファイルを1人の演奏者として、実際の演奏と同じ速さ(--fast なら待たずに)で音声を送り、返ってきた音符と結果を表示する
+# --compressed ならデコードせずにファイルの中身をそのまま送り、サーバ側の ffmpeg で少しずつデコードさせる
+# 複数のファイル(または --clients で同じファイルを何人分も)を同時に送って、サーバが何人まで捌けるかを確かめる
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CHUNK_SECONDS = 0.05  # 1回に送る音声の秒数
+COMPRESSED_CHUNK_BYTES = 4096  # --compressed のときに1回に送るバイト数
+
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length, encoding, type_length = FRAME_HEADER.unpack(header)
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return decode_frame_body(encoding, type_length, body)
+
+# サーバから返ってくるフレームを受け取る(音符イベントの遅延を記録する)
+async def receive(reader, session_id, latencies, verbose):
+    while True:
+        frame = await read_frame(reader)
+        if frame is None:
+            return None
+        data_type, data = frame
+        if data_type == "note":
+            now = time.monotonic()
+            for message in decode_messages(data):
+                if isinstance(message, NoteEvent):
+                    latencies.append(now - message.timestamp)
+                    if verbose:
+                        print(f"[{session_id}] 位置 {message.position + 1}: {code_to_doremi(message.pitch)}")
+        elif data_type in ("result", "error"):
+            return data_type, data
+
+# 送る音声を (チャンク, 演奏の何秒目までか) の順に返す
+def iter_chunks(path, sr, compressed):
+    if compressed:
+        duration = librosa.get_duration(path=path)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            sent = 0
+            while True:
+                data = f.read(COMPRESSED_CHUNK_BYTES)
+                if not data:
+                    return
+                sent += len(data)
+                yield data, duration * sent / size
+    audio_data, _ = librosa.load(path, sr=sr)
+    chunk = int(sr * CHUNK_SECONDS)
+    for start_index in range(0, len(audio_data), chunk):
+        yield audio_data[start_index:start_index + chunk].astype("<f4").tobytes(), (start_index + chunk) / sr
+
+# 1人分の演奏を送る
+async def play(path, session_id, host, port, sr, reference, bpm, fast, verbose, compressed=False):
+    reader, writer = await asyncio.open_connection(host, port)
+    hello = {"session_id": session_id, "sample_rate": sr, "bpm": bpm, "realtime": not fast}
+    if compressed:
+        hello["format"] = os.path.splitext(path)[1].lstrip(".").lower() or "auto"
+    if reference:
+        hello["reference"] = reference
+    writer.write(encode_frame("hello", hello))
+    frame = await read_frame(reader)
+    if frame is None or frame[0] != "ready":
+        writer.close()
+        raise ConnectionError(f"セッションを開始できませんでした: {frame}")
+
+    latencies = []
+    receiver = asyncio.get_running_loop().create_task(receive(reader, session_id, latencies, verbose))
+    start = time.monotonic()
+    for data, position in iter_chunks(path, sr, compressed):
+        writer.write(encode_frame("audio", data))
+        await writer.drain()
+        if not fast:
+            # 実際の演奏と同じ速さで送る
+            await asyncio.sleep(max(0.0, start + position - time.monotonic()))
+    writer.write(encode_frame("end", {}))
+    await writer.drain()
+
+    outcome = await receiver
+    writer.close()
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    if outcome is None or outcome[0] == "error":
+        print(f"[{session_id}] エラー: {outcome}")
+        return None
+    result = outcome[1]
+    print(f"[{session_id}] 正解率 {result['accuracy']:.0%}, 音符イベント {len(latencies)}個, "
+          f"遅延 p50 {np.percentile(latencies_ms, 50):.1f} ms / p95 {np.percentile(latencies_ms, 95):.1f} ms")
+    return result
+
+async def run_clients(paths, host, port, sr, reference, bpm, fast, verbose, compressed=False):
+    tasks = [play(path, f"{os.path.splitext(os.path.basename(path))[0]}-{k}", host, port, sr, reference, bpm, fast, verbose, compressed)
+             for k, path in enumerate(paths)]
+    return await asyncio.gather(*tasks)
+
+def main():
+    parser = argparse.ArgumentParser(description="session_server.py に音声ファイルを演奏として送る")
+    parser.add_argument("paths", nargs="*", help="送る音声ファイル(省略時は audio_files 以下の最初のファイル)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--clients", type=int, default=1, help="同じファイルを何人分送るか")
+    parser.add_argument("--sr", type=int, default=22050, help="送るPCMのサンプリングレート(サーバと違えばサーバ側でリサンプリングする)")
+    parser.add_argument("--reference", default=None, help="正解ファイル名(省略時はサーバの既定)")
+    parser.add_argument("--bpm", type=float, default=110)
+    parser.add_argument("--fast", action="store_true", help="演奏の速さを待たずに送る(録音のアップロードとして扱い、取りこぼさない)")
+    parser.add_argument("--compressed", action="store_true", help="ファイルをデコードせずにそのまま送る(サーバに ffmpeg が必要)")
+    parser.add_argument("--verbose", action="store_true", help="返ってきた音符を表示する")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(current_dir, "audio_files", "*")))[:1]
+    paths = [path for path in paths for _ in range(args.clients)]
+    start = time.monotonic()
+    results = asyncio.run(run_clients(paths, args.host, args.port, args.sr, args.reference, args.bpm, args.fast, args.verbose, args.compressed))
+    print(f"{len(paths)}人分の演奏を {time.monotonic() - start:.1f}秒で送りました (成功 {sum(r is not None for r in results)}人)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import AudioIngest, find_ffmpeg
+from results_store import RESULTS_DB_PATH, ResultsStore
+from score_index import load_reference
+from recognizer import NoteRecognizer
+from session import Session, SessionScheduler
+from socket_connector import FRAME_HEADER, decode_frame_body, encode_frame
+from timing import DEFAULT_BPM, load_timing
+from startup import StartupTimer
+
+# 1つのプロセスでたくさんの演奏者の音声をソケットやHTTPで受け取って解析するサーバ
+# 接続ごとにセッションを作り、届いた音声は ingest.AudioIngest で届いた分だけデコード・リサンプリングして、
+# ブロックは SessionScheduler の共有のワーカーで処理し、結果を同じ接続に返す
+#
+# ソケット(--port): socket_connector.py と同じフレーム形式
+#   クライアント -> サーバ
+#     "hello"(JSON): セッションの設定(下の SESSION_SETTINGS)
+#     "audio"(バイナリ): 音声(format が PCM なら長さは自由、圧縮された音声ならファイルの中身を先頭から少しずつ)
+#     "end": 演奏の終わり
+#   サーバ -> クライアント
+#     "ready"(JSON): セッションの設定, "note": 音符イベント, "notes": スナップショット
+#     "result"(JSON): 楽譜の位置に揃えた音階と正解率, "error"(JSON): エラーの内容
+#
+# HTTP(--http-port): POST(または PUT) /sessions?format=mp3&bpm=110 の本文に音声を送る(chunked でも Content-Length でもよい)
+#   返事は1行1つのJSON(application/x-ndjson)で、音符イベントを届いた順に返し、最後に "result" を返す
+#   例: curl -T IMG_6043.mp3 -H "Transfer-Encoding: chunked" "http://127.0.0.1:7080/sessions?format=mp3&realtime=0"
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_REFERENCE = "doremi_notes_list.json"
+MAX_WRITE_BUFFER = 1 << 20  # クライアントが受け取らずに溜まった送信データがこれを超えたらイベントを捨てる
+HTTP_READ_SIZE = 65536
+
+# セッションの設定と型(hello のJSONとHTTPのクエリで共通)
+#   session_id: 名前, reference: 正解ファイル名, bpm: BPM, sample_rate: 届く音声のサンプリングレート,
+#   format: "f32" / "s16" / "s32" / "mp3" などの音声の形式, channels: PCMのチャンネル数,
+#   realtime: 1 ならマイクからの演奏(解析が追いつかなければ捨てる)、0 なら録音のアップロード(受信を待たせる)
+SESSION_SETTINGS = {
+    "session_id": str,
+    "reference": str,
+    "bpm": float,
+    "sample_rate": int,
+    "format": str,
+    "channels": int,
+    "realtime": lambda value: str(value).lower() not in ("0", "false", "no"),
+    "wire_format": str,
+}
+
+def parse_settings(values):
+    return {name: SESSION_SETTINGS[name](value) for name, value in values.items() if name in SESSION_SETTINGS}
+
+
+# セッションの送信先: 解析のワーカーから呼ばれ、イベントループで同じ接続に書き込む
+# encode(data_type, data) で接続の形式(フレームかHTTPのチャンク)のバイト列にする
+class StreamOutput:
+    def __init__(self, loop, writer, encode=encode_frame):
+        self.loop = loop
+        self.writer = writer
+        self.encode = encode
+        self.dropped = 0
+
+    def send_event(self, event):
+        self.loop.call_soon_threadsafe(self.write, "note", event)
+
+    def send(self, data, key="state"):
+        self.loop.call_soon_threadsafe(self.write, key, data)
+
+    def write(self, data_type, data):
+        if self.writer.is_closing() or self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.dropped += 1
+            return
+        self.writer.write(self.encode(data_type, data))
+
+# HTTPのチャンクに1行のJSONを入れる
+def encode_ndjson_chunk(data_type, data):
+    if not isinstance(data, dict) or "type" not in data:
+        data = {"type": data_type, **data} if isinstance(data, dict) else {"type": data_type, "data": data}
+    line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+    return f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n"
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length, encoding, type_length = FRAME_HEADER.unpack(header)
+        body = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return decode_frame_body(encoding, type_length, body)
+
+# HTTPのリクエスト行とヘッダーを読む
+async def read_http_request(reader):
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    method, target, _ = request_line.split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    url = urllib.parse.urlsplit(target)
+    return method, url.path, dict(urllib.parse.parse_qsl(url.query)), headers
+
+# HTTPの本文を少しずつ読む(chunked なら1つのチャンクもさらに分けて読む)
+async def iter_http_body(reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()).strip():
+                    pass  # トレーラーを読み飛ばす
+                return
+            while size > 0:
+                data = await reader.readexactly(min(HTTP_READ_SIZE, size))
+                size -= len(data)
+                yield data
+            await reader.readline()
+    else:
+        remaining = int(headers.get("content-length", 0))
+        while remaining > 0:
+            data = await reader.read(min(HTTP_READ_SIZE, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+
+class SessionServer:
+    # ingest_workers: 音声のデコードと、録音のアップロードで解析を待つ間に使うスレッドの数
+    def __init__(self, scheduler, host="127.0.0.1", port=7000, http_port=None, bpm=DEFAULT_BPM,
+                 reference=DEFAULT_REFERENCE, ingest_workers=64, store=None):
+        self.scheduler = scheduler
+        self.store = store
+        self.host = host
+        self.port = port
+        self.http_port = http_port
+        self.bpm = bpm
+        self.reference = reference
+        self.references = {}  # (正解ファイル, BPM) -> (正解の音階, TimingModel)
+        self.ingest_executor = ThreadPoolExecutor(max_workers=ingest_workers, thread_name_prefix="ingest")
+        self.next_id = 0
+
+    # 正解ファイルはサーバのフォルダにあるものだけを使う(読み込んだものは使い回す)
+    def load(self, name, bpm):
+        path = os.path.join(current_dir, os.path.basename(name))
+        key = (path, bpm)
+        if key not in self.references:
+            self.references[key] = (load_reference(path), load_timing(path, bpm=bpm))
+        return self.references[key]
+
+    # 既定の正解ファイルを読み込み、ピッチ推定を合成音で1回動かしておく(最初の演奏者を待たせない)
+    def warm_up(self):
+        _, timing = self.load(self.reference, self.bpm)
+        NoteRecognizer(timing).warm_up()
+
+    # 設定からセッションと音声の受信口を作る
+    async def open_session(self, settings, output, wire_format="binary"):
+        reference, timing = await asyncio.to_thread(self.load, settings.get("reference", self.reference),
+                                                    settings.get("bpm", self.bpm))
+        self.next_id += 1
+        session_id = settings.get("session_id", f"session-{self.next_id}")
+        ingest = AudioIngest(lambda samples: self.submit_samples(session, samples), settings.get("sample_rate", timing.sr),
+                             timing.sr, settings.get("format", "f32"), settings.get("channels", 1))
+        session = Session(session_id, reference, timing, output=output, wire_format=settings.get("wire_format", wire_format),
+                          realtime=settings.get("realtime", True), store=self.store)
+        try:
+            self.scheduler.add(session)
+        except ValueError:
+            ingest.close()
+            raise
+        print(f"[{session_id}] 演奏を開始しました (同時に {len(self.scheduler.sessions)}人)")
+        return session, ingest
+
+    # デコードされた音声をホップごとのブロックにして解析待ちに積む(受信のスレッドから呼ばれる)
+    def submit_samples(self, session, samples):
+        timestamp = time.monotonic()
+        for block in session.split_blocks(samples):
+            self.scheduler.submit(session, block, timestamp, wait=not session.realtime)
+
+    # 届いた音声をデコードする(ffmpeg や録音の解析を待つことがあるので、イベントループでは行わない)
+    async def feed(self, ingest, data):
+        await asyncio.get_running_loop().run_in_executor(self.ingest_executor, ingest.feed, data)
+
+    # 残りの音声をデコードしきり、解析待ちのブロックを処理しきってから結果を返す
+    async def close_session(self, session, ingest):
+        await asyncio.get_running_loop().run_in_executor(self.ingest_executor, ingest.finish)
+        await asyncio.to_thread(self.scheduler.remove, session)
+        result = session.finish()
+        stats = session.stats()
+        print(f"[{session.session_id}] 演奏を終了しました: 正解率 {result['accuracy']:.0%}, "
+              f"解析 {stats['processed']}ブロック, 取りこぼし {stats['dropped']}, 平均 {stats['mean_block_ms']:.2f} ms")
+        return {**result, "stats": stats}
+
+    def abort_session(self, session, ingest):
+        ingest.close()
+        self.scheduler.remove(session, timeout=0)
+
+    async def handle_client(self, reader, writer):
+        session = ingest = None
+        try:
+            frame = await read_frame(reader)
+            if frame is None:
+                return
+            data_type, hello = frame
+            if data_type != "hello" or not isinstance(hello, dict):
+                raise ValueError("最初に hello を送ってください")
+            output = StreamOutput(asyncio.get_running_loop(), writer)
+            session, ingest = await self.open_session(parse_settings(hello), output)
+            writer.write(encode_frame("ready", {"session_id": session.session_id, "sample_rate": session.timing.sr,
+                                                "hop_size": session.timing.hop_size, "length": len(session.reference)}))
+            while True:
+                frame = await read_frame(reader)
+                if frame is None or frame[0] == "end":
+                    break
+                if frame[0] == "audio":
+                    await self.feed(ingest, frame[1])
+
+            result = await self.close_session(session, ingest)
+            session = None
+            writer.write(encode_frame("result", result))
+            await writer.drain()
+        except Exception as e:
+            print(f"セッションでエラーが発生しました: {e}")
+            if not writer.is_closing():
+                writer.write(encode_frame("error", {"message": str(e)}))
+            if session is not None:
+                self.abort_session(session, ingest)
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        session = ingest = None
+        try:
+            method, path, query, headers = await read_http_request(reader)
+            if method not in ("POST", "PUT") or path.rstrip("/") != "/sessions":
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            if headers.get("expect", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            try:
+                output = StreamOutput(asyncio.get_running_loop(), writer, encode=encode_ndjson_chunk)
+                session, ingest = await self.open_session(parse_settings(query), output, wire_format="json")
+            except (ValueError, OSError, RuntimeError) as e:
+                body = json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False).encode("utf-8")
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n"
+                             + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+                return
+            # 音符は本文を受け取りながら返す
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                         b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+            async for data in iter_http_body(reader, headers):
+                await self.feed(ingest, data)
+
+            result = await self.close_session(session, ingest)
+            session = None
+            writer.write(encode_ndjson_chunk("result", result) + b"0\r\n\r\n")
+            await writer.drain()
+        except Exception as e:
+            print(f"セッションでエラーが発生しました: {e}")
+            if session is not None:
+                self.abort_session(session, ingest)
+        finally:
+            writer.close()
+
+    # stats_interval 秒ごとに全体の状態を表示する
+    async def report(self, stats_interval):
+        while True:
+            await asyncio.sleep(stats_interval)
+            stats = self.scheduler.stats()
+            if stats["sessions"]:
+                print(f"セッション数: {stats['sessions']}, 解析待ち: {stats['backlog']}ブロック, 取りこぼし: {stats['dropped']}")
+
+    async def serve(self, stats_interval=None):
+        servers = [await asyncio.start_server(self.handle_client, self.host, self.port)]
+        print(f"{self.host}:{self.port} で演奏者の接続を待っています")
+        if self.http_port:
+            servers.append(await asyncio.start_server(self.handle_http, self.host, self.http_port))
+            print(f"http://{self.host}:{self.http_port}/sessions で録音のアップロードを待っています")
+        if stats_interval:
+            asyncio.get_running_loop().create_task(self.report(stats_interval))
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    def shutdown(self):
+        self.ingest_executor.shutdown(wait=False)
+        self.scheduler.shutdown(wait=False)
+        if self.store is not None:
+            self.store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="複数の演奏者の音声をソケットやHTTPで受け取って解析するサーバ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--http-port", type=int, default=None, help="録音をHTTPで受け取るポート(省略時は受け取らない)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="解析のワーカーの数")
+    parser.add_argument("--reference", default=DEFAULT_REFERENCE, help="設定で指定がないときの正解ファイル")
+    parser.add_argument("--bpm", type=float, default=DEFAULT_BPM)
+    parser.add_argument("--max-backlog", type=int, default=64, help="セッションごとに溜められる解析待ちのブロック数")
+    parser.add_argument("--results", default=RESULTS_DB_PATH, help="小節ごとの音階を記録するデータベース(空なら記録しない)")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="全体の状態を表示する間隔(秒)")
+    args = parser.parse_args()
+
+    # 圧縮された音声を送ってくるクライアントのために、ffmpeg があることを最初に確かめる
+    try:
+        print(f"ffmpeg: {find_ffmpeg()}")
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
+
+    startup_timer = StartupTimer()
+    scheduler = SessionScheduler(workers=args.workers, max_backlog=args.max_backlog)
+    store = ResultsStore(args.results) if args.results else None
+    server = SessionServer(scheduler, args.host, args.port, http_port=args.http_port, bpm=args.bpm,
+                           reference=args.reference, store=store)
+    startup_timer.mark("サーバの準備")
+    server.warm_up()
+    startup_timer.mark("正解ファイルの読み込みとウォームアップ")
+    startup_timer.report()
+    try:
+        asyncio.run(server.serve(args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
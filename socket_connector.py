@@ -0,0 +1,127 @@
+import json
+import socket
+import struct
+import threading
+
+# UnityConnector と同じ使い方(start_listening で接続を待ち、send で送る)ができるTCPの接続
+# 手元で送信の経路を動かして計測するために、mock_unity.py の模擬Unityと同じ形式でやりとりする
+#
+# フレーム形式(リトルエンディアン)
+#   length(I): data_type と payload のバイト数の合計, encoding(B): 0=JSON, 1=バイナリ, type_length(H)
+#   data_type(UTF-8), payload
+
+FRAME_HEADER = struct.Struct("<IBH")
+JSON_ENCODING = 0
+BINARY_ENCODING = 1
+STOP_DATA_TYPE = "stop"  # Unityから送られてくる停止命令
+
+# 1つのフレームを作る(bytes はそのまま、それ以外はJSONにする)
+def encode_frame(data_type, data):
+    type_bytes = data_type.encode("utf-8")
+    if isinstance(data, (bytes, bytearray)):
+        encoding, payload = BINARY_ENCODING, bytes(data)
+    else:
+        encoding, payload = JSON_ENCODING, json.dumps(data, ensure_ascii=False).encode("utf-8")
+    return FRAME_HEADER.pack(len(type_bytes) + len(payload), encoding, len(type_bytes)) + type_bytes + payload
+
+# フレームの本体(ヘッダーの後ろ)を data_type とデータに戻す
+def decode_frame_body(encoding, type_length, body):
+    data_type = body[:type_length].decode("utf-8")
+    payload = body[type_length:]
+    if encoding == JSON_ENCODING:
+        return data_type, json.loads(payload.decode("utf-8"))
+    return data_type, payload
+
+# ソケットからちょうど size バイト読む(接続が切れたら None)
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+# ソケットから1フレーム読む(接続が切れたら None)
+def read_frame(sock):
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    length, encoding, type_length = FRAME_HEADER.unpack(header)
+    body = recv_exactly(sock, length)
+    if body is None:
+        return None
+    return decode_frame_body(encoding, type_length, body)
+
+
+class SocketConnector:
+    def __init__(self, on_timeout, on_stopped, host="127.0.0.1", port=5000):
+        self.on_timeout = on_timeout
+        self.on_stopped = on_stopped
+        self.host = host
+        self.port = port
+        self.connection = None
+        self.server = None
+        self.send_lock = threading.Lock()
+
+    # Unity(模擬Unity)がつながるまで待つ
+    def start_listening(self, on_data_received):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, self.port))
+            server.listen(1)
+            self.server = server
+            try:
+                connection, _ = server.accept()
+            finally:
+                self.server = None
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection = connection
+        threading.Thread(target=self.receive_loop, args=(connection, on_data_received), daemon=True).start()
+
+    # Unityから届くデータを受け取る(接続が切れたら on_timeout、停止命令なら on_stopped を呼ぶ)
+    def receive_loop(self, connection, on_data_received):
+        while True:
+            try:
+                frame = read_frame(connection)
+            except OSError:
+                frame = None
+            if frame is None:
+                if self.connection is connection:
+                    self.close()
+                    self.on_timeout()
+                return
+            data_type, data = frame
+            if data_type == STOP_DATA_TYPE:
+                self.close()
+                self.on_stopped()
+                return
+            on_data_received(data_type, data)
+
+    def send(self, data_type, data):
+        connection = self.connection
+        if connection is None:
+            raise ConnectionError("Unityと接続されていません")
+        with self.send_lock:
+            connection.sendall(encode_frame(data_type, data))
+
+    def close(self):
+        # 接続待ちなら待ち受けをやめる
+        server = self.server
+        if server is not None:
+            try:
+                server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            server.close()
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                connection.close()
+            except OSError:
+                pass
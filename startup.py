@@ -0,0 +1,50 @@
+import os
+import time
+
+# 起動にかかる時間を段階ごとに測って表示する
+# 重いモジュール(librosa, numba, scipy.signal など)は使う関数の中で読み込み、ピッチ推定は warm_up() で
+# ストリームを開く前に1回動かしておくので、最初のブロックが届いてから読み込みやJITコンパイルを待たない
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+NUMBA_CACHE_DIR = os.path.join(current_dir, "numba_cache")
+
+# librosa の numba の関数のコンパイル結果をディスクに残して、次回の起動から再利用する
+# (numba が読み込まれる前に呼ぶ必要がある。環境変数ですでに指定されていればそちらを使う)
+def enable_numba_cache(cache_dir=NUMBA_CACHE_DIR):
+    os.environ.setdefault("NUMBA_CACHE_DIR", cache_dir)
+
+
+class StartupTimer:
+    # started: 計測の起点(省略時は今)
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.last = self.started
+        self.phases = []  # [(段階の名前, 秒数)]
+        self.first_note = None  # 起点から最初の音階を判定するまでの秒数
+
+    # 前の段階からここまでを name の段階として記録する
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+        return now - self.started
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    # 最初の音階を判定したときに1回だけ呼ぶ(2回目以降は何もしない)
+    def note_recognized(self):
+        if self.first_note is None:
+            self.first_note = self.elapsed()
+            print(f"最初の音階を判定するまで: 起動から {self.first_note:.2f}秒, "
+                  f"ストリームを開いてから {self.first_note - self.total():.2f}秒")
+
+    # mark() で記録した段階の合計
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def report(self):
+        print("起動時間:")
+        for name, seconds in self.phases:
+            print(f"  {name}: {seconds:.2f}秒")
+        print(f"  合計: {self.total():.2f}秒")
@@ -0,0 +1,204 @@
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+from scipy.special import betainc
+
+# YIN の累積平均正規化差分関数(CMND)を複数フレームまとめて計算する
+# frames: (フレーム数, フレーム長) の配列。戻り値は (フレーム数, max_period + 1)
+def yin_cmnd(frames, win_length, max_period):
+    frame_length = frames.shape[-1]
+    n_fft = 1 << int(np.ceil(np.log2(frame_length + win_length)))
+
+    # 自己相関(先頭 win_length サンプルと各ラグの相互相関)を FFT で計算
+    spectrum = np.fft.rfft(frames, n_fft, axis=-1)
+    head_spectrum = np.fft.rfft(frames[..., :win_length], n_fft, axis=-1)
+    acf = np.fft.irfft(spectrum * np.conj(head_spectrum), n_fft, axis=-1)[..., :max_period + 1]
+
+    # 各ラグでの窓内エネルギー
+    cumulative_energy = np.concatenate(
+        [np.zeros(frames.shape[:-1] + (1,)), np.cumsum(frames ** 2, axis=-1)], axis=-1
+    )
+    lags = np.arange(max_period + 1)
+    energy = cumulative_energy[..., lags + win_length] - cumulative_energy[..., lags]
+
+    # 差分関数 d(tau) と累積平均による正規化
+    difference = energy[..., :1] + energy - 2 * acf
+    difference[..., 0] = 0
+    difference = np.maximum(difference, 0)
+    cumulative_mean = np.cumsum(difference[..., 1:], axis=-1) / lags[1:]
+    cmnd = np.ones_like(difference)
+    cmnd[..., 1:] = difference[..., 1:] / (cumulative_mean + np.finfo(float).tiny)
+    return cmnd
+
+# 谷の位置を放物線補間して小数のラグに補正する
+def parabolic_shift(cmnd, taus):
+    rows = np.arange(len(taus))
+    left = cmnd[rows, np.maximum(taus - 1, 0)]
+    center = cmnd[rows, taus]
+    right = cmnd[rows, np.minimum(taus + 1, cmnd.shape[-1] - 1)]
+    denominator = left - 2 * center + right
+    shift = np.zeros(len(taus))
+    valid = np.abs(denominator) > 1e-12
+    shift[valid] = 0.5 * (left[valid] - right[valid]) / denominator[valid]
+    return np.clip(shift, -1, 1)
+
+
+# ブロックごとに pyin を最初から実行する代わりに、
+# 前のブロックの末尾(オーバーラップ分)と HMM の状態を保持して、新しいホップ分だけ計算するピッチトラッカー
+class StreamingPitchTracker:
+    def __init__(self, sr=22050, fmin=65.41, fmax=2093.0, frame_length=1024, hop_length=256,
+                 n_thresholds=100, beta_parameters=(2, 18), resolution=0.1,
+                 max_transition_rate=35.92, switch_prob=0.01, no_trough_prob=0.01):
+        self.sr = sr
+        self.fmin = fmin
+        self.fmax = fmax
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.win_length = frame_length // 2
+        self.no_trough_prob = no_trough_prob
+
+        # 探索するラグの範囲(fmax〜fmin)
+        self.min_period = max(int(np.floor(sr / fmax)), 1)
+        self.max_period = min(int(np.ceil(sr / fmin)), frame_length - self.win_length - 1)
+
+        # pyin と同じく、閾値の事前分布にベータ分布を使う(累積分布関数は正則化不完全ベータ関数)
+        # (scipy.stats は読み込みに時間がかかるので、scipy.special の betainc で計算する)
+        thresholds = np.linspace(0, 1, n_thresholds + 1)
+        self.thresholds = thresholds[1:]
+        self.beta_probs = np.diff(betainc(*beta_parameters, thresholds))
+
+        # ピッチの状態数(resolution 半音刻み)
+        self.bins_per_semitone = int(np.ceil(1.0 / resolution))
+        self.n_pitch_bins = int(np.floor(12 * self.bins_per_semitone * np.log2(fmax / fmin))) + 1
+        self.bin_frequencies = fmin * 2 ** (np.arange(self.n_pitch_bins) / (12 * self.bins_per_semitone))
+
+        # 1フレームで移動できるピッチ状態の幅と有声/無声の切り替え確率
+        max_semitones_per_frame = max_transition_rate * 12 * hop_length / sr
+        self.transition_width = int(round(max_semitones_per_frame * self.bins_per_semitone)) * 2 + 1
+        self.log_stay = np.log(1 - switch_prob)
+        self.log_switch = np.log(switch_prob)
+
+        self.reset()
+
+    # 状態を初期化する(新しい演奏の開始時に呼ぶ)
+    def reset(self):
+        self.buffer = np.zeros(0, dtype=np.float64)
+        # Viterbi の前向き対数確率(有声状態と無声状態)
+        uniform = -np.log(2 * self.n_pitch_bins)
+        self.log_delta_voiced = np.full(self.n_pitch_bins, uniform)
+        self.log_delta_unvoiced = np.full(self.n_pitch_bins, uniform)
+        self.samples_seen = 0
+        self.frames_seen = 0
+        self.last_f0 = np.nan
+        self.last_voiced_prob = 0.0
+
+    # フレームごとの有声ピッチ状態の観測確率を計算する
+    def observation_probs(self, frames):
+        n_frames = len(frames)
+        cmnd = yin_cmnd(frames, self.win_length, self.max_period)
+        search = cmnd[:, self.min_period:self.max_period + 1]
+
+        # 探索範囲内の谷(極小値)
+        is_trough = np.zeros(search.shape, dtype=bool)
+        is_trough[:, 1:-1] = (search[:, 1:-1] < search[:, :-2]) & (search[:, 1:-1] <= search[:, 2:])
+        is_trough[:, 0] = search[:, 0] < search[:, 1]
+        trough_values = np.where(is_trough, search, np.inf)
+
+        # 各閾値について、閾値を下回る最初の谷に事前確率を割り当てる
+        below = trough_values[:, :, None] < self.thresholds[None, None, :]
+        first_trough = np.argmax(below, axis=1)
+        has_trough = below.any(axis=1)
+        tau_probs = np.zeros(search.shape)
+        frame_index = np.broadcast_to(np.arange(n_frames)[:, None], first_trough.shape)
+        np.add.at(tau_probs, (frame_index[has_trough], first_trough[has_trough]),
+                  np.broadcast_to(self.beta_probs, first_trough.shape)[has_trough])
+
+        # どの閾値も下回らなかった分は、最小の谷に小さな確率で割り当てる
+        missing = np.sum(np.where(has_trough, 0, self.beta_probs[None, :]), axis=1)
+        global_min = np.argmin(trough_values, axis=1)
+        tau_probs[np.arange(n_frames), global_min] += missing * self.no_trough_prob
+
+        # ラグをピッチ状態に変換して確率を集計する
+        frame_rows, tau_columns = np.nonzero(tau_probs)
+        taus = tau_columns + self.min_period
+        shifts = parabolic_shift(cmnd[frame_rows], taus)
+        f0 = self.sr / (taus + shifts)
+        bins = np.round(12 * self.bins_per_semitone * np.log2(f0 / self.fmin)).astype(int)
+        bins = np.clip(bins, 0, self.n_pitch_bins - 1)
+        voiced_obs = np.zeros((n_frames, self.n_pitch_bins))
+        np.add.at(voiced_obs, (frame_rows, bins), tau_probs[frame_rows, tau_columns])
+        return voiced_obs
+
+    # Viterbi の前向き計算を1フレーム進める
+    def step(self, voiced_obs):
+        voiced_prob = min(voiced_obs.sum(), 1.0)
+        unvoiced_obs = (1 - voiced_prob) / self.n_pitch_bins
+
+        # ピッチは近い状態にしか移動できないので、全状態間ではなく近傍の最大値だけを取る
+        reach_voiced = maximum_filter1d(self.log_delta_voiced, self.transition_width, mode="nearest")
+        reach_unvoiced = maximum_filter1d(self.log_delta_unvoiced, self.transition_width, mode="nearest")
+
+        with np.errstate(divide="ignore"):
+            log_voiced_obs = np.log(voiced_obs)
+            log_unvoiced_obs = np.log(unvoiced_obs) if unvoiced_obs > 0 else -np.inf
+        next_voiced = np.maximum(reach_voiced + self.log_stay, reach_unvoiced + self.log_switch) + log_voiced_obs
+        next_unvoiced = np.maximum(reach_unvoiced + self.log_stay, reach_voiced + self.log_switch) + log_unvoiced_obs
+
+        # 値が小さくなりすぎないように正規化する
+        peak = max(next_voiced.max(), next_unvoiced.max())
+        if not np.isfinite(peak):
+            peak = 0.0
+        self.log_delta_voiced = next_voiced - peak
+        self.log_delta_unvoiced = next_unvoiced - peak
+
+        best_voiced = int(np.argmax(self.log_delta_voiced))
+        if self.log_delta_voiced[best_voiced] >= self.log_delta_unvoiced.max():
+            return self.bin_frequencies[best_voiced], True, voiced_prob
+        return np.nan, False, voiced_prob
+
+    # 新しい音声ブロックを追加し、新しく計算できたフレームの (f0, voiced_flag, voiced_prob) を返す
+    def update(self, block):
+        self.buffer = np.concatenate([self.buffer, np.asarray(block, dtype=np.float64)])
+        self.samples_seen += len(block)
+
+        n_frames = 0
+        if len(self.buffer) >= self.frame_length:
+            n_frames = (len(self.buffer) - self.frame_length) // self.hop_length + 1
+        if n_frames == 0:
+            return np.zeros(0), np.zeros(0, dtype=bool), np.zeros(0)
+
+        # 新しいフレームだけをまとめて切り出す(コピーなしのビュー)
+        windows = np.lib.stride_tricks.sliding_window_view(self.buffer, self.frame_length)
+        frames = windows[:n_frames * self.hop_length:self.hop_length]
+        voiced_obs = self.observation_probs(frames)
+
+        f0 = np.full(n_frames, np.nan)
+        voiced_flag = np.zeros(n_frames, dtype=bool)
+        voiced_probs = np.zeros(n_frames)
+        for k in range(n_frames):
+            f0[k], voiced_flag[k], voiced_probs[k] = self.step(voiced_obs[k])
+
+        # 次のフレームに必要なオーバーラップ分だけを残す
+        self.buffer = self.buffer[n_frames * self.hop_length:]
+        self.frames_seen += n_frames
+        self.last_f0 = f0[-1]
+        self.last_voiced_prob = voiced_probs[-1]
+        return f0, voiced_flag, voiced_probs
+
+    # 無音のブロックをピッチ推定せずに読み飛ばす(フレームの数と位置は update() と同じにする)
+    # 新しいフレームはすべて無声とし、HMM の状態は長い無音の後と同じく初期状態に戻す
+    def skip(self, block):
+        self.buffer = np.concatenate([self.buffer, np.asarray(block, dtype=np.float64)])
+        self.samples_seen += len(block)
+
+        n_frames = 0
+        if len(self.buffer) >= self.frame_length:
+            n_frames = (len(self.buffer) - self.frame_length) // self.hop_length + 1
+        self.buffer = self.buffer[n_frames * self.hop_length:]
+        self.frames_seen += n_frames
+        if n_frames > 0:
+            uniform = -np.log(2 * self.n_pitch_bins)
+            self.log_delta_voiced = np.full(self.n_pitch_bins, uniform)
+            self.log_delta_unvoiced = np.full(self.n_pitch_bins, uniform)
+            self.last_f0 = np.nan
+            self.last_voiced_prob = 0.0
+        return np.full(n_frames, np.nan), np.zeros(n_frames, dtype=bool), np.zeros(n_frames)
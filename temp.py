@@ -1,77 +1,91 @@
-import sounddevice as sd
 import numpy as np
-import librosa
 import os
-import json
-from connection import send_data_loop
+from connection import send_data_loop, close_transport
+from pitch_backends import get_estimator
+from offline import transcribe_reader
+from audio_reader import AudioReader
+from onset import segment_by_onsets, cached_onset_envelope
+from results_store import ResultsStore, new_session_id
+from timing import DEFAULT_BPM, TimingModel
+from note_table import hz_to_codes, hz_to_cents, natural_codes, in_octaves, code_to_label
+from recognizer import ENERGY_GATE, dominant_pitch
 
 # 音声ファイルのパス
 current_dir = os.path.dirname(os.path.abspath(__file__))
 audio_file_path = os.path.join(current_dir, "audio_files", "IMG_6043.mp3")
 
-# ms_dictのパス
-ms_dict_path = os.path.join(current_dir, "ms_dict")
-
 # サンプリングレートを設定
 sr = 22050  # サンプリングレート
 previous_doremi_note = "不明"
 
-# 英語音階名をドレミファソラシドに変換する辞書
-note_to_doremi = {
-    'C': 'ド',
-    'C♯': 'ド',
-    'D': 'レ',
-    'D♯': 'レ',
-    'E': 'ミ',
-    'F': 'ファ',
-    'F♯': 'ファ',
-    'G': 'ソ',
-    'G♯': 'ソ',
-    'A': 'ラ',
-    'A♯': 'ラ',
-    'B': 'シ'
-}
+# ピッチ推定バックエンド("pyin": 正確な参照用, "yin": バイオリンの音域に限定した高速版)
+PITCH_BACKEND = "pyin"
+
+# 八分音符の秒数(110BPMで約0.27秒)
+SPLIT_TIME = TimingModel(bpm=DEFAULT_BPM).note_seconds
+
+# True の場合は音声全体を1回でピッチ推定する一括モード、False の場合は区切った音ごとに推定する
+BATCH_MODE = True
+
+# 一括モードでないときの音の区切り方("onset": オンセットで区切る, "fixed": 八分音符ごとの決まった長さで区切る)
+SEGMENTATION = "onset"
 
 # 音声データを指定された時間毎に分割
+# (リストにせず、コピーしないビューを1つずつ返すので、np.memmap の長い録音でもメモリを使わない)
 def split_audio(audio_data, split_time, sr=22050):
     split_index = int(sr * split_time)
-    split_audio_data = [audio_data[i:i+split_index] for i in range(2*split_index, len(audio_data), split_index)]
-    return split_audio_data
-
-# ファイル名の連番を作成する
-def get_next_filename(base_filename, extension, i):
-    filename = f"{base_filename}_{i}.{extension}"
-    return filename
+    for i in range(2*split_index, len(audio_data), split_index):
+        yield audio_data[i:i+split_index]
+
+# 音声データをオンセットで区切ってから八分音符の長さごとに分割する
+# (決まった間隔で区切る split_audio と違い、区切りの位置を音の立ち上がりに揃え直すので、テンポが揺れても前の音が混ざらない)
+# split_audio と同じく先頭の2マス分は読み飛ばし、八分音符の半分に満たない端は捨てる
+# onsets: 音声全体で求めてあるオンセットのサンプル位置(None なら読み飛ばしたあとの音声から検出する)
+def split_audio_by_onsets(audio_data, split_time, sr=22050, onsets=None):
+    split_index = int(sr * split_time)
+    audio_data = audio_data[2*split_index:]
+    if onsets is not None:
+        onsets = np.asarray(onsets) - 2*split_index
+    for start, stop in segment_by_onsets(audio_data, sr=sr, max_length=split_index, min_length=split_index//2, onsets=onsets):
+        if stop - start >= split_index // 2:
+            yield audio_data[start:stop]
 
 # バイオリンの音階を判定する
-def ms_recognition(indata, sr=22050, hop_length=512):
+def ms_recognition(indata, sr=22050, hop_length=512, backend=PITCH_BACKEND):
     global previous_doremi_note
     
     # 入力された音声データを取得
     audio_data = indata # 1チャンネル分の音声
     
-    # ピッチ推定（基本周波数を取得）
-    f0, _, _  = librosa.pyin(audio_data, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=sr, hop_length=hop_length)
+    # 小さな音(無音・休符)のブロックはピッチ推定を省いて休符とする
+    rms = float(np.sqrt(np.mean(np.square(audio_data, dtype=np.float64)))) if len(audio_data) else 0.0
+    if rms < ENERGY_GATE:
+        print(f"無音判定 (RMS: {rms:.4f})")
+        print("------------------------------------------------------------------")
+        return "休符"
+
+    # ピッチ推定（基本周波数と有声の確からしさを取得）
+    estimator = get_estimator(backend, sr=sr, hop_length=hop_length)
+    f0, _, voiced_probs = estimator.estimate(audio_data)
     
     # 基本周波数が存在するかを確認
     if f0 is not None:
-        # nanを除いた周波数の平均を取得
         valid_f0 = f0[~np.isnan(f0)]
         if len(valid_f0) > 0:
-            dominant_f0 = np.mean(valid_f0)
-            note = librosa.hz_to_note(dominant_f0)  # 周波数を対応する音階名に変換する
-            
-            # 音階をドレミファソラシドに変換
-            base_note = note[:-1]  # 音階（例: C, D#, E）
-            octave = note[-1]      # オクターブ番号（例: 4）
+            # いちばん多い半音のフレームの f0 を代表にする(平均と違い、オクターブ誤りや音の変わり目を混ぜない)
+            dominant_f0 = dominant_pitch(valid_f0)
+            nearest_code = int(hz_to_codes(dominant_f0))  # 周波数を対応する音高コードに変換する
+            cents = float(hz_to_cents(dominant_f0, nearest_code))
+            code = int(natural_codes(nearest_code))
             
             # オクターブが4, 5, 6の範囲内の音階のみを取得
-            if octave == "4" or octave == "5" or octave == "6":
-                doremi_note = note_to_doremi.get(base_note, "不明") + octave  # ドレミファソラシド形式に変換
+            if in_octaves(code):
+                doremi_note = code_to_label(code)  # ドレミファソラシド形式に変換
             else:
                 print("音階が4, 5, 6の範囲外です")
                 doremi_note = previous_doremi_note # 直前の音階を返す
             
+            print(f"有声の確からしさ: {np.mean(voiced_probs):.2f}, RMS: {rms:.4f}, ずれ: {cents:+.0f}セント")
             print(f"基本周波数: {dominant_f0:.2f} Hz, 音階: {doremi_note}")
             print("------------------------------------------------------------------")
             previous_doremi_note = doremi_note
@@ -84,77 +98,90 @@ def ms_recognition(indata, sr=22050, hop_length=512):
         print("ピッチ検知に失敗した!!")
         return "検知失敗"
 
-# 音声ファイルを読み込み、リアルタイムで音声を処理
-audio_data, sr = librosa.load(audio_file_path, sr=sr)
-
-# 音声ファイルを0.27秒ごとに分割(八部音符の秒数)
-split_audio_data = split_audio(audio_data, split_time=0.27, sr=sr)
-
-ms_dict = {}
-ms_list = []
-current_i = 0
-i = 0
-previous_note = None
-
-# ms_dict以下のファイルを削除
-for file in os.listdir(ms_dict_path):
-    file_path = os.path.join(ms_dict_path, file)
-    os.remove(file_path)
-
-# フラグ: "ファ5"が検出されたかどうかを追跡
-found_fa5 = False
-
-# 音声データをUnityに送信する
-for audio_data in split_audio_data:
-    detected_note = ms_recognition(audio_data)
-    
-    # "ファ5"が見つかっていないかつ"ファ5"が検知された場合、フラグをTrueにする
-    if not found_fa5 and detected_note == "ファ5":
-        print("ファ5が検知されました。ここからJSONファイルを生成します。")
-        found_fa5 = True
-
-    # "ファ5"を検知した後のみ、処理を進める
-    if found_fa5:
-        ms_dict[current_i] = detected_note
-        ms_list.append(ms_dict[current_i])
-        current_i += 1
-
-        # 1小節分の音階を取得したらUnityに送信する
-        if current_i == 8:
-            filename = get_next_filename("ms_dict", "json", i)
-            ms_save_path= os.path.join(ms_dict_path, filename)
-            print("******************************************************************")
-            print(f"{i + 1}小節目終了")
-            print("******************************************************************")
+# 音声ファイルを読み込み、八分音符ごとの音階をUnityに送信する
+def main():
+    # デコード・リサンプリング済みの音声をキャッシュから np.memmap で開く(全体をメモリに読み込まない)
+    # ピッチ推定とオンセットの結果も録音ごとにキャッシュしてあれば使う(feature_cache)
+    reader = AudioReader(audio_file_path, sr=sr)
+    audio_data = reader.audio
+
+    # 音声ファイルを0.27秒ごと(八部音符の秒数)に音階を推定
+    if BATCH_MODE:
+        # 八分音符ごとに ms_recognition と同じ判定をした Recognition(音階、f0、有声の確からしさ、RMS など)を返す
+        detected_notes = [recognition.note for recognition in
+                          transcribe_reader(reader, split_time=SPLIT_TIME, backend=PITCH_BACKEND)]
+    elif SEGMENTATION == "onset":
+        _, onsets = cached_onset_envelope(reader)
+        split_audio_data = split_audio_by_onsets(audio_data, split_time=SPLIT_TIME, sr=sr, onsets=onsets)
+        detected_notes = (ms_recognition(audio_data) for audio_data in split_audio_data)
+    else:
+        split_audio_data = split_audio(audio_data, split_time=SPLIT_TIME, sr=sr)
+        detected_notes = (ms_recognition(audio_data) for audio_data in split_audio_data)
+
+    ms_dict = {}
+    ms_list = []
+    current_i = 0
+    i = 0
+
+    # 小節ごとの音階は結果ストアに新しい演奏として記録する(以前の結果は消さない)
+    results_store = ResultsStore()
+    session_id = new_session_id("offline")
+    results_store.start_session(session_id)
+
+    # フラグ: "ファ5"が検出されたかどうかを追跡
+    found_fa5 = False
+
+    # 音声データをUnityに送信する
+    for detected_note in detected_notes:
+        # "ファ5"が見つかっていないかつ"ファ5"が検知された場合、フラグをTrueにする
+        if not found_fa5 and detected_note == "ファ5":
+            print("ファ5が検知されました。ここからJSONファイルを生成します。")
+            found_fa5 = True
+
+        # "ファ5"を検知した後のみ、処理を進める
+        if found_fa5:
+            ms_dict[current_i] = detected_note
+            ms_list.append(ms_dict[current_i])
+            current_i += 1
+
+            # 1小節分の音階を取得したらUnityに送信する
+            if current_i == 8:
+                print("******************************************************************")
+                print(f"{i + 1}小節目終了")
+                print("******************************************************************")
             
-            # Save the data for the measure into a JSON file
-            with open(ms_save_path, "w", encoding="utf-8") as f:
-                f.write(json.dumps(ms_dict, ensure_ascii=False, indent=4))
+                # Save the data for the measure (written by the store's background thread)
+                results_store.save_measure(session_id, i, ms_dict)
             
-            # Send the data to Unity
-            test = {"key": ','.join(ms_list)}
-            print(test)
-            send_data_loop(test)
-            print(ms_dict)
+                # Send the data to Unity
+                test = {"key": ','.join(ms_list)}
+                print(test)
+                send_data_loop(test)
+                print(ms_dict)
             
-            # Reset for the next measure
-            ms_dict = {}
-            current_i = 0
-            i += 1
-
-# After the loop, check if there's any leftover data (less than 8 notes)
-if current_i > 0 and ms_dict:
-    test = {"key": ','.join(ms_list)}
-    filename = get_next_filename("ms_dict", "json", i)
-    ms_save_path = os.path.join(ms_dict_path, filename)
-    print(f"Sending remaining data (less than 8 notes): {current_i} notes.")
+                # Reset for the next measure
+                ms_dict = {}
+                current_i = 0
+                i += 1
+
+    # After the loop, check if there's any leftover data (less than 8 notes)
+    if current_i > 0 and ms_dict:
+        test = {"key": ','.join(ms_list)}
+        print(f"Sending remaining data (less than 8 notes): {current_i} notes.")
     
-    # Save remaining notes to a JSON file
-    with open(ms_save_path, "w", encoding="utf-8") as f:
-        f.write(json.dumps(ms_dict, ensure_ascii=False, indent=4))
+        # Save remaining notes
+        results_store.save_measure(session_id, i, ms_dict)
     
-    # Send the remaining data to Unity
-    send_data_loop(test)
+        # Send the remaining data to Unity
+        send_data_loop(test)
+
+    # Print the full list of notes
+    print(ms_list)
+
+    # 保存待ちの結果と送信待ちのデータを書き出してから終了する
+    results_store.finish_session(session_id)
+    results_store.close()
+    close_transport()
 
-# Print the full list of notes
-print(ms_list)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
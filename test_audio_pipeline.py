@@ -0,0 +1,29 @@
+import numpy as np
+
+from audio_pipeline import AnalysisWorker, BlockRingBuffer
+
+# 解析スレッドは1つのブロックの処理に失敗しても止まらずに、残りのブロックを処理し続ける
+
+
+def test_worker_keeps_going_after_process_block_raises():
+    ring_buffer = BlockRingBuffer(block_size=4, capacity=8)
+    seen = []
+
+    def process_block(audio_data, timestamp):
+        if timestamp == 1.0:
+            raise ValueError("失敗")
+        seen.append(timestamp)
+        return "ド4"
+
+    worker = AnalysisWorker(ring_buffer, process_block, poll_interval=0.01)
+    worker.start()
+    for timestamp in range(4):
+        assert ring_buffer.push(np.zeros(4, dtype=np.float32), float(timestamp))
+    worker.stop(timeout=5.0)
+
+    assert not worker.is_alive()
+    assert seen == [0.0, 2.0, 3.0]
+    stats = worker.stats()
+    assert stats["processed"] == 3
+    assert stats["errors"] == 1
+    assert stats["dropped"] == 0
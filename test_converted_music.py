@@ -0,0 +1,49 @@
+import os
+
+from music21 import converter
+
+from converted_music import iter_eighth_notes, score_to_doremi_list
+from score_index import ScoreLibrary, compile_score
+
+# 同梱の楽譜(music_score.mxl)を八分音符に展開したときの数を固定しておく
+# 以前の(音符をディープコピーして八分音符の楽譜を作り直す)変換は、2つのパートの音符(休符を除く)を順に並べて 528 個だった
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+SCORE_PATH = os.path.join(current_dir, "music_score.mxl")
+
+BASELINE_COUNT = 528  # 以前の変換の音階の数(休符なし)
+EIGHTH_NOTE_COUNT = 645  # iter_eighth_notes が返す八分音符の数(休符を含む)
+
+
+def test_score_to_doremi_list_matches_baseline_count():
+    doremi_list = score_to_doremi_list(converter.parse(SCORE_PATH))
+    assert len(doremi_list) == BASELINE_COUNT
+    assert "休符" not in doremi_list
+    assert doremi_list[:8] == ['ファ5', 'ファ5', 'ミ5', 'ソ5', 'ソ5', 'ファ5', 'レ5', 'レ5']
+
+
+def test_iter_eighth_notes_keeps_rests_and_ties():
+    eighth_notes = list(iter_eighth_notes(converter.parse(SCORE_PATH)))
+    assert len(eighth_notes) == EIGHTH_NOTE_COUNT
+    assert sum(eighth_note.pitch is not None for eighth_note in eighth_notes) == BASELINE_COUNT
+    # 4分音符の2つ目の八分音符は前の音の続き
+    assert eighth_notes[0].tied is False and eighth_notes[1].tied is True
+
+
+def test_compiled_score_matches_converted_music():
+    score = converter.parse(SCORE_PATH)
+    assert compile_score(SCORE_PATH).doremi_list() == score_to_doremi_list(score)
+
+
+def test_score_library_rebuilds_a_truncated_cache(tmp_path):
+    library = ScoreLibrary(cache_dir=str(tmp_path))
+    expected = library.get(SCORE_PATH).doremi_list()
+    cache_files = os.listdir(tmp_path)
+    assert len(cache_files) == 1 and cache_files[0].endswith(".npz")  # 一時ファイルは残らない
+
+    # 書きかけで途切れたキャッシュは読めないので、コンパイルし直して置き換える
+    cache_path = os.path.join(tmp_path, cache_files[0])
+    with open(cache_path, "r+b") as f:
+        f.truncate(64)
+    assert ScoreLibrary(cache_dir=str(tmp_path)).get(SCORE_PATH).doremi_list() == expected
+    assert os.path.getsize(cache_path) > 64
@@ -0,0 +1,73 @@
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+
+import audio_reader
+from audio_reader import AudioReader
+from feature_cache import FeatureCache
+
+# 特徴量のキャッシュの容量の管理と、別のプロセスに消されたときの読み直し
+
+
+def write_entry(cache, name, size, age):
+    path = os.path.join(cache.cache_dir, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return path
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache = FeatureCache(str(tmp_path), max_bytes=250, grace_seconds=0)
+    oldest = write_entry(cache, "a.npz", 100, 30)
+    middle = write_entry(cache, "b.npz", 100, 20)
+    newest = write_entry(cache, "c.npz", 100, 10)
+    assert cache.evict() == 1
+    assert not os.path.exists(oldest)
+    assert os.path.exists(middle) and os.path.exists(newest)
+
+
+def test_evict_spares_kept_and_recently_used_files(tmp_path):
+    cache = FeatureCache(str(tmp_path), max_bytes=0, grace_seconds=60)
+    kept = write_entry(cache, "a.f32", 100, 300)
+    recent = write_entry(cache, "b.npz", 100, 5)
+    stale = write_entry(cache, "c.npz", 100, 300)
+    assert cache.evict(keep=(kept,)) == 1
+    assert os.path.exists(kept) and os.path.exists(recent)
+    assert not os.path.exists(stale)
+
+
+def test_get_or_compute_saves_once(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"f0": np.arange(3.0)}
+    for _ in range(2):
+        arrays = cache.get_or_compute("digest", "pitch", {"hop_length": 512}, compute)
+        assert arrays["f0"].tolist() == [0.0, 1.0, 2.0]
+    assert len(calls) == 1
+    assert cache.hits == 1
+
+
+def test_audio_reader_redecodes_when_cache_file_vanishes(tmp_path, monkeypatch):
+    path = str(tmp_path / "tone.wav")
+    sf.write(path, np.sin(np.arange(2205) / 10.0).astype(np.float32), 22050)
+    cache = FeatureCache(str(tmp_path / "cache"))
+    expected = np.array(AudioReader(path, cache=cache).audio)
+
+    # 存在を確かめたあと、開く前に別のプロセスが消した場合
+    memmap = np.memmap
+    def vanishing_memmap(filename, *args, **kwargs):
+        monkeypatch.setattr(audio_reader.np, "memmap", memmap)
+        os.remove(filename)
+        raise FileNotFoundError(filename)
+    monkeypatch.setattr(audio_reader.np, "memmap", vanishing_memmap)
+
+    reader = AudioReader(path, cache=cache)
+    assert np.array_equal(reader.audio, expected)
+    assert os.path.exists(reader.cache_path)
@@ -0,0 +1,74 @@
+import pytest
+
+from note_events import (EVENT_FORMAT, SNAPSHOT_HEADER_FORMAT, NoteEvent, NoteEventEncoder, Snapshot,
+                         decode_messages, encode_event, encode_snapshot)
+from note_table import REST_CODE, UNKNOWN_CODE, label_to_code
+
+# Unity へ送るバイナリ形式(note_events の先頭の説明)を固定しておく
+# confidence は float32 で送るので、丸めても値の変わらない数にしておく
+
+EVENT = NoteEvent(seq=7, position=-1, pitch=77, confidence=0.75, timestamp=12345.678901)
+SNAPSHOT = Snapshot(seq=32, position=3, pitches=[77, REST_CODE, UNKNOWN_CODE, 0, 127])
+
+
+def test_event_round_trip():
+    data = encode_event(EVENT)
+    assert EVENT_FORMAT.format == "<BIihfd" and len(data) == 23
+    assert data[0] == 1
+    assert decode_messages(data) == [EVENT]
+
+
+def test_snapshot_round_trip():
+    data = encode_snapshot(SNAPSHOT)
+    assert SNAPSHOT_HEADER_FORMAT.format == "<BIiI"
+    assert len(data) == SNAPSHOT_HEADER_FORMAT.size + 2 * len(SNAPSHOT.pitches)
+    assert data[0] == 2
+    assert decode_messages(data) == [SNAPSHOT]
+    assert decode_messages(encode_snapshot(Snapshot(0, 0, []))) == [Snapshot(0, 0, [])]
+
+
+def test_mixed_messages_in_one_frame():
+    events = [EVENT._replace(seq=seq, position=seq) for seq in range(3)]
+    data = encode_event(events[0]) + encode_snapshot(SNAPSHOT) + encode_event(events[1]) + encode_event(events[2])
+    assert decode_messages(data) == [events[0], SNAPSHOT, events[1], events[2]]
+
+
+@pytest.mark.parametrize("data", [
+    encode_event(EVENT)[:-1],                               # イベントの途中まで
+    encode_event(EVENT) + encode_event(EVENT)[:5],          # 2つ目のイベントの途中まで
+    encode_snapshot(SNAPSHOT)[:SNAPSHOT_HEADER_FORMAT.size - 1],  # スナップショットのヘッダの途中まで
+    encode_snapshot(SNAPSHOT)[:-1],                         # スナップショットの音高の途中まで
+])
+def test_partial_buffer_is_rejected(data):
+    with pytest.raises(ValueError):
+        decode_messages(data)
+
+
+def test_unknown_message_type_is_rejected():
+    with pytest.raises(ValueError):
+        decode_messages(b"\x03" + encode_event(EVENT)[1:])
+
+
+def test_encoder_binary_and_json_agree():
+    binary = NoteEventEncoder(4, snapshot_interval=2)
+    json = NoteEventEncoder(4, wire_format="json", snapshot_interval=2)
+    notes = [(0, "ファ5", 0.5, 1.0), (1, "休符", 0.0, 1.25), (2, "不明", 0.25, 1.5)]
+    for position, note, confidence, timestamp in notes:
+        binary_event, binary_snapshot = binary.note(position, note, confidence, timestamp)
+        json_event, json_snapshot = json.note(position, note, confidence, timestamp)
+
+        [event] = decode_messages(binary_event)
+        assert event == NoteEvent(json_event["seq"], json_event["position"], json_event["pitch"],
+                                  json_event["confidence"], json_event["timestamp"])
+        assert json_event["type"] == "note" and json_event["note"] == note
+        assert event.pitch == label_to_code(note)
+
+        # 2つごとにスナップショットを送る(seq はそれに含まれていない最初のイベントの番号)
+        assert (binary_snapshot is None) == (json_snapshot is None) == (event.seq % 2 == 0)
+        if binary_snapshot is not None:
+            [snapshot] = decode_messages(binary_snapshot)
+            assert snapshot == Snapshot(2, 1, [label_to_code("ファ5"), REST_CODE, REST_CODE, REST_CODE])
+            assert json_snapshot == {"type": "snapshot", "seq": 2, "position": 1, "key": "ファ5,休符,休符,休符"}
+
+    with pytest.raises(ValueError):
+        NoteEventEncoder(4, wire_format="xml")
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from note_table import (REST_CODE, REST_LABEL, UNKNOWN_CODE, UNKNOWN_LABEL, code_to_label, codes_to_labels, hz_to_codes,
+                        label_to_code, midi_to_hz, note_to_midi)
+
+# 音高コード(MIDI ノート番号)と音階の対応表を固定しておく
+# 表の両端(MIDI 0 = ド-1、127 = ソ9)、休符(-1)と不明(-2)、オクターブのない音階を含める
+
+# (音高コード, 音階, ♯を区別した音階)
+CODE_LABELS = [
+    (0, "ド-1", "ド-1"),
+    (1, "ド-1", "ド#-1"),
+    (11, "シ-1", "シ-1"),
+    (12, "ド0", "ド0"),
+    (60, "ド4", "ド4"),
+    (66, "ファ4", "ファ#4"),
+    (69, "ラ4", "ラ4"),
+    (77, "ファ5", "ファ5"),
+    (126, "ファ9", "ファ#9"),
+    (127, "ソ9", "ソ9"),
+    (REST_CODE, REST_LABEL, REST_LABEL),
+    (UNKNOWN_CODE, UNKNOWN_LABEL, UNKNOWN_LABEL),
+    (128, UNKNOWN_LABEL, UNKNOWN_LABEL),
+]
+
+# (音階, 音高コード)
+LABEL_CODES = [
+    ("ド-1", 0),
+    ("ド#-1", 1),
+    ("ソ9", 127),
+    ("ド4", 60),
+    ("ファ#4", 66),   # ♯つきの音階も受け付ける
+    ("ファ5", 77),
+    (REST_LABEL, REST_CODE),
+    (UNKNOWN_LABEL, UNKNOWN_CODE),
+    ("ファ", UNKNOWN_CODE),  # オクターブのない音階
+    ("ド#", UNKNOWN_CODE),
+    ("ド10", UNKNOWN_CODE),  # 表の範囲外
+    ("ラ-2", UNKNOWN_CODE),
+    ("", UNKNOWN_CODE),
+]
+
+# (周波数, 音高コード)
+HZ_CODES = [
+    (440.0, 69),
+    (float(midi_to_hz(60)) * 2 ** (0.49 / 12), 60),  # 半音の半分未満のずれは同じ音
+    (float(midi_to_hz(60)) * 2 ** (0.51 / 12), 61),
+    (float(midi_to_hz(0)), 0),
+    (float(midi_to_hz(127)), 127),
+    (float(midi_to_hz(-1)), UNKNOWN_CODE),   # 表の範囲外(低すぎる)
+    (float(midi_to_hz(128)), UNKNOWN_CODE),  # 表の範囲外(高すぎる)
+    (np.nan, REST_CODE),
+    (0.0, REST_CODE),
+    (-440.0, REST_CODE),
+]
+
+
+@pytest.mark.parametrize("code, label, sharp_label", CODE_LABELS)
+def test_code_to_label(code, label, sharp_label):
+    assert code_to_label(code) == label
+    assert code_to_label(code, sharps=True) == sharp_label
+
+
+@pytest.mark.parametrize("label, code", LABEL_CODES)
+def test_label_to_code(label, code):
+    assert label_to_code(label) == code
+
+
+@pytest.mark.parametrize("f0, code", HZ_CODES)
+def test_hz_to_codes(f0, code):
+    assert int(hz_to_codes(f0)) == code
+
+
+def test_round_trip_over_the_whole_table():
+    codes = np.arange(128)
+    # ♯を区別した音階なら、どのコードも元に戻る
+    assert [label_to_code(label) for label in codes_to_labels(codes, sharps=True)] == list(codes)
+    # ♯をまとめた音階では、♯の音は1つ下の音に戻る
+    naturals = [label_to_code(label) for label in codes_to_labels(codes)]
+    assert all(natural in (code, code - 1) for code, natural in zip(codes, naturals))
+    assert [code_to_label(code) for code in naturals] == codes_to_labels(codes)
+    # 周波数にしてから戻しても同じコード
+    assert list(hz_to_codes(midi_to_hz(codes))) == list(codes)
+
+
+def test_hz_to_codes_keeps_the_array_shape():
+    f0 = np.array([[440.0, np.nan], [0.0, 1e6]])
+    assert hz_to_codes(f0).tolist() == [[69, REST_CODE], [REST_CODE, UNKNOWN_CODE]]
+
+
+@pytest.mark.parametrize("name, midi", [("C-1", 0), ("G9", 127), ("A4", 69), ("F#4", 66), ("Bb5", 82), ("C♯2", 37)])
+def test_note_to_midi(name, midi):
+    assert note_to_midi(name) == midi
+
+
+@pytest.mark.parametrize("name", ["", "H4", "C", "F#", "C4x"])
+def test_note_to_midi_rejects_unknown_names(name):
+    with pytest.raises(ValueError):
+        note_to_midi(name)
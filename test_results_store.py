@@ -0,0 +1,27 @@
+from results_store import ResultsStore, new_session_id
+
+# 結果ストアの演奏IDと、書き込みに失敗したときの書き込みスレッドの動き
+
+
+def test_session_ids_are_unique_within_a_second():
+    ids = {new_session_id("realtime") for _ in range(100)}
+    assert len(ids) == 100
+
+
+def test_failed_batch_does_not_stop_the_writer(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"), flush_interval=0.01)
+    try:
+        # 列の数が合わない行は書き込みに失敗する
+        store.queue.put(("measure", ("壊れた行",)))
+        assert store.flush(timeout=5.0)
+        assert store.failed == 1
+        assert store.writer.is_alive()
+
+        session_id = new_session_id("test")
+        store.start_session(session_id)
+        store.save_measure(session_id, 0, ["ド4", "レ4"])
+        assert store.flush(timeout=5.0)
+        assert store.measure(session_id, 0) == ["ド4", "レ4"]
+    finally:
+        store.close(timeout=5.0)
+    assert not store.writer.is_alive()
@@ -0,0 +1,90 @@
+import json
+import os
+
+import pytest
+
+from score_follower import OnlineScoreFollower
+
+# 楽譜追従(OnlineScoreFollower)が弾き逃し・余分な音・テンポの揺れ・演奏前の無音をどう扱うかを固定しておく
+# 既定の band / skip_penalty / extra_penalty を変えてこれらが変わったら、ここで気づけるようにする
+# 同梱の正解(doremi_notes_list.json)は同じ音が続くところが多いので、音ごとの位置はずれることがある。全体の正解率と位置のずれの大きさで確かめる
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(current_dir, "doremi_notes_list.json"), encoding="utf-8") as f:
+    REFERENCE = json.load(f)
+
+# 同じ音が続かない音階(位置が一意に決まる)
+SCALE = ["ド4", "レ4", "ミ4", "ファ4", "ソ4", "ラ4", "シ4", "ド5", "レ5", "ミ5", "ファ5", "ソ5", "ラ5", "シ5", "ド6", "レ6"]
+
+
+def follow(reference, notes):
+    follower = OnlineScoreFollower(reference)
+    return follower, [follower.update(note) for note in notes]
+
+
+def test_exact_performance():
+    follower, results = follow(REFERENCE, REFERENCE)
+    assert [result.position for result in results] == list(range(len(REFERENCE)))
+    assert all(result.correct and result.drift == 0.0 for result in results)
+    assert follower.accuracy() == 1.0
+    assert follower.aligned_notes() == REFERENCE
+
+
+def test_skipped_notes_on_a_scale():
+    # 4つ目の音(ファ4)を弾き逃しても、次の音から楽譜どおりの位置に戻る
+    played = [k for k in range(len(SCALE)) if k != 3]
+    follower, results = follow(SCALE, [SCALE[k] for k in played])
+    assert [result.position for result in results] == played
+    assert not follower.correct[3]
+    assert follower.accuracy() == pytest.approx(15 / 16)
+
+
+def test_every_third_note_skipped():
+    played = [k for k in range(len(REFERENCE)) if k % 3 != 2]
+    follower, results = follow(REFERENCE, [REFERENCE[k] for k in played])
+    # 楽譜の最後まで追従し、位置のずれは3音以内
+    assert follower.position >= len(REFERENCE) - 4
+    assert max(abs(result.position - k) for result, k in zip(results, played)) <= 3
+    # 弾いた音は 2/3 だが、同じ音が続くところで前後の位置に割り当てられる分だけ下がる
+    assert follower.accuracy() == pytest.approx(0.641, abs=0.01)
+
+
+def test_extra_notes():
+    # 4音ごとに楽譜にない音(シ6)を挟む
+    notes = []
+    for k, note in enumerate(REFERENCE):
+        notes.append(note)
+        if k % 4 == 3:
+            notes.append("シ6")
+    follower, results = follow(REFERENCE, notes)
+    assert follower.position == len(REFERENCE) - 1
+    # 余分な音では楽譜の位置は1つまでしか進まない
+    positions = [result.position for result in results]
+    assert all(0 <= b - a <= 1 for a, b, note in zip(positions, positions[1:], notes[1:]) if note == "シ6")
+    # 余分な音がのった位置は不正解になる
+    assert follower.accuracy() == pytest.approx(0.803, abs=0.01)
+
+
+def test_stretched_tempo():
+    # 楽譜の半分の速さ(1つの音を2回ずつ検出する)
+    notes = [note for note in REFERENCE for _ in range(2)]
+    follower, results = follow(REFERENCE, notes)
+    assert follower.position == len(REFERENCE) - 1
+    assert follower.accuracy() == 1.0
+    assert max(abs(result.position - k // 2) for k, result in enumerate(results)) <= 4
+    # 遅れているので、テンポのずれは負になる
+    assert results[-1].drift < -0.25
+
+
+def test_lead_in_silence():
+    # 最初の音が来るまでは追従を始めない
+    follower, results = follow(REFERENCE, ["休符"] * 10 + ["不明"] * 3 + REFERENCE)
+    assert results[:13] == [None] * 13
+    assert [result.position for result in results[13:]] == list(range(len(REFERENCE)))
+    assert follower.accuracy() == 1.0
+
+
+def test_not_started_without_first_note():
+    follower, results = follow(REFERENCE, ["休符"] * 5)
+    assert results == [None] * 5
+    assert not follower.started and follower.accuracy() == 0.0
@@ -0,0 +1,66 @@
+import math
+
+# BPM・拍子・細分(八分音符なら8)から、解析の窓の長さとホップ(ブロック)の長さを計算するタイミングモデル
+# ホップは遅延を、窓は精度を決めるので、hops_per_note と window_notes で別々に調整できる
+#   hops_per_note: 1音(八分音符)あたりのホップ数(大きいほど遅延が小さい)
+#   window_notes: 窓の長さ(音符何個分か。1なら八分音符1つ分の音声で音階を判定する)
+
+DEFAULT_BPM = 110
+
+
+class TimingModel:
+    def __init__(self, bpm=DEFAULT_BPM, time_signature=(4, 4), subdivision=8, hops_per_note=2, window_notes=1.0, sr=22050):
+        self.bpm = bpm
+        self.time_signature = tuple(time_signature)
+        self.subdivision = subdivision
+        self.hops_per_note = hops_per_note
+        self.window_notes = window_notes
+        self.sr = sr
+
+    # 楽譜の BPM と拍子を使う(楽譜に BPM がなければ bpm を使う)
+    @classmethod
+    def from_score(cls, score_index, bpm=DEFAULT_BPM, **kwargs):
+        if score_index.bpm is not None and math.isfinite(score_index.bpm):
+            bpm = score_index.bpm
+        return cls(bpm=bpm, time_signature=score_index.time_signature, **kwargs)
+
+    # 1音(八分音符など)の秒数(4分音符は 60 / BPM 秒)
+    @property
+    def note_seconds(self):
+        return 60.0 / self.bpm * 4 / self.subdivision
+
+    # 1小節の音符の数(4/4拍子の八分音符なら8)
+    @property
+    def notes_per_measure(self):
+        numerator, denominator = self.time_signature
+        return int(round(numerator * self.subdivision / denominator))
+
+    # ホップの秒数とサンプル数(オーディオコールバックのブロックサイズ)
+    @property
+    def hop_seconds(self):
+        return self.note_seconds / self.hops_per_note
+
+    @property
+    def hop_size(self):
+        return int(self.sr * self.hop_seconds)
+
+    # 解析の窓の秒数とサンプル数
+    @property
+    def window_seconds(self):
+        return self.note_seconds * self.window_notes
+
+    @property
+    def window_size(self):
+        return int(self.sr * self.window_seconds)
+
+    def __repr__(self):
+        return (f"TimingModel(bpm={self.bpm}, time_signature={self.time_signature[0]}/{self.time_signature[1]}, "
+                f"note={self.note_seconds:.3f}s, hop={self.hop_size}, window={self.window_size})")
+
+
+# 正解ファイルに合わせたタイミングモデルを作る(楽譜ファイルなら楽譜の BPM と拍子を使う)
+def load_timing(reference_path, bpm=DEFAULT_BPM, **kwargs):
+    if reference_path.endswith(".json"):
+        return TimingModel(bpm=bpm, **kwargs)
+    from score_index import score_library
+    return TimingModel.from_score(score_library.get(reference_path), bpm=bpm, **kwargs)
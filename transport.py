@@ -0,0 +1,264 @@
+import asyncio
+import threading
+
+# Unityへの送信を別スレッドの asyncio ループで行う送信レイヤー
+# 解析スレッドからは send() / send_event() でキューに積むだけで、接続待ちや送信でブロックしない
+#   - 送信キューには上限があり、溢れたときの動作を drop_policy で選べる
+#       "drop_oldest": 一番古いメッセージを捨てる, "drop_newest": 新しいメッセージを捨てる, "block": 空くまで呼び出し元を待たせる
+#   - send() で送る全体の状態(スナップショット)は、送信待ちの間に同じ key の新しいものが来たら最新のものだけを送る
+#   - send_event() で送るイベントは batch_interval 秒の間にまとめて1回で送る(bytes のイベントは連結する)
+#   - 接続が切れたら、キャプチャを止めずに裏で再接続し、key ごとの最後のスナップショットを送り直して状態を揃える
+
+SNAPSHOT = "snapshot"
+EVENT = "event"
+DROP_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+# いつ戻るかわからないブロッキング関数をデーモンスレッドで実行し、asyncio で待てるようにする
+# (asyncio.to_thread のスレッドは終了時に join されるので、接続待ちのままだとプロセスが終われない)
+def run_in_daemon_thread(loop, func, *args):
+    future = loop.create_future()
+
+    def resolve(callback):
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass  # ループがすでに閉じられている
+
+    def target():
+        try:
+            result = func(*args)
+        except Exception as e:
+            # except を抜けると e は消えるので、コールバックには引数で渡す
+            resolve(lambda error=e: future.done() or future.set_exception(error))
+        else:
+            resolve(lambda: future.done() or future.set_result(result))
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+class UnityTransport:
+    # connector_factory(on_timeout, on_stopped) は UnityConnector と同じ start_listening() と send() を持つオブジェクトを返す
+    def __init__(self, connector_factory, data_type="test", max_queue=256, batch_size=32, batch_interval=0.05,
+                 drop_policy="drop_oldest", reconnect_interval=1.0, max_reconnect_interval=10.0, on_data_received=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"不明な drop_policy です: {drop_policy} (選択肢: {', '.join(DROP_POLICIES)})")
+        self.connector_factory = connector_factory
+        self.data_type = data_type
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.drop_policy = drop_policy
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.on_data_received = on_data_received or (lambda data_type, data: None)
+
+        self.connector = None
+        self.pending_connector = None  # 接続待ちの connector
+        self.last_snapshots = {}  # key -> 最後に送ったスナップショット
+        self.loop = None
+        self.queue = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.connected = threading.Event()
+        self.closing = False
+
+        # 送信の統計
+        self.sent = 0
+        self.batches = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.reconnects = 0
+        self.errors = 0
+
+    # 送信スレッドを起動する(接続は裏で行うので、ここではUnityを待たない)
+    def start(self):
+        if self.thread is not None:
+            return self
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.sender_task = self.loop.create_task(self.sender())
+        self.connect_task = self.loop.create_task(self.ensure_connected())
+        self.ready.set()
+        self.loop.run_until_complete(self.sender_task)
+        self.connect_task.cancel()
+        self.loop.run_until_complete(asyncio.gather(self.connect_task, return_exceptions=True))
+        self.loop.close()
+
+    # 送信キューの深さ
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def stats(self):
+        return {
+            "connected": self.connected.is_set(),
+            "queue_depth": self.queue_depth(),
+            "sent": self.sent,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "reconnects": self.reconnects,
+            "errors": self.errors,
+        }
+
+    # 全体の状態を送る(送信待ちの同じ key の古いスナップショットは新しいものに置き換わる)
+    def send(self, data, key="state"):
+        self.put((SNAPSHOT, (key, data)))
+
+    # 1つのイベントを送る(他のイベントとまとめて送られる)
+    def send_event(self, event):
+        self.put((EVENT, event))
+
+    # どのスレッドからでも呼べる: 送信キューに積む
+    def put(self, item):
+        if self.thread is None:
+            self.start()
+        if self.drop_policy == "block":
+            # キューが空くまで呼び出し元を待たせる(バックプレッシャー)
+            asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+        else:
+            self.loop.call_soon_threadsafe(self.enqueue, item)
+
+    def enqueue(self, item):
+        if self.queue.full():
+            self.dropped += 1
+            if item is None:
+                # 停止の合図は必ず積む
+                self.queue.get_nowait()
+                self.queue.put_nowait(item)
+                return
+            if self.drop_policy == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+
+    # Unityと接続する(つながるまで間隔を伸ばしながら再試行する)
+    async def ensure_connected(self):
+        interval = self.reconnect_interval
+        while self.connector is None and not self.closing:
+            try:
+                print("connecting...")
+                connector = self.connector_factory(self.handle_disconnect, self.handle_disconnect)
+                self.pending_connector = connector
+                # start_listening はUnityがつながるまで戻らないので、別スレッドで待つ
+                await run_in_daemon_thread(self.loop, connector.start_listening, self.on_data_received)
+                self.pending_connector = None
+                if self.closing:
+                    break
+                self.connector = connector
+                self.connected.set()
+                print("connected")
+                # 再接続したクライアントが状態を取り戻せるように、最後のスナップショットを送り直す
+                if self.reconnects > 0:
+                    for snapshot in list(self.last_snapshots.values()):
+                        await self.deliver(snapshot)
+            except Exception as e:
+                self.pending_connector = None
+                if self.closing:
+                    break
+                self.errors += 1
+                print(f"Unityとの接続に失敗しました: {e} ({interval:.1f}秒後に再接続します)")
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_reconnect_interval)
+
+    # タイムアウトや停止命令で接続が切れたとき(UnityConnector のスレッドから呼ばれる)
+    def handle_disconnect(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.reconnect)
+
+    def reconnect(self):
+        if self.connector is None:
+            return
+        self.connector = None
+        self.connected.clear()
+        self.reconnects += 1
+        if not self.closing:
+            self.connect_task = self.loop.create_task(self.ensure_connected())
+
+    # キューから取り出したメッセージをまとめる
+    # スナップショットは key ごとに最新の1つだけ、イベントは1つにまとめる
+    def coalesce(self, batch):
+        snapshots = {}
+        events = []
+        for kind, data in batch:
+            if kind == SNAPSHOT:
+                key, snapshot = data
+                if key in snapshots:
+                    self.coalesced += 1
+                snapshots[key] = snapshot
+            else:
+                events.append(data)
+        payloads = []
+        if events:
+            if all(isinstance(event, bytes) for event in events):
+                payloads.append(b"".join(events))
+            else:
+                payloads.append({"events": events})
+        self.last_snapshots.update(snapshots)
+        payloads.extend(snapshots.values())
+        return payloads
+
+    async def sender(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            # batch_interval 秒の間に届いたメッセージをまとめる
+            batch = [item]
+            closing = False
+            deadline = self.loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+
+            for payload in self.coalesce(batch):
+                await self.deliver(payload)
+            self.batches += 1
+            if closing:
+                break
+
+    # 1つのメッセージを送る(接続が切れていたら、つながるまで待ってから送る)
+    async def deliver(self, payload):
+        while True:
+            while self.connector is None:
+                if self.closing and not self.connected.is_set() and self.connect_task.done():
+                    self.dropped += 1
+                    return
+                await asyncio.sleep(0.05)
+            try:
+                await asyncio.to_thread(self.connector.send, self.data_type, payload)
+                self.sent += 1
+                return
+            except Exception as e:
+                self.errors += 1
+                print(f"Unityへの送信に失敗しました: {e}")
+                self.reconnect()
+
+    # 送信待ちのメッセージを送りきってから止める(timeout 秒を過ぎたら諦める)
+    def close(self, timeout=5.0):
+        if self.thread is None:
+            return
+        self.closing = True
+        self.loop.call_soon_threadsafe(self.enqueue, None)
+        self.thread.join(timeout)
+        # 接続待ちのままなら待ち受けをやめる(close() を持つ connector のみ)
+        for connector in (self.pending_connector, self.connector):
+            if connector is not None and hasattr(connector, "close"):
+                connector.close()